@@ -0,0 +1,4 @@
+"""
+Benchmark suite of the simulator, the GNN parser and policy, the LP solvers, the MPC baseline and training,
+see benchmarks/run.py.
+"""
@@ -0,0 +1,176 @@
+"""
+Benchmark Fixtures
+------------------
+This file contains the shared parts of the benchmark suite. In particular, we implement:
+(1) SCENARIOS / create_scenario
+    The bundled scenarios (Toy: scenario_test_3_2.json, NY_5: NY_5.json) and the Scenario construction of main.py.
+(2) measure / result
+    Wall-clock timing of repeated calls (an untimed setup may run before every call) and the JSON result rows
+    with min / median / mean / p95 / std in ms.
+(3) BenchContext
+    Per-scenario fixture: compiled scenario, seeded environment, solver settings and one recorded reference
+    episode (snapshots, matching flows, desired accumulations and rebalancing flows of every step) that the
+    step and solver benchmarks replay, so every run times the same states.
+(4) metadata
+    Commit, library versions and machine of a run, stored next to the results to compare runs across commits.
+"""
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+from collections import namedtuple
+import numpy as np
+import torch
+
+from src.envs.amod_env import Scenario, AMoD
+from src.envs.scenario_cache import load_or_create_scenario
+from src.algos.a2c_gnn import A2C
+from src.algos.pax_flows_solver import make_pax_flows_solver
+from src.algos.min_cost_flow import make_rebal_flow_solver
+from src.misc.utils import desired_acc_from_action
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = {
+    'Toy': (os.path.join(ROOT, 'data', 'Toy', 'scenario_test_3_2.json'), os.path.join(ROOT, 'data', 'Toy', 'energy_distance_3x2.npy')),
+    'NY_5': (os.path.join(ROOT, 'data', 'NY_5', 'NY_5.json'), os.path.join(ROOT, 'data', 'NY_5', 'energy_distance.npy')),
+}
+
+Step = namedtuple('Step', ['snapshot', 'pax_action', 'desired_acc', 'reb_action'])
+
+
+def create_scenario(json_file_path, energy_file_path, seed=10):
+    f = open(json_file_path)
+    energy_dist = np.load(energy_file_path)
+    data = json.load(f)
+    scenario = Scenario(spatial_nodes=data['spatialNodes'], charging_stations=data['chargeLocations'], cars_per_station_capacity=data['carsPerStationCapacity'],
+                        number_charge_levels=data['chargelevels'], charge_levels_per_charge_step=data['chargeLevelsPerChargeStep'],
+                        energy_distance=energy_dist, tf=data['episodeLength'], sd=seed, tripAttr=data['demand'], demand_ratio=1,
+                        reb_time=data['rebTime'], total_acc=data['totalAcc'], p_energy=data["energy_prices"],
+                        time_granularity=data["timeGranularity"], operational_cost_per_timestep=data['operationalCostPerTimestep'])
+    return scenario
+
+
+def quiet(fn, *args, **kwargs):
+    # Scenario construction and some solvers print progress
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def measure(fn, repeat, setup=None, warmup=1):
+    """
+    Calls fn() warmup + repeat times (setup() untimed before each call) and returns the repeat timings in ms.
+    """
+    timings = []
+    for k in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        t_start = time.perf_counter()
+        fn()
+        if k >= warmup:
+            timings.append(1000 * (time.perf_counter() - t_start))
+    return timings
+
+
+def result(name, scenario, timings, **params):
+    """
+    JSON row of one benchmark: its name, scenario, parameters and timing statistics in ms.
+    """
+    timings = np.asarray(timings, dtype=float)
+    return dict(name=name, scenario=scenario, params=params, repeat=len(timings), min_ms=timings.min(),
+                median_ms=np.median(timings), mean_ms=timings.mean(), p95_ms=np.percentile(timings, 95), std_ms=timings.std())
+
+
+def skipped(name, scenario, reason, **params):
+    return dict(name=name, scenario=scenario, params=params, repeat=0, skipped=reason)
+
+
+class BenchContext:
+    """
+    Fixture of one scenario. scale multiplies the default repeat counts of the benchmarks; lp_backend and
+    gurobi_env are used by all LP solvers (gurobi_env is None for the highs backend).
+    """
+
+    def __init__(self, name, scale=1., lp_backend='gurobi', gurobi_env=None, seed=10, model_kwargs=None):
+        self.name = name
+        self.json_file_path, self.energy_file_path = SCENARIOS[name]
+        self.scale = scale
+        self.lp_backend = lp_backend
+        self.gurobi_env = gurobi_env
+        self.seed = seed
+        self.model_kwargs = dict(T=10, scale_factor=0.01, scale_price=0.1) if model_kwargs is None else model_kwargs
+        self.scenario = quiet(load_or_create_scenario, create_scenario, self.json_file_path, self.energy_file_path)
+        self._episode = None
+
+    def repeat(self, n):
+        return max(1, int(round(n * self.scale)))
+
+    def make_env(self):
+        return AMoD(self.scenario, seed=self.seed)
+
+    def make_model(self, env):
+        return A2C(env=env, seed=self.seed, **self.model_kwargs)
+
+    def episode(self):
+        """
+        Reference episode on the scenario demand: LP matching, rebalancing towards the Dirichlet mean of a freshly
+        seeded policy. Returns the environment (reset to the start of the episode) and one Step per time step.
+        """
+        if self._episode is None:
+            env = self.make_env()
+            model = self.make_model(env)
+            env.reset(False)
+            steps = []
+            pax_flows_solver = None
+            rebal_flow_solver = None
+            for step in range(env.tf):
+                snapshot = env.snapshot()
+                if pax_flows_solver is None:
+                    pax_flows_solver = make_pax_flows_solver('lp', env, self.gurobi_env, self.lp_backend)
+                else:
+                    pax_flows_solver.update_constraints()
+                    pax_flows_solver.update_objective()
+                pax_action = pax_flows_solver.optimize()
+                env.pax_step(paxAction=pax_action)
+                desired_acc = desired_acc_from_action(env, model.select_action_MPNN(eval_mode=True))
+                if rebal_flow_solver is None:
+                    rebal_flow_solver = make_rebal_flow_solver('lp', env, desired_acc, self.gurobi_env, self.lp_backend)
+                else:
+                    rebal_flow_solver.update_constraints(desired_acc, env)
+                    rebal_flow_solver.update_objective(env)
+                reb_action = rebal_flow_solver.optimize()
+                _, _, done, _ = env.reb_step(reb_action)
+                steps.append(Step(snapshot, pax_action, desired_acc, reb_action))
+                if done:
+                    break
+            env.restore(steps[0].snapshot)
+            self._episode = (env, steps)
+        return self._episode
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        return commit, bool(dirty)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def metadata():
+    commit, dirty = git_commit()
+    versions = dict(python=platform.python_version(), numpy=np.__version__, torch=torch.__version__)
+    try:
+        import gurobipy as gp
+        versions['gurobi'] = '.'.join(str(v) for v in gp.gurobi.version())
+    except ImportError:
+        pass
+    try:
+        import scipy
+        versions['scipy'] = scipy.__version__
+    except ImportError:
+        pass
+    return dict(commit=commit, dirty=dirty, date=time.strftime('%Y-%m-%dT%H:%M:%S'), versions=versions, machine=platform.machine(),
+                processor=platform.processor(), platform=platform.platform(), cpu_count=os.cpu_count(), torch_threads=torch.get_num_threads())
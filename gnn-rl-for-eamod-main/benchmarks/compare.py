@@ -0,0 +1,60 @@
+"""
+Benchmark Comparison
+--------------------
+Compares two result files of benchmarks/run.py row by row (same name, scenario and parameters) on the median
+time and flags the rows that got slower than the threshold. Exits with status 1 if any did.
+
+Example (from the repository root):
+    python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/new.json --threshold 1.1
+"""
+import argparse
+import json
+
+
+def row_key(row):
+    return row['name'], row['scenario'], json.dumps(row['params'], sort_keys=True)
+
+
+def compare(base, new, threshold=1.1):
+    """
+    Returns (name, scenario, params, base median, new median, ratio, regressed) for every row timed in both runs.
+    """
+    base_rows = {row_key(row): row for row in base['results'] if 'skipped' not in row}
+    rows = []
+    for row in new['results']:
+        key = row_key(row)
+        if 'skipped' in row or key not in base_rows:
+            continue
+        base_ms, new_ms = base_rows[key]['median_ms'], row['median_ms']
+        ratio = new_ms / base_ms if base_ms > 0 else float('inf')
+        rows.append((row['name'], row['scenario'], row['params'], base_ms, new_ms, ratio, ratio > threshold))
+    return rows
+
+
+def print_table(rows):
+    header = ['scenario', 'benchmark', 'params', 'base ms', 'new ms', 'ratio', '']
+    lines = [header]
+    for name, scenario, params, base_ms, new_ms, ratio, regressed in rows:
+        lines.append([scenario, name, ' '.join(f"{key}={value}" for key, value in params.items()), f"{base_ms:.3f}", f"{new_ms:.3f}",
+                      f"{ratio:.2f}", 'slower' if regressed else ''])
+    widths = [max(len(line[k]) for line in lines) for k in range(len(header))]
+    for line in lines:
+        print('  '.join(value.ljust(width) if k < 3 else value.rjust(width) for k, (value, width) in enumerate(zip(line, widths))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares two benchmark result files')
+    parser.add_argument('base', type=str, help='result json of the reference run')
+    parser.add_argument('new', type=str, help='result json of the run to check')
+    parser.add_argument('--threshold', type=float, default=1.1, metavar='F',
+                        help='median time ratio new / base above which a benchmark counts as slower (default: 1.1)')
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"base: {base['meta']['commit']}  new: {new['meta']['commit']}")
+    rows = compare(base, new, args.threshold)
+    print_table(rows)
+    raise SystemExit(int(any(row[-1] for row in rows)))
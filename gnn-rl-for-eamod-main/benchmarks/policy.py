@@ -0,0 +1,91 @@
+"""
+Policy Benchmarks
+-----------------
+GNNParser.parse_obs, the actor / critic forward of one observation, forward + backward of both networks on
+a batch of observations (one step, and all steps of an episode as in A2C.training_step) and training_step.
+"""
+import torch
+from torch.distributions import Dirichlet
+
+from benchmarks.common import measure, result
+
+
+def observations(ctx):
+    """
+    Parsed observations [tf, N, input_size] of the reference episode, the environment and a fresh policy.
+    """
+    env, steps = ctx.episode()
+    model = ctx.make_model(env)
+    x = []
+    for step in steps:
+        env.restore(step.snapshot)
+        x.append(model.parse_obs().x)
+    env.restore(steps[0].snapshot)
+    return env, model, torch.stack(x)
+
+
+def bench_parse_obs(ctx):
+    env, model, _ = observations(ctx)
+    timings = measure(model.parse_obs, ctx.repeat(500))
+    return [result('parser.parse_obs', ctx.name, timings)]
+
+
+def bench_forward(ctx):
+    env, model, _ = observations(ctx)
+    data = model.parse_obs()
+
+    def actor():
+        with torch.no_grad():
+            model.actor(data.x, data.edge_index, data.edge_attr)
+
+    def critic():
+        with torch.no_grad():
+            model.critic(data.x, data.edge_index, data.edge_attr)
+
+    return [result('policy.actor_forward', ctx.name, measure(actor, ctx.repeat(500))),
+            result('policy.critic_forward', ctx.name, measure(critic, ctx.repeat(500)))]
+
+
+def bench_forward_backward(ctx):
+    env, model, x = observations(ctx)
+    results = []
+    for batch_size in (1, len(x)):
+        batch = x[:batch_size]
+        torch.manual_seed(ctx.seed)
+        with torch.no_grad():
+            actions = Dirichlet(concentration=model.forward_batch(batch)[0]).sample()
+
+        def forward_backward():
+            concentration, values = model.forward_batch(batch)
+            loss = -Dirichlet(concentration=concentration).log_prob(actions).sum() + values.pow(2).sum()
+            model.zero_grad()
+            loss.backward()
+
+        results.append(result('policy.forward_backward', ctx.name, measure(forward_backward, ctx.repeat(100)), batch_size=batch_size))
+    return results
+
+
+def bench_training_step(ctx):
+    env, model, x = observations(ctx)
+    torch.manual_seed(ctx.seed)
+    with torch.no_grad():
+        actions = Dirichlet(concentration=model.forward_batch(x)[0]).sample()
+    rewards = torch.linspace(1., 2., len(x))
+
+    def fill_buffer():
+        model.buffer.clear()
+        model.add_trajectory(x, actions, rewards)
+        # concentration statistics of the GCN select_action, averaged by training_step
+        model.means_concentration = [1.]
+        model.std_concentration = [0.]
+
+    timings = measure(model.training_step, ctx.repeat(100), setup=fill_buffer)
+    return [result('policy.training_step', ctx.name, timings, steps=len(x))]
+
+
+BENCHMARKS = [
+    ('parser.parse_obs', bench_parse_obs),
+    ('policy.forward', bench_forward),
+    ('policy.forward_backward', bench_forward_backward),
+    ('policy.training_step', bench_training_step),
+]
@@ -0,0 +1,94 @@
+"""
+Benchmark Runner
+----------------
+Runs the benchmark suite on the bundled scenarios and writes the results as JSON:
+    {"meta": {commit, dirty, date, versions, machine, ..., args}, "results": [{name, scenario, params, repeat,
+     min_ms, median_ms, mean_ms, p95_ms, std_ms}, ...]}
+Benchmarks that cannot run in the current setup (e.g. MPC horizons beyond the size limit of a restricted Gurobi
+license) are reported with a "skipped" reason instead of timings. NumPy / torch are seeded and torch and Gurobi run
+single-threaded, so runs on different commits time the same work; compare them with benchmarks/compare.py.
+
+Example (from the repository root):
+    python -m benchmarks.run --scenarios Toy NY_5 --output benchmarks/results/$(git rev-parse --short HEAD).json
+    python -m benchmarks.run --scenarios Toy --only env. parser. --scale 0.2
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+import torch
+
+from src.algos.lp_backend import LP_BACKENDS, make_gurobi_env
+from benchmarks.common import SCENARIOS, BenchContext, metadata
+from benchmarks import simulator, policy, solvers, training
+
+BENCHMARKS = simulator.BENCHMARKS + policy.BENCHMARKS + solvers.BENCHMARKS + training.BENCHMARKS
+
+
+def selected(name, only):
+    return only is None or any(name.startswith(prefix) for prefix in only)
+
+
+def run_benchmarks(scenarios, only=None, scale=1., lp_backend='gurobi', gurobi_params=None, seed=10, verbose=True):
+    """
+    Runs every benchmark whose name starts with one of the prefixes in only (all by default) on every scenario
+    and returns the result rows.
+    """
+    gurobi_env = make_gurobi_env(dict(gurobi_params or {}, Threads=1)) if lp_backend == 'gurobi' else None
+    results = []
+    for scenario in scenarios:
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        ctx = BenchContext(scenario, scale, lp_backend, gurobi_env, seed)
+        for name, bench in BENCHMARKS:
+            if not selected(name, only):
+                continue
+            t_start = time.time()
+            rows = bench(ctx)
+            results += rows
+            if verbose:
+                for row in rows:
+                    params = ' '.join(f"{key}={value}" for key, value in row['params'].items())
+                    timing = f"skipped: {row['skipped']}" if 'skipped' in row else f"median {row['median_ms']:.3f} ms  p95 {row['p95_ms']:.3f} ms  (n={row['repeat']})"
+                    print(f"{scenario:>5}  {row['name']:<24} {params:<40} {timing}")
+                print(f"{'':>5}  {name} done in {time.time() - t_start:.1f} s")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AMoD benchmark suite')
+    parser.add_argument('--scenarios', type=str, nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS),
+                        help='bundled scenarios to run on (default: all)')
+    parser.add_argument('--only', type=str, nargs='+', default=None,
+                        help='name prefixes of the benchmarks to run, e.g. env. solver.pax mpc (default: all)')
+    parser.add_argument('--scale', type=float, default=1., metavar='F',
+                        help='multiplies the repeat count of every benchmark (default: 1)')
+    parser.add_argument('--lp_backend', type=str, default='gurobi', choices=LP_BACKENDS,
+                        help='LP solver of the matching and rebalancing steps (default: gurobi)')
+    parser.add_argument('--seed', type=int, default=10, metavar='S',
+                        help='random seed (default: 10)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='json file for the results (default: print to stdout)')
+    parser.add_argument('--list', action='store_true',
+                        help='lists the benchmark names and exits')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, _ in BENCHMARKS:
+            print(name)
+        raise SystemExit
+
+    torch.set_num_threads(1)
+    # the local Gurobi license, a license server would add its checkout latency to the build timings
+    gurobi_params = {'OutputFlag': 0}
+    results = run_benchmarks(args.scenarios, args.only, args.scale, args.lp_backend, gurobi_params, args.seed, verbose=args.output is not None)
+    report = dict(meta=dict(metadata(), args=vars(args)), results=results)
+    text = json.dumps(report, indent=1, default=float)
+    if args.output is None:
+        print(text)
+    else:
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
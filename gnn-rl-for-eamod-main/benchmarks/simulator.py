@@ -0,0 +1,53 @@
+"""
+Simulator Benchmarks
+--------------------
+Scenario construction from JSON, loading of the compiled scenario, AMoD.reset and the pax_step / reb_step
+transitions, the latter replayed with the flows of the reference episode.
+"""
+import os
+import tempfile
+
+from src.envs.scenario_cache import compile_scenario, load_compiled_scenario
+from benchmarks.common import create_scenario, measure, quiet, result
+
+
+def bench_scenario_create(ctx):
+    timings = measure(lambda: quiet(create_scenario, ctx.json_file_path, ctx.energy_file_path), ctx.repeat(3), warmup=0)
+    return [result('scenario.create', ctx.name, timings)]
+
+
+def bench_scenario_load_compiled(ctx):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'scenario.npz')
+        compile_scenario(ctx.scenario, path)
+        timings = measure(lambda: load_compiled_scenario(path, restore_random_state=False), ctx.repeat(10))
+    return [result('scenario.load_compiled', ctx.name, timings)]
+
+
+def bench_reset(ctx):
+    env = ctx.make_env()
+    results = []
+    for bool_sample_demand in (True, False):
+        timings = measure(lambda: env.reset(bool_sample_demand), ctx.repeat(200))
+        results.append(result('env.reset', ctx.name, timings, sample_demand=bool_sample_demand))
+    return results
+
+
+def bench_steps(ctx):
+    env, steps = ctx.episode()
+    pax_timings = []
+    reb_timings = []
+    for _ in range(ctx.repeat(10)):
+        env.restore(steps[0].snapshot)
+        for step in steps:
+            pax_timings += measure(lambda: env.pax_step(paxAction=step.pax_action), 1, warmup=0)
+            reb_timings += measure(lambda: env.reb_step(step.reb_action), 1, warmup=0)
+    return [result('env.pax_step', ctx.name, pax_timings), result('env.reb_step', ctx.name, reb_timings)]
+
+
+BENCHMARKS = [
+    ('scenario.create', bench_scenario_create),
+    ('scenario.load_compiled', bench_scenario_load_compiled),
+    ('env.reset', bench_reset),
+    ('env.step', bench_steps),
+]
@@ -0,0 +1,110 @@
+"""
+Solver Benchmarks
+-----------------
+Build and re-solve of the matching (PAX_SOLVERS) and rebalancing (REB_SOLVERS) solvers on the states of the
+reference episode, and build_mpc_model / solve_mpc (build and solve) of the MPC baseline in mpc_baselines/MPC_gurobi.py
+at several horizons.
+"""
+import itertools
+import os
+import sys
+
+from src.algos.pax_flows_solver import PAX_SOLVERS, make_pax_flows_solver
+from src.algos.min_cost_flow import REB_SOLVERS, make_rebal_flow_solver
+from benchmarks.common import ROOT, measure, result, skipped
+
+MPC_HORIZONS = (5, 10, 20)
+
+
+def bench_pax_solvers(ctx):
+    env, steps = ctx.episode()
+    results = []
+    for name in PAX_SOLVERS:
+        env.restore(steps[0].snapshot)
+        timings = measure(lambda: make_pax_flows_solver(name, env, ctx.gurobi_env, ctx.lp_backend), ctx.repeat(20))
+        results.append(result('solver.pax.build', ctx.name, timings, solver=name, lp_backend=ctx.lp_backend))
+        solver = make_pax_flows_solver(name, env, ctx.gurobi_env, ctx.lp_backend)
+        states = itertools.cycle(steps)
+
+        def next_state():
+            env.restore(next(states).snapshot)
+
+        def resolve():
+            solver.update_constraints()
+            solver.update_objective()
+            solver.optimize()
+
+        timings = measure(resolve, ctx.repeat(100), setup=next_state)
+        results.append(result('solver.pax.resolve', ctx.name, timings, solver=name, lp_backend=ctx.lp_backend))
+    env.restore(steps[0].snapshot)
+    return results
+
+
+def bench_reb_solvers(ctx):
+    env, steps = ctx.episode()
+    results = []
+    for name in REB_SOLVERS:
+        # the rebalancing solver runs after the matching step of the same time step
+        env.restore(steps[0].snapshot)
+        env.pax_step(paxAction=steps[0].pax_action)
+        desired_acc = steps[0].desired_acc
+        timings = measure(lambda: make_rebal_flow_solver(name, env, desired_acc, ctx.gurobi_env, ctx.lp_backend), ctx.repeat(20))
+        results.append(result('solver.reb.build', ctx.name, timings, solver=name, lp_backend=ctx.lp_backend))
+        solver = make_rebal_flow_solver(name, env, desired_acc, ctx.gurobi_env, ctx.lp_backend)
+        states = itertools.cycle(steps)
+        current = [steps[0]]
+
+        def next_state():
+            current[0] = next(states)
+            env.restore(current[0].snapshot)
+            env.pax_step(paxAction=current[0].pax_action)
+
+        def resolve():
+            solver.update_constraints(current[0].desired_acc, env)
+            solver.update_objective(env)
+            solver.optimize()
+
+        timings = measure(resolve, ctx.repeat(100), setup=next_state)
+        results.append(result('solver.reb.resolve', ctx.name, timings, solver=name, lp_backend=ctx.lp_backend))
+        if hasattr(solver, 'fallbacks'):
+            # share of the steps the min-cost flow solver handed to the LP
+            results[-1]['lp_fallback_share'] = solver.fallbacks / solver.steps
+    env.restore(steps[0].snapshot)
+    return results
+
+
+def bench_mpc(ctx, horizons=MPC_HORIZONS):
+    # errors of the LP backend that skip a horizon instead of failing the run
+    solver_errors = ()
+    if ctx.lp_backend == 'gurobi':
+        import gurobipy as gp
+        solver_errors = (gp.GurobiError,)
+    mpc_path = os.path.join(ROOT, 'mpc_baselines')
+    if mpc_path not in sys.path:
+        # appended, so `src` still resolves to this repository's simulator
+        sys.path.append(mpc_path)
+    from MPC_gurobi import build_mpc_model, solve_mpc
+
+    env, steps = ctx.episode()
+    env.restore(steps[0].snapshot)
+    results = []
+    for mpc_horizon in sorted(set(min(h, env.tf) for h in horizons)):
+        timings = measure(lambda: build_mpc_model(env, mpc_horizon), ctx.repeat(10))
+        results.append(result('mpc.build_model', ctx.name, timings, mpc_horizon=mpc_horizon))
+        try:
+            timings = measure(lambda: solve_mpc(env, ctx.gurobi_env, mpc_horizon, ctx.lp_backend), ctx.repeat(10))
+        except solver_errors as error:
+            # e.g. the size limit of a restricted license
+            results.append(skipped('mpc.solve_mpc', ctx.name, str(error), mpc_horizon=mpc_horizon, variables=2 * mpc_horizon * len(env.edges),
+                                   lp_backend=ctx.lp_backend))
+            continue
+        results.append(result('mpc.solve_mpc', ctx.name, timings, mpc_horizon=mpc_horizon, variables=2 * mpc_horizon * len(env.edges),
+                              lp_backend=ctx.lp_backend))
+    return results
+
+
+BENCHMARKS = [
+    ('solver.pax', bench_pax_solvers),
+    ('solver.reb', bench_reb_solvers),
+    ('mpc', bench_mpc),
+]
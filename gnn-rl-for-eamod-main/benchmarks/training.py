@@ -0,0 +1,55 @@
+"""
+Training Benchmarks
+-------------------
+One full A2C-GNN training episode as in the sequential loop of main.py: sampled demand, LP matching, Dirichlet
+action of select_action_MPNN, rebalancing, and the training_step at the end of the episode.
+"""
+import warnings
+import torch
+
+from src.algos.pax_flows_solver import make_pax_flows_solver
+from src.algos.min_cost_flow import make_rebal_flow_solver
+from src.misc.utils import desired_acc_from_action
+from benchmarks.common import measure, result
+
+
+def bench_training_episode(ctx, pax_solver='lp', reb_solver='lp'):
+    env = ctx.make_env()
+    model = ctx.make_model(env)
+    torch.manual_seed(ctx.seed)
+    # the solvers are built in the first episode and updated afterwards, like in main.py
+    solvers = {}
+
+    def training_episode():
+        env.reset(True)
+        for step in range(env.tf):
+            if solvers.get('pax') is None:
+                solvers['pax'] = make_pax_flows_solver(pax_solver, env, ctx.gurobi_env, ctx.lp_backend)
+            else:
+                solvers['pax'].update_constraints()
+                solvers['pax'].update_objective()
+            _, paxreward, done, info_pax = env.pax_step(pax_flows_solver=solvers['pax'])
+            action_rl = model.select_action_MPNN()
+            desired_acc = desired_acc_from_action(env, action_rl)
+            if solvers.get('rebal') is None:
+                solvers['rebal'] = make_rebal_flow_solver(reb_solver, env, desired_acc, ctx.gurobi_env, ctx.lp_backend)
+            else:
+                solvers['rebal'].update_constraints(desired_acc, env)
+                solvers['rebal'].update_objective(env)
+            rebAction = solvers['rebal'].optimize()
+            _, rebreward, done, info_reb = env.reb_step(rebAction)
+            model.buffer.add_reward(paxreward + rebreward, done)
+            if done:
+                break
+        with warnings.catch_warnings():
+            # the concentration statistics are only collected by the GCN select_action, their mean is empty here
+            warnings.simplefilter('ignore', RuntimeWarning)
+            model.training_step()
+
+    timings = measure(training_episode, ctx.repeat(10))
+    return [result('training.episode', ctx.name, timings, steps=env.tf, pax_solver=pax_solver, reb_solver=reb_solver, lp_backend=ctx.lp_backend)]
+
+
+BENCHMARKS = [
+    ('training.episode', bench_training_episode),
+]
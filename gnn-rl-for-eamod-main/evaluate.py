@@ -0,0 +1,242 @@
+"""
+Parallel Checkpoint Evaluation
+------------------------------
+This file contains the evaluation runner for trained A2C-GNN checkpoints. In particular, we implement:
+(1) run_eval_episode
+    One episode of the matching step, the GNN rebalancing policy of the checkpoint (greedy: Dirichlet mean as
+    select_action_MPNN(eval_mode=True), stochastic: Dirichlet sample) and the rebalancing step, with the
+    latency of every step.
+(2) run_eval_jobs
+    Fans the (mode, episode, seed) jobs out over a process pool. Every worker loads the checkpoint once; an
+    episode only depends on its seed (demand Generator of the environment and torch sampler are reseeded, the
+    matching / rebalancing solvers are rebuilt) and all solvers run single-threaded, so the results do not depend
+    on the number of workers or on which worker played which episode.
+(3) summarize
+    Mean, standard deviation and 95% confidence interval over the episodes of every mode, plus p50 / p95 step latency.
+
+Example:
+    python evaluate.py --checkpoint saved_files/ckpt/Toy/a2c_gnn.pth --episodes 8 --num_workers 4 --output results_eval.csv
+"""
+import argparse
+import csv
+import json
+import math
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import torch
+from scipy import stats
+
+from src.envs.amod_env import Scenario, AMoD
+from src.envs.scenario_cache import load_or_create_scenario
+from src.algos.a2c_gnn import A2C
+from src.algos.pax_flows_solver import PAX_SOLVERS, make_pax_flows_solver
+from src.algos.min_cost_flow import REB_SOLVERS, make_rebal_flow_solver
+from src.algos.lp_backend import LP_BACKENDS, make_gurobi_env, gurobi_params_from_env
+from src.misc.utils import desired_acc_from_action
+
+MODES = ('greedy', 'stochastic')
+RESULT_FIELDS = ['mode', 'episode', 'seed', 'reward', 'served_demand', 'rebalancing_cost', 'steps', 'step_ms_mean', 'step_ms_p50',
+                 'step_ms_p95', 'episode_s']
+METRICS = ['reward', 'served_demand', 'rebalancing_cost']
+
+# settings of the current worker process stored by init_worker, environment, policy and Gurobi environment built by worker_state
+_env = None
+_model = None
+_gurobi_env = None
+_settings = {}
+
+
+def create_scenario(json_file_path, energy_file_path, seed=10):
+    f = open(json_file_path)
+    energy_dist = np.load(energy_file_path)
+    data = json.load(f)
+    scenario = Scenario(spatial_nodes=data['spatialNodes'], charging_stations=data['chargeLocations'], cars_per_station_capacity=data['carsPerStationCapacity'],
+                        number_charge_levels=data['chargelevels'], charge_levels_per_charge_step=data['chargeLevelsPerChargeStep'],
+                        energy_distance=energy_dist, tf=data['episodeLength'], sd=seed, tripAttr=data['demand'], demand_ratio=1,
+                        reb_time=data['rebTime'], total_acc=data['totalAcc'], p_energy=data["energy_prices"],
+                        time_granularity=data["timeGranularity"], operational_cost_per_timestep=data['operationalCostPerTimestep'])
+    return scenario
+
+
+def init_worker(scenario, checkpoint, model_kwargs, gurobi_params, lp_backend, pax_solver, reb_solver, sample_demand):
+    global _settings
+    # one thread per worker: multi-threaded reductions (torch) and concurrent LP methods (Gurobi) are not reproducible
+    torch.set_num_threads(1)
+    # only stores the settings, errors raised in a Pool initializer make the pool respawn the worker forever
+    _settings = dict(scenario=scenario, checkpoint=checkpoint, model_kwargs=model_kwargs, gurobi_params=gurobi_params,
+                     lp_backend=lp_backend, pax_solver=pax_solver, reb_solver=reb_solver, sample_demand=sample_demand)
+
+
+def worker_state():
+    """
+    Environment, policy and Gurobi environment of the current worker, set up by its first episode.
+    """
+    global _env, _model, _gurobi_env
+    if _model is None:
+        _env = AMoD(_settings['scenario'])
+        model = A2C(env=_env, **_settings['model_kwargs'])
+        model.load_checkpoint(_settings['checkpoint'])
+        if _settings['lp_backend'] == 'gurobi':
+            _gurobi_env = make_gurobi_env(dict(_settings['gurobi_params'] or {}, Threads=1))
+        _model = model
+    return _env, _model, _gurobi_env
+
+
+def run_eval_episode(job):
+    """
+    job = (mode, episode, seed). The demand realization is drawn from seed (the scenario demand is used when the
+    workers run without sample_demand) and stochastic episodes sample their actions from a torch generator seeded
+    with seed as well, so greedy and stochastic episode k see the same demand. Returns one result row and the
+    latencies of all steps in ms.
+    """
+    mode, episode, seed = job
+    t_start = time.time()
+    env, model, gurobi_env = worker_state()
+    env.rng = np.random.default_rng(seed)
+    torch.manual_seed(seed)
+    env.reset(_settings['sample_demand'])
+    # fresh solvers, a warm start from the previous episode of this worker could select another optimal vertex
+    pax_flows_solver = None
+    rebal_flow_solver = None
+    episode_reward = 0
+    episode_served_demand = 0
+    episode_rebalancing_cost = 0
+    step_ms = []
+    for step in range(env.tf):
+        time_i_start = time.perf_counter()
+        # take matching step (Step 1 in paper)
+        if pax_flows_solver is None:
+            pax_flows_solver = make_pax_flows_solver(_settings['pax_solver'], env, gurobi_env, _settings['lp_backend'])
+        else:
+            pax_flows_solver.update_constraints()
+            pax_flows_solver.update_objective()
+        _, paxreward, done, info_pax = env.pax_step(pax_flows_solver=pax_flows_solver)
+        episode_reward += paxreward
+
+        # use GNN-RL policy (Step 2 in paper), without storing the step in the rollout buffer
+        with torch.no_grad():
+            data = model.parse_obs()
+            alpha = model.actor(data.x, data.edge_index, data.edge_attr)[1] + 1e-16
+            if mode == 'greedy':
+                action_rl = alpha / (alpha.sum() + 1e-16)
+            else:
+                action_rl = torch.distributions.Dirichlet(concentration=alpha.view(-1,)).sample()
+        desired_acc = desired_acc_from_action(env, action_rl)
+
+        # solve minimum rebalancing distance problem (Step 3 in paper)
+        if rebal_flow_solver is None:
+            rebal_flow_solver = make_rebal_flow_solver(_settings['reb_solver'], env, desired_acc, gurobi_env, _settings['lp_backend'])
+        else:
+            rebal_flow_solver.update_constraints(desired_acc, env)
+            rebal_flow_solver.update_objective(env)
+        rebAction = rebal_flow_solver.optimize()
+
+        _, rebreward, done, info_reb = env.reb_step(rebAction)
+        step_ms.append(1000 * (time.perf_counter() - time_i_start))
+        episode_reward += rebreward
+        episode_served_demand += info_pax['served_demand']
+        episode_rebalancing_cost += info_reb['rebalancing_cost']
+        if done:
+            break
+    step_ms = np.array(step_ms)
+    row = dict(mode=mode, episode=episode, seed=seed, reward=episode_reward, served_demand=episode_served_demand,
+               rebalancing_cost=episode_rebalancing_cost, steps=len(step_ms), step_ms_mean=step_ms.mean(),
+               step_ms_p50=np.percentile(step_ms, 50), step_ms_p95=np.percentile(step_ms, 95), episode_s=time.time() - t_start)
+    return row, step_ms
+
+
+def run_eval_jobs(jobs, scenario, checkpoint, model_kwargs, gurobi_params=None, lp_backend='gurobi', pax_solver='lp', reb_solver='lp',
+                  sample_demand=True, num_workers=1, start_method='fork'):
+    """
+    Runs all jobs on num_workers processes and returns the result rows and step latencies in job order.
+    """
+    ctx = mp.get_context(start_method)
+    initargs = (scenario, checkpoint, model_kwargs, gurobi_params, lp_backend, pax_solver, reb_solver, sample_demand)
+    with ctx.Pool(num_workers, initializer=init_worker, initargs=initargs) as pool:
+        results = pool.map(run_eval_episode, jobs, chunksize=1)
+    return [row for row, _ in results], [step_ms for _, step_ms in results]
+
+
+def summarize(rows, step_ms, confidence=0.95):
+    """
+    One row per mode with mean, std and the half-width of the Student-t confidence interval of the mean of every
+    metric over the episodes, and the p50 / p95 latency over all steps of the mode.
+    """
+    summary = []
+    for mode in MODES:
+        group = [k for k, row in enumerate(rows) if row['mode'] == mode]
+        if len(group) == 0:
+            continue
+        n = len(group)
+        entry = dict(mode=mode, episodes=n)
+        for metric in METRICS:
+            values = np.array([rows[k][metric] for k in group], dtype=float)
+            std = values.std(ddof=1) if n > 1 else 0.
+            entry[metric + '_mean'] = values.mean()
+            entry[metric + '_std'] = std
+            entry[metric + '_ci'] = stats.t.ppf((1 + confidence) / 2, n - 1) * std / math.sqrt(n) if n > 1 else 0.
+        latencies = np.concatenate([step_ms[k] for k in group])
+        entry['step_ms_p50'] = np.percentile(latencies, 50)
+        entry['step_ms_p95'] = np.percentile(latencies, 95)
+        summary.append(entry)
+    return summary
+
+
+def print_table(summary):
+    header = ['mode', 'episodes'] + METRICS + ['step_ms_p50', 'step_ms_p95']
+    lines = [header]
+    for entry in summary:
+        lines.append([entry['mode'], str(entry['episodes'])] +
+                     [f"{entry[metric + '_mean']:.2f} +- {entry[metric + '_ci']:.2f}" for metric in METRICS] +
+                     [f"{entry['step_ms_p50']:.2f}", f"{entry['step_ms_p95']:.2f}"])
+    widths = [max(len(line[k]) for line in lines) for k in range(len(header))]
+    for line in lines:
+        print('  '.join(value.rjust(width) for value, width in zip(line, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel evaluation of an A2C-GNN checkpoint')
+    parser.add_argument('--checkpoint', type=str, default=os.path.join('saved_files', 'ckpt', 'Toy', 'a2c_gnn.pth'),
+                        help='checkpoint saved by main.py (default: saved_files/ckpt/Toy/a2c_gnn.pth)')
+    parser.add_argument('--scenario', type=str, default=os.path.join('data', 'Toy', 'scenario_test_3_2.json'),
+                        help='scenario json file')
+    parser.add_argument('--energy', type=str, default=os.path.join('data', 'Toy', 'energy_distance_3x2.npy'),
+                        help='energy distance file of the scenario')
+    parser.add_argument('--episodes', type=int, default=10, metavar='N',
+                        help='episodes per mode (default: 10)')
+    parser.add_argument('--modes', type=str, nargs='+', default=list(MODES), choices=MODES,
+                        help='greedy (Dirichlet mean) and / or stochastic (Dirichlet sample) actions')
+    parser.add_argument('--seed', type=int, default=10, metavar='S',
+                        help='seed of the first episode, episode k uses seed + k (default: 10)')
+    parser.add_argument('--scenario_demand', type=bool, default=False,
+                        help='runs every episode on the scenario demand instead of a sampled realization')
+    parser.add_argument('--T', type=int, default=10, metavar='N',
+                        help='Time horizon of the checkpoint (default: 10)')
+    parser.add_argument('--lp_backend', type=str, default='gurobi', choices=LP_BACKENDS,
+                        help='LP solver of the matching and rebalancing steps (default: gurobi)')
+    parser.add_argument('--pax_solver', type=str, default='lp', choices=PAX_SOLVERS,
+                        help='matching step solver (default: lp)')
+    parser.add_argument('--reb_solver', type=str, default='lp', choices=REB_SOLVERS,
+                        help='rebalancing step solver (default: lp)')
+    parser.add_argument('--num_workers', type=int, default=1, metavar='N',
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='csv file for the per-episode results')
+    args = parser.parse_args()
+
+    # WLS license keys from GUROBI_WLSACCESSID / GUROBI_WLSSECRET / GUROBI_LICENSEID, otherwise the local license
+    gurobi_params = gurobi_params_from_env(OutputFlag=0)
+
+    scenario = load_or_create_scenario(create_scenario, args.scenario, args.energy)
+    model_kwargs = dict(T=args.T, scale_factor=0.01, scale_price=0.1)
+    jobs = [(mode, episode, args.seed + episode) for mode in args.modes for episode in range(args.episodes)]
+    rows, step_ms = run_eval_jobs(jobs, scenario, args.checkpoint, model_kwargs, gurobi_params, args.lp_backend, args.pax_solver,
+                                  args.reb_solver, not args.scenario_demand, args.num_workers)
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    print_table(summarize(rows, step_ms))
@@ -1,11 +1,9 @@
 from __future__ import print_function
 import argparse
 import os
-import gurobipy as gp
 from tqdm import trange
 import numpy as np
-from src.algos.pax_flows_solver import PaxFlowsSolver
-from src.algos.reb_flow_solver import RebalFlowSolver
+from src.algos.pax_flows_solver import PAX_SOLVERS, make_pax_flows_solver
 import torch
 import json
 import os
@@ -15,9 +13,15 @@ import time
 import math
 
 from src.envs.amod_env import Scenario, AMoD
+from src.envs.scenario_cache import load_or_create_scenario
 from src.algos.a2c_gnn import A2C
 from src.algos.a2c_gnn_2 import A2C as A2C_2
-from src.misc.utils import dictsum
+from src.algos.ppo_gnn import PPO
+from src.algos.impala import IMPALA, AsyncActorPool
+from src.algos.rollout_workers import RolloutWorkerPool
+from src.algos.lp_backend import LP_BACKENDS, gurobi_params_from_env, make_gurobi_env
+from src.algos.min_cost_flow import REB_SOLVERS, make_rebal_flow_solver
+from src.misc.utils import dictsum, desired_acc_from_action
 
 def create_scenario(json_file_path, energy_file_path, seed=10):
     f = open(json_file_path)
@@ -77,6 +81,31 @@ parser.add_argument('--grad_norm_clip_a', type=float, default=0.5, metavar='N',
                     help='Gradient norm clipping for the actor')
 parser.add_argument('--grad_norm_clip_c', type=float, default=0.5, metavar='N',
                     help='Gradient norm clipping for the critic')
+parser.add_argument('--lp_backend', type=str, default='gurobi', choices=LP_BACKENDS,
+                    help='LP solver for the matching and rebalancing steps, highs needs no license (default: gurobi)')
+parser.add_argument('--pax_solver', type=str, default='lp', choices=PAX_SOLVERS,
+                    help='matching solver, greedy gives the LP optimum without solving an LP (default: lp)')
+parser.add_argument('--reb_solver', type=str, default='lp', choices=REB_SOLVERS,
+                    help='rebalancing solver, mcf solves a min-cost flow and uses the LP only when charger capacities bind (default: lp)')
+parser.add_argument('--num_workers', type=int, default=0, metavar='N',
+                    help='number of rollout worker processes, 0 trains sequentially (default: 0)')
+parser.add_argument('--algo', type=str, default='a2c', choices=('a2c', 'ppo', 'impala'),
+                    help='learner, ppo runs several clipped minibatch epochs per update, impala trains on episodes of '
+                         'asynchronous rollout workers with V-trace (needs --num_workers) (default: a2c)')
+parser.add_argument('--episodes_per_update', type=int, default=1, metavar='N',
+                    help='episodes collected before every training step (default: 1)')
+parser.add_argument('--ppo_epochs', type=int, default=4, metavar='N',
+                    help='PPO epochs per training step (default: 4)')
+parser.add_argument('--ppo_minibatch', type=int, default=64, metavar='N',
+                    help='PPO minibatch size in steps (default: 64)')
+parser.add_argument('--ppo_clip', type=float, default=0.2, metavar='N',
+                    help='PPO ratio clipping (default: 0.2)')
+parser.add_argument('--gae_lambda', type=float, default=0.95, metavar='N',
+                    help='GAE lambda of PPO (default: 0.95)')
+parser.add_argument('--queue_size', type=int, default=None, metavar='N',
+                    help='finished episodes the impala workers may queue for the learner (default: num_workers)')
+parser.add_argument('--rho_bar', type=float, default=1.0, metavar='N',
+                    help='V-trace clipping of the importance ratios (default: 1.0)')
 
 args = parser.parse_args()
 args.cuda = torch.cuda.is_available()
@@ -94,11 +123,19 @@ problem_folder = 'Toy'
 file_path = os.path.join('data', problem_folder, 'scenario_test_3_2.json')
 experiment = 'training_' + problem_folder+ '_' + str(args.max_episodes) + '_episodes_T_' + str(args.T) + file_path
 energy_dist_path = os.path.join('data', problem_folder,  'energy_distance_3x2.npy')
-scenario = create_scenario(file_path, energy_dist_path)
-env = AMoD(scenario)
+scenario = load_or_create_scenario(create_scenario, file_path, energy_dist_path)
+env = AMoD(scenario, seed=seed)
 scale_factor = 0.01
 scale_price = 0.1
-model = A2C(env=env, T=T, lr_a=lr_a, lr_c=lr_c, grad_norm_clip_a=grad_norm_clip_a, grad_norm_clip_c=grad_norm_clip_c, seed=seed, scale_factor=scale_factor, scale_price=scale_price).to(device)
+if args.algo == 'impala':
+    assert args.num_workers > 0 or test, "--algo impala needs rollout workers (--num_workers)"
+    model = IMPALA(env=env, rho_bar=args.rho_bar, c_bar=args.rho_bar,
+                   T=T, lr_a=lr_a, lr_c=lr_c, grad_norm_clip_a=grad_norm_clip_a, grad_norm_clip_c=grad_norm_clip_c, seed=seed, scale_factor=scale_factor, scale_price=scale_price).to(device)
+elif args.algo == 'ppo':
+    model = PPO(env=env, clip_ratio=args.ppo_clip, gae_lambda=args.gae_lambda, epochs=args.ppo_epochs, minibatch_size=args.ppo_minibatch,
+                T=T, lr_a=lr_a, lr_c=lr_c, grad_norm_clip_a=grad_norm_clip_a, grad_norm_clip_c=grad_norm_clip_c, seed=seed, scale_factor=scale_factor, scale_price=scale_price).to(device)
+else:
+    model = A2C(env=env, T=T, lr_a=lr_a, lr_c=lr_c, grad_norm_clip_a=grad_norm_clip_a, grad_norm_clip_c=grad_norm_clip_c, seed=seed, scale_factor=scale_factor, scale_price=scale_price).to(device)
 model_2 = A2C_2(env=env, T=T, lr_a=lr_a, lr_c=lr_c, grad_norm_clip_a=grad_norm_clip_a, grad_norm_clip_c=grad_norm_clip_c, seed=seed, scale_factor=scale_factor, scale_price=scale_price).to(device)
 tf = env.tf
 
@@ -108,23 +145,10 @@ if test:
     experiment += "_test_evaluation"
 experiment += "_RL_approach_constraint"
 
-# set Gurobi environment Justin
-# gurobi_env = gp.Env(empty=True)
-# gurobi = "Justin"
-# gurobi_env.setParam('WLSACCESSID', '82115472-a780-40e8-9297-b9c92969b6d4')
-# gurobi_env.setParam('WLSSECRET', '0c069810-f45f-4920-a6cf-3f174425e641')
-# gurobi_env.setParam('LICENSEID', 844698)
-# gurobi_env.setParam("OutputFlag",0)
-# gurobi_env.start()
-
-# # set Gurobi environment Karthik2
-gurobi_env = gp.Env(empty=True)
-gurobi = "Karthik2"
-gurobi_env.setParam('WLSACCESSID', 'bc0f99a5-8537-45c3-89d9-53368d17e080')
-gurobi_env.setParam('WLSSECRET', '6dddd313-d8d4-4647-98ab-d6df872c6eaa')
-gurobi_env.setParam('LICENSEID', 799870)
-gurobi_env.setParam("OutputFlag",0)
-gurobi_env.start()
+# set Gurobi environment: WLS license keys from GUROBI_WLSACCESSID / GUROBI_WLSSECRET / GUROBI_LICENSEID,
+# otherwise the local license; the worker pools start their environments from the same parameters
+gurobi_params = gurobi_params_from_env(OutputFlag=0)
+gurobi_env = make_gurobi_env(gurobi_params) if args.lp_backend == 'gurobi' else None
 
 # set up wandb
 wandb.init(
@@ -151,7 +175,9 @@ wandb.init(
         "episode_length": env.tf,
         "seed": seed,
         "charge_levels_per_timestep": env.scenario.charge_levels_per_charge_step, 
-        "licence": gurobi,
+        "licence": 'wls' if 'WLSACCESSID' in gurobi_params else 'local',
+        "algo": args.algo,
+        "episodes_per_update": args.episodes_per_update,
       })
 
 
@@ -177,6 +203,50 @@ for region in env.nodes_spatial:
         for t in range(env.tf):
             total_demand_per_spatial_node[region] += env.demand[region,destination][t]
 
+pax_flows_solver = None
+rebal_flow_solver = None
+a_loss = v_loss = mean_value = mean_concentration = mean_std = mean_log_prob = std_log_prob = None
+if args.num_workers > 0 and not test:
+    # parallel training: every round each worker plays one episode with the current weights
+    model_kwargs = dict(T=args.T, lr_a=lr_a, lr_c=lr_c, grad_norm_clip_a=grad_norm_clip_a, grad_norm_clip_c=grad_norm_clip_c, seed=seed, scale_factor=scale_factor, scale_price=scale_price)
+    if args.algo == 'impala':
+        # asynchronous training: workers keep playing with the latest weights they have seen and every round the
+        # learner takes the next episodes_per_update finished episodes
+        pool = AsyncActorPool(scenario, model, args.num_workers, model_kwargs, gurobi_params, lp_backend=args.lp_backend,
+                              pax_solver=args.pax_solver, reb_solver=args.reb_solver, queue_size=args.queue_size, seed=seed)
+        rounds = trange(math.ceil(n_episodes / args.episodes_per_update))
+    else:
+        pool = RolloutWorkerPool(scenario, model, args.num_workers, model_kwargs, gurobi_params, lp_backend=args.lp_backend,
+                                 pax_solver=args.pax_solver, reb_solver=args.reb_solver, seed=seed)
+        rounds = trange(math.ceil(n_episodes / args.num_workers))
+    for i_round in rounds:
+        if args.algo == 'impala':
+            trajectories = pool.get(args.episodes_per_update)
+        else:
+            pool.set_weights(model)
+            trajectories = pool.collect(bool_sample_demand=True)
+        for trajectory in trajectories:
+            model.add_trajectory(trajectory.x, trajectory.actions, trajectory.rewards, trajectory.log_probs)
+        if args.algo == 'impala':
+            a_loss, v_loss, mean_value, mean_concentration, mean_std, mean_log_prob, std_log_prob = model.training_step()
+            pool.set_weights(model)
+        elif (i_round + 1) % max(1, args.episodes_per_update // args.num_workers) == 0:
+            a_loss, v_loss, mean_value, mean_concentration, mean_std, mean_log_prob, std_log_prob = model.training_step()
+        i_episode = (i_round + 1) * len(trajectories) - 1
+        episode_reward = np.mean([trajectory.reward for trajectory in trajectories])
+        episode_served_demand = np.mean([trajectory.served_demand for trajectory in trajectories])
+        episode_rebalancing_cost = np.mean([trajectory.rebalancing_cost for trajectory in trajectories])
+        rounds.set_description(f"Episode {i_episode+1} | Reward: {episode_reward:.2f} | ServedDemand: {episode_served_demand:.2f} | Reb. Cost: {episode_rebalancing_cost:.2f}")
+        if episode_reward > best_reward:
+            model.save_checkpoint(path=f"./{args.directory}/ckpt/{problem_folder}/a2c_gnn.pth")
+            best_model = model
+            wandb.save(f"./{args.directory}/ckpt/{problem_folder}/a2c_gnn.pth")
+            best_reward = episode_reward
+        wandb.log({"Episode": i_episode+1, "Reward": episode_reward, "Best Reward:": best_reward, "ServedDemand": episode_served_demand,
+        "Reb. Cost": episode_rebalancing_cost, "Actor Loss": a_loss, "Value Loss": v_loss, "Mean Value": mean_value, "Mean Log Prob": mean_log_prob, "Std Log Prob": std_log_prob})
+    pool.close()
+    epochs = [] # skip the sequential loop below
+
 k = 8000
 grad_prop = True
 for i_episode in epochs:
@@ -193,7 +263,7 @@ for i_episode in epochs:
         if i_episode < k:
             # linear optimization
             if step == 0 and i_episode == 0:
-                pax_flows_solver = PaxFlowsSolver(env=env,gurobi_env=gurobi_env)
+                pax_flows_solver = make_pax_flows_solver(args.pax_solver, env, gurobi_env, args.lp_backend)
             else:
                 pax_flows_solver.update_constraints()
                 pax_flows_solver.update_objective()
@@ -235,25 +305,15 @@ for i_episode in epochs:
         action_rl = model.select_action_MPNN()           
 
         # transform sample from Dirichlet into actual vehicle counts (i.e. (x1*x2*..*xn)*num_vehicles)
-        total_idle_acc = sum(env.acc[n][env.time+1] for n in env.nodes)
-        desired_acc = {env.nodes[i]: int(action_rl[i] *total_idle_acc) for i in range(env.number_nodes)} # over nodes
+        desired_acc = desired_acc_from_action(env, action_rl)
         action_tracker[step] = desired_acc
-        total_desiredAcc = sum(desired_acc[n] for n in env.nodes)
-        missing_cars = total_idle_acc - total_desiredAcc
-        most_likely_node = np.argmax(action_rl)
-        if missing_cars != 0:
-            desired_acc[env.nodes[most_likely_node]] += missing_cars   
-            total_desiredAcc = sum(desired_acc[n] for n in env.nodes)
-        assert abs(total_desiredAcc - total_idle_acc) < 1e-5
-        for n in env.nodes:
-            assert desired_acc[n] >= 0
         for n in env.nodes:
             desired_accumulations_spatial_nodes[n[0]] += desired_acc[n]
 
         # solve minimum rebalancing distance problem (Step 3 in paper)
         if step == 0 and i_episode == 0:
             # initialize optimization problem in the first step
-            rebal_flow_solver = RebalFlowSolver(env=env, desiredAcc=desired_acc, gurobi_env=gurobi_env)
+            rebal_flow_solver = make_rebal_flow_solver(args.reb_solver, env, desired_acc, gurobi_env, args.lp_backend)
         else:
             rebal_flow_solver.update_constraints(desired_acc, env)
             rebal_flow_solver.update_objective(env)
@@ -263,7 +323,7 @@ for i_episode in epochs:
         new_obs, rebreward, done, info_reb = env.reb_step(rebAction)
         episode_reward += rebreward
         # Store the transition in memory
-        model.rewards.append(paxreward + rebreward)
+        model.buffer.add_reward(paxreward + rebreward, done)
         # track performance over episode
         episode_served_demand += info_pax['served_demand']
         episode_rebalancing_cost += info_reb['rebalancing_cost']
@@ -272,7 +332,7 @@ for i_episode in epochs:
             break
     # perform on-policy backprop
     if not use_equal_distr_baseline:
-        if grad_prop:
+        if grad_prop and (i_episode + 1) % args.episodes_per_update == 0:
             a_loss, v_loss, mean_value, mean_concentration, mean_std, mean_log_prob, std_log_prob = model.training_step()
 
     epochs.set_description(f"Episode {i_episode+1} | Reward: {episode_reward:.2f} | ServedDemand: {episode_served_demand:.2f} | Reb. Cost: {episode_rebalancing_cost:.2f}")
@@ -291,16 +351,16 @@ for i_episode in epochs:
         best_model = model
         wandb.save(f"./{args.directory}/ckpt/{problem_folder}/a2c_gnn.pth")
         with open(f"./{args.directory}/ckpt/{problem_folder}/acc_spatial.p", "wb") as file:
-            pickle.dump(env.acc_spatial, file)
+            pickle.dump(env.acc_spatial.to_dict(), file)
         wandb.save(f"./{args.directory}/ckpt/{problem_folder}/acc_spatial.p")
         with open(f"./{args.directory}/ckpt/{problem_folder}/n_charging_vehicles_spatial.p", "wb") as file:
-            pickle.dump(env.n_charging_vehicles_spatial, file)
+            pickle.dump(env.n_charging_vehicles_spatial.to_dict(), file)
         wandb.save(f"./{args.directory}/ckpt/{problem_folder}/n_charging_vehicles_spatial.p")
         with open(f"./{args.directory}/ckpt/{problem_folder}/n_rebal_vehicles_spatial.p", "wb") as file:
-            pickle.dump(env.n_rebal_vehicles_spatial, file)
+            pickle.dump(env.n_rebal_vehicles_spatial.to_dict(), file)
         wandb.save(f"./{args.directory}/ckpt/{problem_folder}/n_rebal_vehicles_spatial.p")
         with open(f"./{args.directory}/ckpt/{problem_folder}/n_customer_vehicles_spatial.p", "wb") as file:
-            pickle.dump(env.n_customer_vehicles_spatial, file)
+            pickle.dump(env.n_customer_vehicles_spatial.to_dict(), file)
         wandb.save(f"./{args.directory}/ckpt/{problem_folder}/n_customer_vehicles_spatial.p")
         best_reward = episode_reward
         best_rebal_cost = episode_rebalancing_cost
@@ -319,16 +379,16 @@ for i_episode in epochs:
             model.save_checkpoint(path=f"./{args.directory}/ckpt/{problem_folder}/a2c_gnn_{i_episode}.pth")
             wandb.save(f"./{args.directory}/ckpt/{problem_folder}/a2c_gnn_{i_episode}.pth")
             with open(f"./{args.directory}/ckpt/{problem_folder}/acc_spatial_{i_episode}.p", "wb") as file:
-                pickle.dump(env.acc_spatial, file)
+                pickle.dump(env.acc_spatial.to_dict(), file)
             wandb.save(f"./{args.directory}/ckpt/{problem_folder}/acc_spatial_{i_episode}.p")
             with open(f"./{args.directory}/ckpt/{problem_folder}/n_charging_vehicles_spatial_{i_episode}.p", "wb") as file:
-                pickle.dump(env.n_charging_vehicles_spatial, file)
+                pickle.dump(env.n_charging_vehicles_spatial.to_dict(), file)
             wandb.save(f"./{args.directory}/ckpt/{problem_folder}/n_charging_vehicles_spatial_{i_episode}.p")
             with open(f"./{args.directory}/ckpt/{problem_folder}/n_rebal_vehicles_spatial_{i_episode}.p", "wb") as file:
-                pickle.dump(env.n_rebal_vehicles_spatial, file)
+                pickle.dump(env.n_rebal_vehicles_spatial.to_dict(), file)
             wandb.save(f"./{args.directory}/ckpt/{problem_folder}/n_rebal_vehicles_spatial_{i_episode}.p")
             with open(f"./{args.directory}/ckpt/{problem_folder}/n_customer_vehicles_spatial_{i_episode}.p", "wb") as file:
-                pickle.dump(env.n_customer_vehicles_spatial, file)
+                pickle.dump(env.n_customer_vehicles_spatial.to_dict(), file)
             wandb.save(f"./{args.directory}/ckpt/{problem_folder}/n_customer_vehicles_spatial_{i_episode}.p")
 if test:
     print(rewards_np)
@@ -351,9 +411,9 @@ time_start = time.time()
 action_tracker = {}
 for step in range(T):
     # take matching step (Step 1 in paper)
-    if step == 0 and i_episode == 0:
+    if pax_flows_solver is None:
         # initialize optimization problem in the first step
-        pax_flows_solver = PaxFlowsSolver(env=env,gurobi_env=gurobi_env)
+        pax_flows_solver = make_pax_flows_solver(args.pax_solver, env, gurobi_env, args.lp_backend)
     else:
         pax_flows_solver.update_constraints()
         pax_flows_solver.update_objective()
@@ -366,25 +426,15 @@ for step in range(T):
     # action_rl = best_model.select_action_GAT(eval_mode=True)  # GAT
     
     # transform sample from Dirichlet into actual vehicle counts (i.e. (x1*x2*..*xn)*num_vehicles)
-    total_idle_acc = sum(env.acc[n][env.time+1] for n in env.nodes)
-    desired_acc = {env.nodes[i]: int(action_rl[i] *total_idle_acc) for i in range(env.number_nodes)} # over nodes
+    desired_acc = desired_acc_from_action(env, action_rl)
     action_tracker[step] = desired_acc
-    total_desiredAcc = sum(desired_acc[n] for n in env.nodes)
-    missing_cars = total_idle_acc - total_desiredAcc
-    most_likely_node = np.argmax(action_rl)
-    if missing_cars != 0:
-        desired_acc[env.nodes[most_likely_node]] += missing_cars   
-        total_desiredAcc = sum(desired_acc[n] for n in env.nodes)
-    assert abs(total_desiredAcc - total_idle_acc) < 1e-5
-    for n in env.nodes:
-        assert desired_acc[n] >= 0
     for n in env.nodes:
         desired_accumulations_spatial_nodes[n[0]] += desired_acc[n]
 
     # solve minimum rebalancing distance problem (Step 3 in paper)
-    if step == 0 and i_episode == 0:
+    if rebal_flow_solver is None:
         # initialize optimization problem in the first step
-        rebal_flow_solver = RebalFlowSolver(env=env, desiredAcc=desired_acc, gurobi_env=gurobi_env)
+        rebal_flow_solver = make_rebal_flow_solver(args.reb_solver, env, desired_acc, gurobi_env, args.lp_backend)
     else:
         rebal_flow_solver.update_constraints(desired_acc, env)
         rebal_flow_solver.update_objective(env)
@@ -393,8 +443,6 @@ for step in range(T):
     # Take action in environment
     new_obs, rebreward, done, info_reb = env.reb_step(rebAction)
     episode_reward += rebreward
-    # Store the transition in memory
-    best_model.rewards.append(paxreward + rebreward)
     # track performance over episode
     episode_served_demand += info_pax['served_demand']
     episode_rebalancing_cost += info_reb['rebalancing_cost']
@@ -404,5 +452,7 @@ for step in range(T):
 
 # Send current statistics to screen was episode_reward, episode_served_demand, episode_rebalancing_cost
 print(f"Reward: {episode_reward:.2f} | ServedDemand: {episode_served_demand:.2f} | Reb. Cost: {episode_rebalancing_cost:.2f}")
+if args.reb_solver == 'mcf':
+    print(rebal_flow_solver.report())
 
 print("done")
\ No newline at end of file
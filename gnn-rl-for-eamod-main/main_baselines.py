@@ -10,6 +10,7 @@ import os
 import wandb
 
 from src.envs.amod_env import Scenario, AMoD
+from src.envs.scenario_cache import load_or_create_scenario
 from src.algos.a2c_gnn import A2C
 from src.algos.reb_flow_solver import solveRebFlow
 from src.misc.utils import dictsum
@@ -57,7 +58,7 @@ problem_folder = 'Toy'
 file_path = os.path.join('data', problem_folder, 'scenario_train_3_2.json')
 experiment = args.baseline_type + '_baseline_testing_' + file_path
 energy_dist_path = os.path.join('data', problem_folder, 'energy_distance_3x2.npy')
-test_scenario = create_scenario(file_path, energy_dist_path)
+test_scenario = load_or_create_scenario(create_scenario, file_path, energy_dist_path)
 env = AMoD(test_scenario, beta=args.beta)
 # Initialize A2C-GNN
 model = A2C(env=env).to(device)
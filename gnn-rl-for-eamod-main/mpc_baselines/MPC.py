@@ -6,7 +6,7 @@ Created on Wed Aug  5 22:09:46 2020
 from collections import defaultdict
 import numpy as np
 import subprocess
-from MPC_gurobi import solve_mpc, solve_mpc_trilevel
+from MPC_gurobi import solve_mpc, solve_mpc_trilevel, RollingHorizonMPC
 import os
 import networkx as nx
 from src.misc.utils import mat2str
@@ -14,17 +14,27 @@ from copy import deepcopy
 import re
 
 class MPC:
-    def __init__(self, env, gurobi_env, mpc_horizon):
+    def __init__(self, env, gurobi_env, mpc_horizon, lp_backend='gurobi'):
         self.env = env
         self.gurobi_env = gurobi_env
         self.mpc_horizon = mpc_horizon
+        self.lp_backend = lp_backend
+        self.rolling_horizon = None
         
     def MPC_exact(self):
-        paxAction, rebAction = solve_mpc(env=self.env, gurobi_env=self.gurobi_env, mpc_horizon=self.mpc_horizon)
+        paxAction, rebAction = solve_mpc(env=self.env, gurobi_env=self.gurobi_env, mpc_horizon=self.mpc_horizon, backend=self.lp_backend)
+        return paxAction,rebAction
+    
+    def MPC_rolling(self, warm_start='previous'):
+        # same model as MPC_exact, but with gurobi one persistent model is updated as the window moves
+        if self.rolling_horizon is None:
+            self.rolling_horizon = RollingHorizonMPC(env=self.env, gurobi_env=self.gurobi_env, mpc_horizon=self.mpc_horizon, warm_start=warm_start,
+                                                     backend=self.lp_backend)
+        paxAction, rebAction = self.rolling_horizon.solve()
         return paxAction,rebAction
     
     def MPC_trilevel(self):
-        paxAction, rebAction = solve_mpc_trilevel(env=self.env, gurobi_env=self.gurobi_env, mpc_horizon=self.mpc_horizon)
+        paxAction, rebAction = solve_mpc_trilevel(env=self.env, gurobi_env=self.gurobi_env, mpc_horizon=self.mpc_horizon, backend=self.lp_backend)
         return paxAction,rebAction
     
     def bi_level_matching(self):
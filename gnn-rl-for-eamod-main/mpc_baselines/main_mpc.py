@@ -1,15 +1,18 @@
 import sys
 import argparse
-sys.path.append('./src')
+import os
+# the repository root goes first, so `src` is the simulator of main.py rather than the older copy in mpc_baselines/src
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
 from src.envs.amod_env import Scenario, AMoD #, Star2Complete
 from src.misc.utils import mat2str, dictsum
+from src.algos.lp_backend import LP_BACKENDS, gurobi_params_from_env, make_gurobi_env
 from MPC import MPC
+from MPC_gurobi import WARM_STARTS
 import time
-import os
 import subprocess
 from collections import defaultdict
 import numpy as np
-import gurobipy as gp
 import json
 import wandb
 import pickle
@@ -50,6 +53,12 @@ parser.add_argument('--toy', type=bool, default=False,
                     help='activates toy mode for agent evaluation')
 parser.add_argument('--mpc_horizon', type=int, default=60, metavar='N',
                     help='MPC horizon (default: 60)')
+parser.add_argument('--rolling_horizon', type=bool, default=False,
+                    help='keeps one MPC model alive and updates it as the horizon moves')
+parser.add_argument('--lp_backend', type=str, default='gurobi', choices=LP_BACKENDS,
+                    help='LP solver of the MPC model, highs needs no Gurobi license (default: gurobi)')
+parser.add_argument('--warm_start', type=str, default='previous', choices=WARM_STARTS,
+                    help='simplex start of the rolling horizon model, see RollingHorizonMPC (default: previous)')
 parser.add_argument('--subproblem', type=int, default=0, metavar='N',
                     help='which subproblem to run (default: 0)')
 parser.add_argument('--seed', type=int, default=10, metavar='S',
@@ -65,42 +74,29 @@ if args.toy:
     # file_path = os.path.join('.', 'data', problem_folder, 'scenario_test_6_1x2_flip.json')
     # experiment = file_path +  '_mpc_horizon_' + str(mpc_horizon)
     # energy_dist_path = os.path.join('.', 'data', problem_folder,  'energy_distance_1x2.npy')
-    file_path = os.path.join('../', 'data', problem_folder, 'scenario_test_3_2.json')
+    file_path = os.path.join(ROOT, 'data', problem_folder, 'scenario_test_3_2.json')
     experiment = file_path +  '_mpc_horizon_' + str(mpc_horizon)
-    energy_dist_path = os.path.join('../', 'data', problem_folder,  'energy_distance_3x2.npy')
-    scenario = create_scenario(file_path, energy_dist_path)
-    env = AMoD(scenario)
+    energy_dist_path = os.path.join(ROOT, 'data', problem_folder,  'energy_distance_3x2.npy')
+    scenario = create_scenario(file_path, energy_dist_path, args.seed)
+    env = AMoD(scenario, seed=args.seed)
     tf = env.tf
 else:
     # problem_folder = 'SF_5_clustered'
     # file_path = os.path.join('..', 'data', problem_folder, 'SF_5_short.json')
     problem_folder = 'NY_5'
-    file_path = os.path.join('.', 'data', problem_folder, 'NY_5.json')
+    file_path = os.path.join(ROOT, 'data', problem_folder, 'NY_5.json')
     experiment = file_path +  '_mpc_horizon_' + str(mpc_horizon)
-    energy_dist_path = os.path.join('.', 'data', problem_folder, 'energy_distance.npy')
-    test_scenario = create_scenario(file_path, energy_dist_path)
-    env = AMoD(test_scenario)
+    energy_dist_path = os.path.join(ROOT, 'data', problem_folder, 'energy_distance.npy')
+    test_scenario = create_scenario(file_path, energy_dist_path, args.seed)
+    env = AMoD(test_scenario, seed=args.seed)
     tf = env.tf
 print('mpc_horizon', mpc_horizon, 'episodeLength', tf)
 experiment += "_RL_approach_constraint"
 
-# set Gurobi environment Justin
-# gurobi_env = gp.Env(empty=True)
-# gurobi = "Justin"
-# gurobi_env.setParam('WLSACCESSID', '82115472-a780-40e8-9297-b9c92969b6d4')
-# gurobi_env.setParam('WLSSECRET', '0c069810-f45f-4920-a6cf-3f174425e641')
-# gurobi_env.setParam('LICENSEID', 844698)
-# gurobi_env.setParam("OutputFlag",0)
-# gurobi_env.start()
-
-# set Gurobi environment Karthik2
-gurobi_env = gp.Env(empty=True)
-gurobi = "Karthik2"
-gurobi_env.setParam('WLSACCESSID', 'bc0f99a5-8537-45c3-89d9-53368d17e080')
-gurobi_env.setParam('WLSSECRET', '6dddd313-d8d4-4647-98ab-d6df872c6eaa')
-gurobi_env.setParam('LICENSEID', 799870)
-gurobi_env.setParam("OutputFlag",0)
-gurobi_env.start()
+# set Gurobi environment: WLS license keys from GUROBI_WLSACCESSID / GUROBI_WLSSECRET / GUROBI_LICENSEID,
+# otherwise the local license
+gurobi_params = gurobi_params_from_env(OutputFlag=0)
+gurobi_env = make_gurobi_env(gurobi_params) if args.lp_backend == 'gurobi' else None
 
 # set up wandb
 wandb.init(
@@ -116,12 +112,13 @@ wandb.init(
       "mpc_horizon": mpc_horizon,
       "number_vehicles_per_node_init": env.G.nodes[(0,1)]['accInit'],
       "charging_stations": list(env.scenario.charging_stations),
-      "licence": gurobi,
+      "licence": 'wls' if 'WLSACCESSID' in gurobi_params else 'local',
+      "lp_backend": args.lp_backend,
       })
 
 opt_rew = []
 # obs = env.reset() # TODO: determine if we should do this
-mpc = MPC(env, gurobi_env, mpc_horizon)
+mpc = MPC(env, gurobi_env, mpc_horizon, args.lp_backend)
 done = False
 served = 0
 rebcost = 0
@@ -131,7 +128,10 @@ t_0 = time.time()
 time_list = []
 while(not done):
     time_i_start = time.time()
-    paxAction, rebAction = mpc.MPC_exact() 
+    if args.rolling_horizon:
+        paxAction, rebAction = mpc.MPC_rolling(args.warm_start)
+    else:
+        paxAction, rebAction = mpc.MPC_exact() 
     time_i_end = time.time()
     t_i = time_i_end - time_i_start
     time_list.append(t_i)
@@ -140,7 +140,7 @@ while(not done):
     else:
         timesteps = [0]
     for t in timesteps:
-        obs, reward1, done, info = env.pax_step(paxAction[t], gurobi_env)    
+        obs, reward1, done, info = env.pax_step(paxAction[t])
         obs, reward2, done, info = env.reb_step(rebAction[t])
         opt_rew.append(reward1+reward2) 
         served += info['served_demand']
@@ -0,0 +1,196 @@
+"""
+Parallel MPC Evaluation
+-----------------------
+This file contains the multi-seed runner for the MPC baseline. In particular, we implement:
+(1) run_mpc_episode
+    One MPC episode for a (scenario, seed, horizon) job, as in main_mpc.py, with the latency of every solve.
+(2) run_mpc_jobs
+    Fans the jobs out over a process pool. With the gurobi LP backend every worker process starts its own Gurobi
+    environment (in its first episode, so license errors reach the caller), and the Gurobi / torch thread counts
+    are capped so that the workers together do not oversubscribe the cores. The highs backend needs no license.
+(3) summarize
+    Mean and standard deviation over the seeds of every (scenario, horizon), one row each.
+
+Example (from mpc_baselines/):
+    python mpc_runner.py --seeds 10 11 12 13 --mpc_horizon 6 10 --num_workers 4 --output results_mpc.csv
+"""
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import sys
+import time
+import json
+import numpy as np
+import torch
+
+# the repository root goes first, so `src` is the simulator of main.py / evaluate.py rather than the older copy
+# in mpc_baselines/src
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from src.envs.amod_env import Scenario, AMoD
+from src.algos.lp_backend import LP_BACKENDS, gurobi_params_from_env, make_gurobi_env
+from MPC import MPC
+from MPC_gurobi import WARM_STARTS
+
+RESULT_FIELDS = ['scenario', 'seed', 'mpc_horizon', 'reward', 'served_demand', 'rebalancing_cost', 'operating_cost', 'revenue',
+                 'solves', 'solve_ms_mean', 'solve_ms_p50', 'solve_ms_p95', 'solve_ms_max', 'episode_s']
+METRICS = ['reward', 'served_demand', 'rebalancing_cost', 'operating_cost', 'revenue', 'solve_ms_mean', 'solve_ms_p95']
+
+# Gurobi parameters of the current worker process stored by init_worker, its environment started by gurobi_env()
+_gurobi_params = None
+_gurobi_env = None
+
+
+def create_scenario(json_file_path, energy_file_path, seed=10):
+    f = open(json_file_path)
+    energy_dist = np.load(energy_file_path)
+    data = json.load(f)
+    scenario = Scenario(spatial_nodes=data['spatialNodes'], charging_stations=data['chargeLocations'], cars_per_station_capacity=data['carsPerStationCapacity'],
+                        number_charge_levels=data['chargelevels'], charge_levels_per_charge_step=data['chargeLevelsPerChargeStep'],
+                        energy_distance=energy_dist, tf=data['episodeLength'], sd=seed, tripAttr=data['demand'], demand_ratio=1,
+                        reb_time=data['rebTime'], total_acc=data['totalAcc'], p_energy=data["energy_prices"],
+                        time_granularity=data["timeGranularity"], operational_cost_per_timestep=data['operationalCostPerTimestep'])
+    return scenario
+
+
+def init_worker(gurobi_params, threads):
+    global _gurobi_params
+    torch.set_num_threads(threads)
+    # the Gurobi environment is started by the first episode, errors raised in a Pool initializer make the
+    # pool respawn the worker forever
+    _gurobi_params = dict(gurobi_params or {}, Threads=threads)
+
+
+def gurobi_env():
+    global _gurobi_env
+    if _gurobi_env is None:
+        _gurobi_env = make_gurobi_env(_gurobi_params)
+    return _gurobi_env
+
+
+def run_mpc_episode(job):
+    """
+    job = (json_file_path, energy_file_path, seed, mpc_horizon, rolling_horizon, warm_start, sample_demand, lp_backend).
+    With sample_demand the episode runs on a Poisson demand realization drawn from the environment's Generator
+    seeded with seed, otherwise on the scenario demand as in main_mpc.py. Returns one result row.
+    """
+    json_file_path, energy_file_path, seed, mpc_horizon, rolling_horizon, warm_start, sample_demand, lp_backend = job
+    t_start = time.time()
+    scenario = create_scenario(json_file_path, energy_file_path, seed)
+    env = AMoD(scenario, seed=seed)
+    if sample_demand:
+        env.reset(bool_sample_demand=True)
+    mpc = MPC(env, gurobi_env() if lp_backend == 'gurobi' else None, mpc_horizon, lp_backend)
+    rewards = []
+    served = rebcost = opcost = revenue = 0
+    time_list = []
+    done = False
+    while not done:
+        time_i_start = time.time()
+        if rolling_horizon:
+            paxAction, rebAction = mpc.MPC_rolling(warm_start)
+        else:
+            paxAction, rebAction = mpc.MPC_exact()
+        time_list.append(time.time() - time_i_start)
+        if env.tf <= env.time + mpc_horizon:
+            timesteps = range(mpc_horizon)
+        else:
+            timesteps = [0]
+        for t in timesteps:
+            obs, reward1, done, info = env.pax_step(paxAction[t])
+            obs, reward2, done, info = env.reb_step(rebAction[t])
+            rewards.append(reward1 + reward2)
+            served += info['served_demand']
+            rebcost += info['rebalancing_cost']
+            opcost += info['operating_cost']
+            revenue += info['revenue']
+    solve_ms = 1000 * np.array(time_list)
+    return dict(scenario=os.path.splitext(os.path.basename(json_file_path))[0], seed=seed, mpc_horizon=mpc_horizon,
+                reward=sum(rewards), served_demand=served, rebalancing_cost=rebcost, operating_cost=opcost, revenue=revenue,
+                solves=len(solve_ms), solve_ms_mean=solve_ms.mean(), solve_ms_p50=np.percentile(solve_ms, 50),
+                solve_ms_p95=np.percentile(solve_ms, 95), solve_ms_max=solve_ms.max(), episode_s=time.time() - t_start)
+
+
+def run_mpc_jobs(jobs, gurobi_params, num_workers=1, threads=None, start_method='fork'):
+    """
+    Runs all jobs on num_workers processes (threads per process default to cores // num_workers) and returns
+    the result rows in job order.
+    """
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // num_workers)
+    ctx = mp.get_context(start_method)
+    with ctx.Pool(num_workers, initializer=init_worker, initargs=(gurobi_params, threads)) as pool:
+        return pool.map(run_mpc_episode, jobs, chunksize=1)
+
+
+def summarize(rows):
+    """
+    One row per (scenario, mpc_horizon) with mean and std over the seeds of every metric.
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['scenario'], row['mpc_horizon']), []).append(row)
+    summary = []
+    for (scenario, mpc_horizon), group in groups.items():
+        entry = dict(scenario=scenario, mpc_horizon=mpc_horizon, seeds=len(group))
+        for metric in METRICS:
+            values = np.array([row[metric] for row in group], dtype=float)
+            entry[metric + '_mean'] = values.mean()
+            entry[metric + '_std'] = values.std()
+        summary.append(entry)
+    return summary
+
+
+def print_table(summary):
+    header = ['scenario', 'horizon', 'seeds'] + METRICS
+    lines = [header]
+    for entry in summary:
+        lines.append([entry['scenario'], str(entry['mpc_horizon']), str(entry['seeds'])] +
+                     [f"{entry[metric + '_mean']:.2f} +- {entry[metric + '_std']:.2f}" for metric in METRICS])
+    widths = [max(len(line[k]) for line in lines) for k in range(len(header))]
+    for line in lines:
+        print('  '.join(value.rjust(width) for value, width in zip(line, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel multi-seed MPC evaluation')
+    parser.add_argument('--scenario', type=str, nargs='+', default=[os.path.join(ROOT, 'data', 'Toy', 'scenario_test_3_2.json')],
+                        help='scenario json files')
+    parser.add_argument('--energy', type=str, nargs='+', default=[os.path.join(ROOT, 'data', 'Toy', 'energy_distance_3x2.npy')],
+                        help='energy distance files, one per scenario')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[10], metavar='S',
+                        help='demand seeds (default: 10)')
+    parser.add_argument('--mpc_horizon', type=int, nargs='+', default=[20], metavar='N',
+                        help='MPC horizons, at most the episode length (default: 20)')
+    parser.add_argument('--rolling_horizon', type=bool, default=False,
+                        help='keeps one MPC model alive and updates it as the horizon moves')
+    parser.add_argument('--warm_start', type=str, default='previous', choices=WARM_STARTS,
+                        help='simplex start of the rolling horizon model, see RollingHorizonMPC (default: previous)')
+    parser.add_argument('--scenario_demand', type=bool, default=False,
+                        help='runs every seed on the scenario demand instead of a sampled realization')
+    parser.add_argument('--lp_backend', type=str, default='gurobi', choices=LP_BACKENDS,
+                        help='LP solver of the MPC model, highs needs no Gurobi license (default: gurobi)')
+    parser.add_argument('--num_workers', type=int, default=1, metavar='N',
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('--threads', type=int, default=None, metavar='N',
+                        help='Gurobi / torch threads per worker (default: cores // num_workers)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='csv file for the per-episode results')
+    args = parser.parse_args()
+    assert len(args.scenario) == len(args.energy)
+
+    # WLS license keys from GUROBI_WLSACCESSID / GUROBI_WLSSECRET / GUROBI_LICENSEID, otherwise the local license
+    gurobi_params = gurobi_params_from_env(OutputFlag=0)
+
+    jobs = [(json_file_path, energy_file_path, seed, mpc_horizon, args.rolling_horizon, args.warm_start, not args.scenario_demand,
+             args.lp_backend)
+            for json_file_path, energy_file_path in zip(args.scenario, args.energy)
+            for mpc_horizon in args.mpc_horizon for seed in args.seeds]
+    rows = run_mpc_jobs(jobs, gurobi_params, args.num_workers, args.threads)
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    print_table(summarize(rows))
@@ -20,14 +20,14 @@ import torch.nn.functional as F
 from torch.distributions import Dirichlet, Normal, LogNormal, Poisson
 from torch_geometric.data import Data
 from torch_geometric.nn import GCNConv, GATv2Conv
-from torch_geometric.nn import global_mean_pool, global_max_pool
+from torch_geometric.nn import global_mean_pool, global_max_pool, global_add_pool
 
 from torch_geometric.nn import MessagePassing
 from torch.nn import Sequential as Seq, Linear, ReLU
 
 from collections import namedtuple
+from src.algos.rollout_buffer import RolloutBuffer
 
-SavedAction = namedtuple('SavedAction', ['log_prob', 'value'])
 args = namedtuple('args', ('render', 'gamma', 'log_interval'))
 args.render = True
 args.gamma = 0.97
@@ -50,40 +50,87 @@ class GNNParser():
         self.scale_factor = scale_factor
         self.price_scale_factor = scale_price
         self.input_size = input_size
+        self.static = None
 
     def parse_obs(self):
-        x = torch.cat((
-            torch.tensor([float(n[1])/self.env.scenario.number_charge_levels for n in self.env.nodes]
-                         ).view(1, 1, self.env.number_nodes).float(),
-            torch.tensor([self.env.acc[n][self.env.time+1]*self.scale_factor for n in self.env.nodes]
-                         ).view(1, 1, self.env.number_nodes).float(),
-            torch.tensor([[(self.env.acc[n][self.env.time+1] + self.env.dacc[n][t])*self.scale_factor for n in self.env.nodes]
-                          for t in range(self.env.time+1, self.env.time+self.T+1)]).view(1, self.T, self.env.number_nodes).float(),
-            torch.tensor([[sum([self.env.price[o[0], j][t] * self.scale_factor * self.price_scale_factor * (self.env.demand[o[0], j][t])*((o[1]-self.env.scenario.energy_distance[o[0], j]) >= int(not self.env.scenario.charging_stations[j]))
-                          for j in self.env.region]) for o in self.env.nodes] for t in range(self.env.time+1, self.env.time+self.T+1)]).view(1, self.T, self.env.number_nodes).float()),
-                      dim=1).squeeze(0).view(self.input_size, self.env.number_nodes).T
-        edge_index = self.env.gcn_edge_idx
-        # edge_weight = self.env.edge_weight
-
-        # edge features for MPNN implementation
-        all_times = []
-        # Loop over edges, get 'time' values for each edge, and add to 'all_times' list.
-        edges = self.env.edges
-        for e in edges:
-            if e in self.env.edges:
-                i, j = self.env.edges[self.env.edges.index(e)]
-                times_for_e = list(self.env.G.edges[i, j]['time'].values())
-            else:
-                times_for_e = [0]
-            while (len(times_for_e) < self.input_size):
-                times_for_e.append(0)
-            all_times.extend(times_for_e)
-        # Convert the list of 'time' values into a tensor.
-        tensor = torch.tensor(all_times)
-        e = (tensor.view(1, np.prod(tensor.shape)).float()).squeeze(0).view(self.input_size, len(edges)).T
+        """
+        Vectorized parse_obs: node features are written into a reused [N, 2T+2] buffer from array slices of
+        acc / dacc / demand / price, edge features are static and computed once per environment.
+        Returns exactly the tensors of the per-node reference in tests/test_gnn_parser.py.
+        """
+        static = self.static_features()
+        x = static['x']
+        self.write_node_features(self.env, x)
+        return Data(torch.tensor(x, dtype=torch.float32), static['edge_index'], edge_attr=static['edge_attr'])
+
+    def parse_obs_batch(self, envs):
+        """
+        Node features [B, N, input_size] of B environments sharing the graph of self.env (e.g. VecAMoD.envs),
+        to be used with A2C.forward_batch.
+        """
+        static = self.static_features()
+        x = np.repeat(static['x'][None], len(envs), axis=0)
+        for b, env in enumerate(envs):
+            self.write_node_features(env, x[b])
+        return torch.tensor(x, dtype=torch.float32)
+
+    def write_node_features(self, env, x):
+        """
+        Writes the time-dependent columns of the [N, input_size] node features of env into x.
+        """
+        static = self.static
+        t = env.time
+        acc = env.state.acc[:, t+1]
+        x[:, 1] = acc*self.scale_factor
+        x[:, 2:2+self.T] = (acc[:, None] + self.window(env.state.dacc, t+1))*self.scale_factor
+        # sum over destination regions j of price * demand for trips the node's charge level can serve
+        price = self.window(env.price_array[static['node_region']], t+1)
+        demand = self.window(env.demand_array[static['node_region']], t+1)
+        revenue = 0
+        for j in env.region:
+            revenue = revenue + price[:, j] * self.scale_factor * self.price_scale_factor * demand[:, j] * static['reachable'][:, j, None]
+        x[:, 2+self.T:] = revenue
+
+    def static_features(self):
+        if self.static is None or self.static['env'] is not self.env:
+            self.static = self.create_static_features()
+        return self.static
+
+    def batch_graph(self, batch_size):
+        """
+        Block-diagonal edge_index, repeated edge_attr and node-to-graph index of batch_size copies of the graph,
+        cached per batch_size by the environment's topology (the same across steps and environments).
+        """
+        return self.env.topology.batch(batch_size, self.input_size)
 
-        data = Data(x, edge_index, edge_attr=e)
-        return data
+    def window(self, array, start):
+        """
+        array[..., start:start+T] of a [..., t] array, zero-padded past its last time step.
+        """
+        out = np.zeros(array.shape[:-1] + (self.T,))
+        stop = min(start + self.T, array.shape[-1])
+        if stop > start:
+            out[..., :stop-start] = array[..., start:stop]
+        return out
+
+    def create_static_features(self):
+        """
+        Parts of the observation that do not change within an episode: charge level column, reachability mask
+        of (node, destination region) pairs, edge_index and the travel-time edge features (from env.topology).
+        """
+        env = self.env
+        scenario = env.scenario
+        x = np.zeros((env.number_nodes, self.input_size))
+        x[:, 0] = [float(n[1])/scenario.number_charge_levels for n in env.nodes]
+        node_region = np.array([n[0] for n in env.nodes], dtype=np.int64)
+        node_charge = np.array([n[1] for n in env.nodes])
+        energy_distance = np.asarray(scenario.energy_distance)[node_region]
+        min_charge = np.array([int(not scenario.charging_stations[j]) for j in env.region])
+        reachable = ((node_charge[:, None] - energy_distance) >= min_charge[None, :]).astype(float)
+
+        # edge_index and travel-time edge features are shared through the topology cache
+        return {'env': env, 'x': x, 'node_region': node_region, 'reachable': reachable,
+                'edge_index': env.gcn_edge_idx, 'edge_attr': env.topology.edge_attr(self.input_size)}
 
     #     # versions for edge_index
     #     # V0 - all edges from AMoD passed into GCN
@@ -352,11 +399,16 @@ class GNNCritic(nn.Module):
         self.conv1 = EdgeConv(node_size, edge_size, hidden_dim)
         self.g_to_v = nn.Linear(22 + hidden_dim, out_channels)
 
-    def forward(self, x, edge_index, edge_attr):
+    def forward(self, x, edge_index, edge_attr, batch=None, num_graphs=None):
+        # with batch (node-to-graph index of a block-diagonal batch) the node embeddings are scatter-summed
+        # per graph and the values of all num_graphs graphs are returned, [num_graphs, out_channels]
         x_pp = self.conv1(x, edge_index, edge_attr)
 
         x_pp = torch.cat([x, x_pp], dim=1)
-        x_pp = torch.sum(x_pp, dim=0)
+        if batch is None:
+            x_pp = torch.sum(x_pp, dim=0)
+        else:
+            x_pp = global_add_pool(x_pp, batch, num_graphs)
 
         v = self.g_to_v(x_pp)
         return v
@@ -402,9 +454,9 @@ class A2C(nn.Module):
 
         self.optimizers = self.configure_optimizers()
 
-        # action & reward buffer
-        self.saved_actions = []
-        self.rewards = []
+        # observation, action, reward & episode-end buffer of the on-policy update
+        self.buffer = RolloutBuffer(env.number_nodes, input_size)
+        # concentration statistics of the GCN select_action
         self.means_concentration = []
         self.std_concentration = []
         self.to(self.device)
@@ -447,6 +499,20 @@ class A2C(nn.Module):
         value = self.critic(x.x, x.edge_index, x.edge_attr)
         return a_probs, value
 
+    def forward_batch(self, x, jitter=1e-16):
+        """
+        forward of both actor and critic on B observations of the same graph in one pass
+        x: [B, N, input_size] node features (e.g. from GNNParser.parse_obs_batch or stacked trajectory steps).
+        Returns the Dirichlet concentrations [B, N] and the values [B].
+        """
+        B, N = x.shape[0], x.shape[1]
+        edge_index, edge_attr, batch = self.obs_parser.batch_graph(B)
+        x = x.to(self.device).reshape(B*N, -1)
+        edge_index, edge_attr, batch = edge_index.to(self.device), edge_attr.to(self.device), batch.to(self.device)
+        a_probs = self.actor(x, edge_index, edge_attr)
+        value = self.critic(x, edge_index, edge_attr, batch=batch, num_graphs=B)
+        return a_probs[1].view(B, N) + jitter, value.view(B)
+
     def parse_obs(self):
         state = self.obs_parser.parse_obs()
         return state
@@ -459,7 +525,6 @@ class A2C(nn.Module):
         # concentration, value = self.forward(obs)
         concentration_without_zeros = torch.tensor([], dtype=torch.float32)
         sampled_zero_bool_arr = []
-        log_prob_for_zeros = 0
         for node in range(non_zero.shape[0]):
             sample = torch.bernoulli(non_zero[node])
             if sample > 0:
@@ -467,10 +532,8 @@ class A2C(nn.Module):
                 new_element = torch.index_select(concentration, 0, indices)
                 concentration_without_zeros = torch.cat((concentration_without_zeros, new_element), 0)
                 sampled_zero_bool_arr.append(False)
-                log_prob_for_zeros += torch.log(non_zero[node])
             else:
                 sampled_zero_bool_arr.append(True)
-                log_prob_for_zeros += torch.log(1-non_zero[node])
         if concentration_without_zeros.shape[0] != 0:
             mean_concentration = np.mean(concentration_without_zeros.detach().numpy())
             std_concentration = np.std(concentration_without_zeros.detach().numpy())
@@ -482,10 +545,6 @@ class A2C(nn.Module):
             else:
                 dirichlet_action = m.rsample()
             dirichlet_action_np = list(dirichlet_action.detach().numpy())
-            log_prob_dirichlet = m.log_prob(dirichlet_action)
-        else:
-            log_prob_dirichlet = 0
-        self.saved_actions.append(SavedAction(log_prob_dirichlet+log_prob_for_zeros, value))
         action_np = []
         dirichlet_idx = 0
         for node in range(non_zero.shape[0]):
@@ -502,75 +561,73 @@ class A2C(nn.Module):
         return list(action)
     
     def select_action_MPNN(self, eval_mode=False):
-        a_probs , value = self.forward()
-        mu, sigma = a_probs[0][0], a_probs[0][1]
+        """
+        Samples a Dirichlet action (its mean in eval_mode). In training mode the observation and action are
+        stored in the buffer, log-prob and value are recomputed with gradients in training_step.
+        """
+        with torch.no_grad():
+            data = self.parse_obs().to(self.device)
+            a_probs = self.actor(data.x, data.edge_index, data.edge_attr)
         alpha = a_probs[1] + 1e-16
-        
+
         dirichlet_action = Dirichlet(concentration=alpha.view(-1,))
-        
-        # prod = gaus.sample()
+
         if (eval_mode):
             action = alpha / (alpha.sum() + 1e-16)
         else:
             action = dirichlet_action.sample()
-        # gaus_log_prob = gaus.log_prob(prod)
-        dir_log_prob = dirichlet_action.log_prob(action)
-        self.saved_actions.append(SavedAction(0.05 * dir_log_prob, value))
-        
+            self.buffer.add(data.x, action.view(-1))
+
         return action
 
+    def add_trajectory(self, x, actions, rewards, log_probs=None):
+        """
+        Appends an episode collected by a rollout worker to the buffer.
+        x: [S, N, input_size] parsed node features, actions: [S, N] Dirichlet samples, rewards: [S],
+        log_probs: [S] log-probs of the actions under the worker's policy (used by off-policy learners).
+        """
+        self.buffer.add_episode(x, actions, rewards, log_probs)
+
+    def evaluate(self, x, actions):
+        """
+        Log-probs (scaled by 0.05 like the sampled actions) and values of stored steps, one batched forward.
+        """
+        concentration, values = self.forward_batch(x)
+        log_probs = 0.05 * Dirichlet(concentration=concentration).log_prob(actions.to(self.device))
+        return log_probs, values
 
     def training_step(self):
-        R = 0
-        saved_actions = self.saved_actions
-        policy_losses = []  # list to save actor (policy) loss
-        value_losses = []  # list to save critic (value) loss
-        returns = []  # list to save the true values
-
-        # calculate the true value using rewards returned from the environment
-        for r in self.rewards[::-1]:
-            # calculate the discounted value
-            R = r + args.gamma * R
-            returns.insert(0, R)
-
-        # returns = [r / 4390. for r in returns] # 49000 is the maximum reward
-        returns = torch.tensor(returns)
+        x, actions, _, _ = self.buffer.get()
+        # discounted returns, restarted at every episode end, normalized over the buffer
+        returns = self.buffer.returns(args.gamma).float().to(self.device)
         returns = (returns - returns.mean()) / (returns.std() + self.eps)
 
-        log_probs = []
-        values = []
-        for (log_prob, value) in saved_actions:
-            log_probs.append(log_prob.item())
-            values.append(value.item())
+        log_probs, values = self.evaluate(x, actions)
 
-        mean_value = np.mean(values)
+        mean_value = values.mean().item()
         mean_concentration = np.mean(self.means_concentration)
         mean_std = np.mean(self.std_concentration)
-        mean_log_prob = np.mean(log_probs)
-        std_log_prob = np.std(log_probs)
-        for (log_prob, value), R in zip(saved_actions, returns):
-            advantage = R - value.item()
-            policy_losses.append(-log_prob * advantage)   # calculate actor (policy) loss
-            value_losses.append(F.smooth_l1_loss(value, torch.tensor([R]).to(self.device)))
+        mean_log_prob = log_probs.mean().item()
+        std_log_prob = log_probs.std(unbiased=False).item()
+        advantages = returns - values.detach()
 
         # take gradient steps
         self.optimizers['a_optimizer'].zero_grad()
-        a_loss = torch.stack(policy_losses).sum()
+        a_loss = -(log_probs * advantages).sum()    # actor (policy) loss
         a_loss = torch.clamp(a_loss, -1000, 1000)
         a_loss.backward()
         torch.nn.utils.clip_grad_norm_(self.actor.parameters(), self.grad_norm_clip_a)
         self.optimizers['a_optimizer'].step()
 
         self.optimizers['c_optimizer'].zero_grad()
-        v_loss = torch.stack(value_losses).sum()
+        v_loss = F.smooth_l1_loss(values, returns, reduction='sum')   # critic (value) loss
         # v_loss = torch.clamp(v_loss, -1000, 1000)
         v_loss.backward()
         torch.nn.utils.clip_grad_norm_(self.critic.parameters(), self.grad_norm_clip_c)
         self.optimizers['c_optimizer'].step()
 
-        # reset rewards and action buffer
-        del self.rewards[:]
-        del self.saved_actions[:]
+        # reset the buffer
+        self.buffer.clear()
         return a_loss, v_loss, mean_value, mean_concentration, mean_std, mean_log_prob, std_log_prob
 
     def configure_optimizers(self):
@@ -0,0 +1,204 @@
+"""
+IMPALA-GNN
+----------
+This file contains an asynchronous actor-learner pipeline for A2C-GNN. In particular, we implement:
+(1) AsyncActorPool
+    K actor processes that play AMoD episodes back to back with the latest weights they have seen, without
+    waiting for each other or for the learner. Finished episodes are handed over through a bounded set of
+    SharedTrajectory slots (actors block when the learner falls behind by queue_size episodes).
+(2) vtrace
+    V-trace targets and policy-gradient advantages (Espeholt et al., 2018) that correct for the lag between
+    the actor's policy and the learner's.
+(3) IMPALA
+    A2C-GNN agent whose training_step applies the V-trace corrected actor-critic update to the buffered episodes.
+"""
+import multiprocessing as mp
+import queue
+from collections import namedtuple
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.distributions import Dirichlet
+from torch.nn.utils import parameters_to_vector, vector_to_parameters
+
+from src.envs.amod_env import AMoD
+from src.algos.a2c_gnn import A2C, args
+from src.algos.rollout_workers import SharedTrajectory, Trajectory, run_episode
+from src.algos.lp_backend import make_gurobi_env
+
+AsyncTrajectory = namedtuple('AsyncTrajectory', Trajectory._fields + ('worker_id', 'policy_version'))
+
+
+def vtrace(behaviour_log_probs, target_log_probs, rewards, values, dones, gamma, rho_bar=1., c_bar=1.):
+    """
+    V-trace for [S] arrays of consecutive steps; the value after an episode end (or the last step) is 0.
+    Returns the value targets vs [S], the policy-gradient advantages [S] and the unclipped ratios [S].
+    """
+    rhos = np.exp(target_log_probs - behaviour_log_probs)
+    clipped_rhos = np.minimum(rho_bar, rhos)
+    cs = np.minimum(c_bar, rhos)
+    not_done = 1. - np.asarray(dones, dtype=np.float64)
+    next_values = np.append(values[1:], 0.) * not_done
+    deltas = clipped_rhos * (rewards + gamma * next_values - values)
+    # vs_t - V(x_t) = delta_t + gamma * c_t * (vs_{t+1} - V(x_{t+1}))
+    corrections = np.zeros(len(values))
+    correction = 0.
+    for t in reversed(range(len(values))):
+        correction = deltas[t] + gamma * cs[t] * not_done[t] * correction
+        corrections[t] = correction
+    vs = values + corrections
+    next_vs = np.append(vs[1:], 0.) * not_done
+    return vs, clipped_rhos * (rewards + gamma * next_vs - values), rhos
+
+
+class IMPALA(A2C):
+    """
+    Actor-critic learner for trajectories sampled by (possibly stale) actor policies.
+    rho_bar / c_bar clip the importance ratios of the advantages / traces, entropy_coef weights the Dirichlet
+    entropy bonus and reward_scale is applied to the rewards before they are used as value targets.
+    """
+
+    def __init__(self, env, rho_bar=1., c_bar=1., entropy_coef=0., reward_scale=1e-3, **kwargs):
+        super(IMPALA, self).__init__(env, **kwargs)
+        self.rho_bar = rho_bar
+        self.c_bar = c_bar
+        self.entropy_coef = entropy_coef
+        self.reward_scale = reward_scale
+        # importance ratio statistics of the last training_step
+        self.stats = {}
+
+    def training_step(self):
+        x, actions, rewards, dones = self.buffer.get()
+        concentration, values = self.forward_batch(x)
+        dist = Dirichlet(concentration=concentration)
+        log_probs = dist.log_prob(actions.to(self.device))
+        vs, advantages, rhos = vtrace(self.buffer.behaviour_log_probs().double().numpy(), log_probs.detach().double().cpu().numpy(),
+                                      rewards.numpy() * self.reward_scale, values.detach().double().cpu().numpy(), dones.numpy(),
+                                      args.gamma, self.rho_bar, self.c_bar)
+        vs = torch.from_numpy(vs).float().to(self.device)
+        advantages = torch.from_numpy(advantages).float().to(self.device)
+        advantages = (advantages - advantages.mean()) / (advantages.std() + self.eps)
+        self.stats = {'mean_rho': float(rhos.mean()), 'clipped_rho_fraction': float((rhos > self.rho_bar).mean())}
+
+        # take gradient steps
+        self.optimizers['a_optimizer'].zero_grad()
+        a_loss = -(log_probs * advantages).mean() - self.entropy_coef * dist.entropy().mean()
+        a_loss.backward()
+        torch.nn.utils.clip_grad_norm_(self.actor.parameters(), self.grad_norm_clip_a)
+        self.optimizers['a_optimizer'].step()
+
+        self.optimizers['c_optimizer'].zero_grad()
+        v_loss = F.smooth_l1_loss(values, vs)
+        v_loss.backward()
+        torch.nn.utils.clip_grad_norm_(self.critic.parameters(), self.grad_norm_clip_c)
+        self.optimizers['c_optimizer'].step()
+
+        # reset the buffer
+        self.buffer.clear()
+        log_probs = log_probs.detach()
+        return (a_loss.item(), v_loss.item(), values.mean().item() / self.reward_scale, concentration.mean().item(),
+                concentration.std().item(), log_probs.mean().item(), log_probs.std(unbiased=False).item())
+
+
+def async_actor(worker_id, scenario, model_kwargs, gurobi_params, lp_backend, pax_solver, reb_solver, seed, weights, version, lock,
+                slots, free_slots, full_slots, stop):
+    """
+    Actor loop: takes a free slot, refreshes the weights if the learner published new ones, plays one episode into
+    the slot and queues (slot, worker_id, policy version, episode statistics). A None slot terminates the actor.
+    """
+    torch.set_num_threads(1)
+    env = AMoD(scenario, seed=seed + worker_id)
+    model = A2C(env=env, **model_kwargs)
+    # decorrelate demand samples and policy samples across actors
+    np.random.seed(seed + worker_id)
+    torch.manual_seed(seed + worker_id)
+    gurobi_env = make_gurobi_env(gurobi_params) if lp_backend == 'gurobi' else None
+    solvers = {}
+    weights = np.frombuffer(weights, dtype=np.float32)
+    policy_version = -1
+    while not stop.is_set():
+        slot = free_slots.get()
+        if slot is None:
+            break
+        vector = None
+        with lock:
+            if version.value != policy_version:
+                vector = weights.copy()
+                policy_version = version.value
+        if vector is not None:
+            vector_to_parameters(torch.from_numpy(vector), model.parameters())
+        stats = run_episode(env, model, solvers, gurobi_env, True, slots[slot], lp_backend, pax_solver, reb_solver)
+        full_slots.put((slot, worker_id, policy_version) + tuple(stats))
+    full_slots.cancel_join_thread()
+
+
+class AsyncActorPool:
+    """
+    Pool of actor processes that keep sampling episodes while the learner trains. model is the learner's A2C
+    (its weights are published before the actors start); model_kwargs, gurobi_params, lp_backend, pax_solver,
+    reb_solver, seed and start_method are as in RolloutWorkerPool. At most queue_size finished episodes
+    (default: n_workers) wait for the learner.
+    """
+
+    def __init__(self, scenario, model, n_workers, model_kwargs, gurobi_params=None, lp_backend='gurobi', pax_solver='lp', reb_solver='lp',
+                 queue_size=None, seed=10, start_method='fork'):
+        ctx = mp.get_context(start_method)
+        self.n_workers = n_workers
+        queue_size = n_workers if queue_size is None else queue_size
+        n_params = sum(p.numel() for p in model.parameters())
+        self.weights = ctx.RawArray('f', n_params)
+        self.version = ctx.RawValue('i', 0)
+        self.lock = ctx.Lock()
+        self.set_weights(model)
+        # every actor holds at most one slot while playing, the others wait in full_slots for the learner
+        self.slots = [SharedTrajectory(model.env.tf, model.env.number_nodes, model.input_size, ctx) for _ in range(n_workers + queue_size)]
+        self.free_slots = ctx.Queue()
+        for slot in range(len(self.slots)):
+            self.free_slots.put(slot)
+        self.full_slots = ctx.Queue()
+        self.stop = ctx.Event()
+        self.workers = []
+        for worker_id in range(n_workers):
+            worker = ctx.Process(target=async_actor, args=(worker_id, scenario, model_kwargs, gurobi_params, lp_backend, pax_solver, reb_solver, seed,
+                                                           self.weights, self.version, self.lock, self.slots, self.free_slots, self.full_slots,
+                                                           self.stop), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def set_weights(self, model):
+        """
+        Publishes the learner's actor and critic parameters as a new policy version.
+        """
+        vector = parameters_to_vector(model.parameters()).detach().cpu().numpy().astype(np.float32)
+        with self.lock:
+            np.frombuffer(self.weights, dtype=np.float32)[:] = vector
+            self.version.value += 1
+
+    def get(self, n_episodes=1):
+        """
+        Waits for n_episodes finished episodes (in completion order) and returns them as AsyncTrajectory.
+        policy_version is the version the episode was played with, compare with self.version.value for the lag.
+        """
+        trajectories = []
+        for _ in range(n_episodes):
+            slot, worker_id, policy_version, reward, served_demand, rebalancing_cost = self.full_slots.get()
+            arrays = self.slots[slot].arrays()
+            length = self.slots[slot].length.value
+            trajectories.append(AsyncTrajectory(arrays['x'][:length].copy(), arrays['actions'][:length].copy(), arrays['rewards'][:length].copy(),
+                                                arrays['log_probs'][:length].copy(), reward, served_demand, rebalancing_cost, worker_id, policy_version))
+            self.free_slots.put(slot)
+        return trajectories
+
+    def close(self):
+        self.stop.set()
+        for _ in self.workers:
+            self.free_slots.put(None)
+        # actors finish the episode they are playing
+        for worker in self.workers:
+            while worker.is_alive():
+                try:
+                    slot = self.full_slots.get(timeout=0.1)[0]
+                    self.free_slots.put(slot)
+                except queue.Empty:
+                    pass
+            worker.join()
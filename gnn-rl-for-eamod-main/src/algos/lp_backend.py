@@ -0,0 +1,159 @@
+"""
+LP Backends
+-----------
+This file contains the solver-agnostic LP interface used by the matching and rebalancing solvers.
+In particular, we implement:
+(1) GurobiBackend
+    Persistent gurobipy model built with the matrix API (needs a Gurobi license / environment).
+(2) HighsBackend
+    License-free backend calling scipy.optimize.linprog with the HiGHS solvers.
+(3) make_lp_backend / make_gurobi_env / gurobi_params_from_env
+    Backend factory used with the --lp_backend command line flag, Gurobi environment from license parameters,
+    WLS license parameters read from the GUROBI_WLSACCESSID / GUROBI_WLSSECRET / GUROBI_LICENSEID variables.
+
+All backends solve
+    min (or max) c @ x   s.t.   A @ x (sense) b,   lb <= x <= ub
+with sense[i] in {'<', '=', '>'}. abs_pairs = (target, source) optionally requires x[target] == |x[source]|;
+this is only meaningful when x[target] is penalized in a minimization (HiGHS uses the usual two-row
+linearization, Gurobi a general constraint).
+"""
+import os
+import numpy as np
+import scipy.sparse as sp
+
+LP_BACKENDS = ('gurobi', 'highs')
+
+
+class LPBackend:
+    """
+    Build once, then update RHS / objective and solve.
+    """
+
+    def build(self, A, sense, b, c, lb=0., ub=np.inf, maximize=False, abs_pairs=None):
+        raise NotImplementedError
+
+    def set_rhs(self, b):
+        raise NotImplementedError
+
+    def set_objective(self, c):
+        raise NotImplementedError
+
+    def solve(self):
+        """
+        Returns the primal solution x; asserts that an optimum was found.
+        """
+        raise NotImplementedError
+
+
+class GurobiBackend(LPBackend):
+    def __init__(self, gurobi_env=None):
+        import gurobipy as gp
+        self.gp = gp
+        self.gurobi_env = gurobi_env
+
+    def build(self, A, sense, b, c, lb=0., ub=np.inf, maximize=False, abs_pairs=None):
+        gp = self.gp
+        n = len(c)
+        self.m = gp.Model(env=self.gurobi_env)
+        self.x = self.m.addMVar(shape=n, lb=np.broadcast_to(lb, n), ub=np.broadcast_to(ub, n), vtype=gp.GRB.CONTINUOUS, name="x")
+        self.constrs = self.m.addMConstr(sp.csr_matrix(A), self.x, np.asarray(sense), np.asarray(b, dtype=float))
+        if abs_pairs is not None:
+            for target, source in zip(*abs_pairs):
+                self.m.addGenConstrAbs(self.x[target].item(), self.x[source].item(), "absconstr")
+        self.m.ModelSense = gp.GRB.MAXIMIZE if maximize else gp.GRB.MINIMIZE
+        self.x.Obj = np.asarray(c, dtype=float)
+        self.m.update()
+
+    def set_rhs(self, b):
+        self.constrs.RHS = np.asarray(b, dtype=float)
+        self.m.update()
+
+    def set_objective(self, c):
+        self.x.Obj = np.asarray(c, dtype=float)
+        self.m.update()
+
+    def solve(self):
+        self.m.optimize()
+        if self.m.status == 3:
+            print("Optimization is infeasible.")
+        assert self.m.status == 2
+        return self.x.X
+
+
+class HighsBackend(LPBackend):
+    def __init__(self, method='highs'):
+        self.method = method
+
+    def build(self, A, sense, b, c, lb=0., ub=np.inf, maximize=False, abs_pairs=None):
+        A = sp.csr_matrix(A)
+        n = A.shape[1]
+        sense = np.asarray(sense)
+        self.maximize = maximize
+        self.le_rows = np.flatnonzero(sense == '<')
+        self.ge_rows = np.flatnonzero(sense == '>')
+        self.eq_rows = np.flatnonzero(sense == '=')
+        rows = [A[self.le_rows], -A[self.ge_rows]]
+        if abs_pairs is not None:
+            # |x[source]| <= x[target] as x[source] - x[target] <= 0 and -x[source] - x[target] <= 0
+            target, source = (np.asarray(idx) for idx in abs_pairs)
+            k = np.arange(len(target))
+            for sign in (1., -1.):
+                rows.append(sp.csr_matrix((np.concatenate((np.full(len(k), sign), -np.ones(len(k)))),
+                                           (np.concatenate((k, k)), np.concatenate((source, target)))), shape=(len(k), n)))
+        self.A_ub = sp.vstack(rows).tocsr()
+        self.A_eq = A[self.eq_rows]
+        self.n_abs_rows = self.A_ub.shape[0] - len(self.le_rows) - len(self.ge_rows)
+        self.bounds = np.column_stack((np.broadcast_to(lb, n), np.broadcast_to(ub, n))).astype(float)
+        self.set_rhs(b)
+        self.set_objective(c)
+
+    def set_rhs(self, b):
+        b = np.asarray(b, dtype=float)
+        self.b_ub = np.concatenate((b[self.le_rows], -b[self.ge_rows], np.zeros(self.n_abs_rows)))
+        self.b_eq = b[self.eq_rows]
+
+    def set_objective(self, c):
+        c = np.asarray(c, dtype=float)
+        self.c = -c if self.maximize else c
+
+    def solve(self):
+        from scipy.optimize import linprog
+        res = linprog(self.c, A_ub=self.A_ub if self.A_ub.shape[0] else None, b_ub=self.b_ub if self.A_ub.shape[0] else None,
+                      A_eq=self.A_eq if self.A_eq.shape[0] else None, b_eq=self.b_eq if self.A_eq.shape[0] else None,
+                      bounds=self.bounds, method=self.method)
+        if res.status == 2:
+            print("Optimization is infeasible.")
+        assert res.status == 0, res.message
+        return res.x
+
+
+def make_gurobi_env(gurobi_params):
+    """
+    Starts a Gurobi environment from a dict of parameters (license keys, OutputFlag, ...).
+    """
+    import gurobipy as gp
+    gurobi_env = gp.Env(empty=True)
+    for key, value in gurobi_params.items():
+        gurobi_env.setParam(key, value)
+    gurobi_env.start()
+    return gurobi_env
+
+
+def gurobi_params_from_env(**params):
+    """
+    Gurobi parameters (e.g. OutputFlag=0) plus the WLS license keys of the environment variables that are set;
+    without them Gurobi falls back to the local license file.
+    """
+    for key, cast in (('WLSACCESSID', str), ('WLSSECRET', str), ('LICENSEID', int)):
+        value = os.environ.get('GUROBI_' + key)
+        if value:
+            params[key] = cast(value)
+    return params
+
+
+def make_lp_backend(name='gurobi', gurobi_env=None):
+    if name == 'gurobi':
+        return GurobiBackend(gurobi_env)
+    if name == 'highs':
+        return HighsBackend()
+    raise ValueError(f"unknown LP backend {name}, expected one of {LP_BACKENDS}")
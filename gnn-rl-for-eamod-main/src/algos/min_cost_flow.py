@@ -0,0 +1,220 @@
+"""
+Min-Cost-Flow Rebalancing
+-------------------------
+This file contains a combinatorial solver for the rebalancing step. In particular, we implement:
+(1) MinCostTransport
+    Successive shortest paths (Dijkstra with node potentials) for the single-hop transportation problem behind
+    RebalFlowSolver: every vehicle at node n either stays or moves along one outgoing edge, the number of
+    vehicles ending within the desired accumulation is maximized and, among those flows, the cost is minimized.
+    This is the optimum of the LP with its 1e10 * |slack| penalty.
+(2) MinCostRebalFlowSolver
+    Drop-in replacement for RebalFlowSolver (same update_constraints / update_objective / optimize calls).
+    Charger capacities are not part of the network. They cannot bind when no region can send more vehicles into
+    its chargers than are free, bounded by the vehicles at the origins and the desired accumulation at the
+    destinations of its charge edges; in every other step the LP is solved directly. fallbacks / steps tells
+    how often that was the case, with most chargers occupied (e.g. NY_5) the solver is the LP.
+(3) make_rebal_flow_solver
+    Solver factory used with the --reb_solver command line flag.
+"""
+import heapq
+import numpy as np
+from src.algos.reb_flow_solver import RebalFlowSolver
+
+INF = float('inf')
+
+
+class MinCostTransport:
+    """
+    Successive shortest paths on a fixed network: N nodes, edges origin[e] -> destination[e]. Every unit of
+    supply[n] either stays at n (cost 0) or moves along one edge (cost[e] >= 0); the units ending within
+    demand[m] are maximized first and the cost second.
+    """
+
+    def __init__(self, number_nodes, origin, destination, tol=1e-9):
+        self.N = number_nodes
+        self.E = len(origin)
+        self.tol = tol
+        # arcs 0..E-1 are the edges, arcs E..E+N-1 let vehicles stay at their node
+        self.tail = [int(o) for o in origin] + list(range(number_nodes))
+        self.head = [int(d) for d in destination] + list(range(number_nodes))
+        self.out_arcs = [[] for _ in range(number_nodes)]
+        self.in_arcs = [[] for _ in range(number_nodes)]
+        for a in range(self.E + number_nodes):
+            self.out_arcs[self.tail[a]].append((a, self.head[a]))
+            self.in_arcs[self.head[a]].append((a, self.tail[a]))
+
+    def solve(self, supply, demand, cost):
+        """
+        supply, demand [N] with equal sums, cost [E]. Returns the edge flows [E].
+        """
+        N, E, tol = self.N, self.E, self.tol
+        head, tail, out_arcs, in_arcs = self.head, self.tail, self.out_arcs, self.in_arcs
+        arc_cost = cost.tolist() + [0.] * N
+        supply = supply.tolist()
+        demand = demand.tolist()
+        # staying is free, so every node first keeps what it can use
+        flow = [0.] * E + [min(s, d) for s, d in zip(supply, demand)]
+        excess = [s - f for s, f in zip(supply, flow[E:])]
+        deficit = [d - f for d, f in zip(demand, flow[E:])]
+        # potentials of the vehicle side (L) and the destination side (R); reduced costs stay >= 0
+        h_L = [0.] * N
+        h_R = [0.] * N
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        while True:
+            dist_L = [INF] * N
+            dist_R = [INF] * N
+            pred_L = [-1] * N
+            pred_R = [-1] * N
+            # settled nodes keep their label, float round-off in the reduced costs must not reopen them and
+            # close a cycle in the predecessor arcs
+            done_L = [False] * N
+            done_R = [False] * N
+            heap = []
+            for l in range(N):
+                if excess[l] > tol:
+                    dist_L[l] = -h_L[l]
+                    heap.append((dist_L[l], 0, l))
+            heapq.heapify(heap)
+            target = -1
+            while heap:
+                d, side, v = heappop(heap)
+                if side == 0:
+                    if done_L[v]:
+                        continue
+                    done_L[v] = True
+                    d += h_L[v]
+                    for a, m in out_arcs[v]:
+                        nd = d + arc_cost[a] - h_R[m]
+                        if not done_R[m] and nd < dist_R[m]:
+                            dist_R[m] = nd
+                            pred_R[m] = a
+                            heappush(heap, (nd, 1, m))
+                else:
+                    if done_R[v]:
+                        continue
+                    done_R[v] = True
+                    if deficit[v] > tol:
+                        target = v
+                        break
+                    # undo (part of) a flow arriving at v
+                    d += h_R[v]
+                    for a, l in in_arcs[v]:
+                        if flow[a] > tol:
+                            nd = d - arc_cost[a] - h_L[l]
+                            if not done_L[l] and nd < dist_L[l]:
+                                dist_L[l] = nd
+                                pred_L[l] = a
+                                heappush(heap, (nd, 0, l))
+            if target < 0:
+                break
+
+            D = dist_R[target]
+            for v in range(N):
+                h_L[v] += min(dist_L[v], D)
+                h_R[v] += min(dist_R[v], D)
+
+            # walk the path back to its source and push the bottleneck amount
+            path = []
+            amount = deficit[target]
+            m = target
+            while True:
+                a = pred_R[m]
+                path.append(a)
+                l = tail[a]
+                b = pred_L[l]
+                if b < 0:
+                    amount = min(amount, excess[l])
+                    break
+                amount = min(amount, flow[b])
+                path.append(b)
+                m = head[b]
+            for k, a in enumerate(path):
+                flow[a] += amount if k % 2 == 0 else -amount
+            excess[l] -= amount
+            deficit[target] -= amount
+        return np.array(flow[:E])
+
+
+class MinCostRebalFlowSolver:
+    """
+    Rebalancing step as a min-cost transportation problem, with the LP (RebalFlowSolver) as fallback in the
+    steps in which a charger capacity may bind.
+    """
+
+    def __init__(self, env, desiredAcc, gurobi_env=None, backend='gurobi', tol=1e-7):
+        self.gurobi_env = gurobi_env
+        self.backend = backend
+        self.tol = tol
+        self.lp_solver = None
+        self.origin_idx = np.empty(len(env.edges), dtype=np.int64)
+        self.destination_idx = np.empty(len(env.edges), dtype=np.int64)
+        for n_idx, n in enumerate(env.nodes):
+            self.origin_idx[env.map_node_to_outgoing_edges[n]] = n_idx
+            self.destination_idx[env.map_node_to_incoming_edges[n]] = n_idx
+        self.transport = MinCostTransport(len(env.nodes), self.origin_idx, self.destination_idx)
+        charge_edges = [np.array(env.map_region_to_charge_edges[r_idx], dtype=np.int64) for r_idx in range(env.number_nodes_spatial)]
+        # nodes from which and into which the vehicles of a region start charging
+        self.charge_origins = [np.unique(self.origin_idx[edges]) for edges in charge_edges]
+        self.charge_destinations = [np.unique(self.destination_idx[edges]) for edges in charge_edges]
+        # number of optimize calls and of those solved by the LP because a charger capacity may bind
+        self.steps = 0
+        self.fallbacks = 0
+        self.update_constraints(desiredAcc, env)
+        self.update_objective(env)
+
+    def update_constraints(self, desired_acc, env):
+        self.env = env
+        self.desired_acc = desired_acc
+        self.acc = env.state.acc[:, env.time + 1].copy()
+        self.desired = np.array([desired_acc[n] for n in env.nodes], dtype=float)
+        assert abs(self.desired.sum() - self.acc.sum()) < 1e-5
+        self.charge_capacity = env.charger_occupancy.free(env.time + 1)
+
+    def update_objective(self, env):
+        self.cost = (env.travel_time(env.time + 1) + env.scenario.time_normalizer) * env.scenario.operational_cost_per_timestep
+
+    def capacity_may_bind(self):
+        """
+        True if the vehicles that can start charging in some region exceed its free chargers. Every vehicle
+        starts at most one edge and the transportation flow never exceeds the desired accumulation of a node.
+        """
+        return any(min(self.acc[origins].sum(), self.desired[destinations].sum()) > capacity + self.tol
+                   for origins, destinations, capacity in zip(self.charge_origins, self.charge_destinations, self.charge_capacity))
+
+    def optimize(self):
+        self.steps += 1
+        if not self.capacity_may_bind():
+            return self.transport.solve(self.acc, self.desired, self.cost)
+        # solve the LP with the charger capacities as side constraints
+        self.fallbacks += 1
+        if self.lp_solver is None:
+            self.lp_solver = RebalFlowSolver(env=self.env, desiredAcc=self.desired_acc, gurobi_env=self.gurobi_env, backend=self.backend)
+        else:
+            self.lp_solver.update_constraints(self.desired_acc, self.env)
+            self.lp_solver.update_objective(self.env)
+        return self.lp_solver.optimize()
+
+    def report(self):
+        return f"min-cost flow rebalancing: {self.fallbacks} of {self.steps} steps solved by the LP (charger capacity may bind)"
+
+    def objective(self, flow):
+        """
+        LP objective of a flow: cost plus 1e10 * L1 distance of the resulting accumulation to the target.
+        """
+        net = np.bincount(self.destination_idx, flow, len(self.acc)) - np.bincount(self.origin_idx, flow, len(self.acc))
+        return self.cost @ flow + 1e10 * np.abs(self.desired - self.acc - net).sum()
+
+
+REB_SOLVERS = ('lp', 'mcf')
+
+
+def make_rebal_flow_solver(name, env, desiredAcc, gurobi_env=None, backend='gurobi'):
+    """
+    Rebalancing solver for the --reb_solver command line flag.
+    """
+    if name == 'lp':
+        return RebalFlowSolver(env=env, desiredAcc=desiredAcc, gurobi_env=gurobi_env, backend=backend)
+    if name == 'mcf':
+        return MinCostRebalFlowSolver(env=env, desiredAcc=desiredAcc, gurobi_env=gurobi_env, backend=backend)
+    raise ValueError(f"unknown rebalancing solver {name}, expected one of {REB_SOLVERS}")
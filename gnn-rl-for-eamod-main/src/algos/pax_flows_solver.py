@@ -1,65 +1,176 @@
 # Class def for optimization
-import gurobipy as gp
-from gurobipy import quicksum
+import numpy as np
+import scipy.sparse as sp
+from src.algos.lp_backend import make_lp_backend
+
 
 class PaxFlowsSolver:
+    """
+    Passenger matching problem (maximize profit). Constraint rows are assembled once as scipy.sparse matrices;
+    every step only pushes new RHS (accumulation, demand) and objective (price - operating cost) arrays.
+    """
 
-    def __init__(self, env, gurobi_env):
+    def __init__(self, env, gurobi_env=None, backend='gurobi'):
         # Initialize model
         self.env = env
-        self.cons_charge_graph = {}
-        self.cons_spatial_graph = {}
-        self.cons_rebal_edges = {}
-        t = self.env.time
-        self.m = gp.Model(env=gurobi_env)
-        self.flow = self.m.addMVar(shape=(len(
-            self.env.edges)), lb=0.0, ub=gp.GRB.INFINITY, vtype=gp.GRB.CONTINUOUS, name="flow")
+        number_edges = len(env.edges)
+        edge_idx = np.arange(number_edges)
+        origin_idx = np.empty(number_edges, dtype=np.int64)
+        for n_idx, n in enumerate(env.nodes):
+            origin_idx[env.map_node_to_outgoing_edges[n]] = n_idx
 
         # constr. 1: can't have outflow more than initial accumulation
-        for n in self.env.nodes:
-            self.cons_charge_graph[n] = self.m.addConstr(
-                sum(self.flow[self.env.map_node_to_outgoing_edges[n]]) <= float(
-                    self.env.acc[n][t])
-            )
-
+        node_rows = sp.csr_matrix((np.ones(number_edges), (origin_idx, edge_idx)), shape=(len(env.nodes), number_edges))
         # constr. 2: no more flow than demand
-        for i in self.env.region:
-            for j in self.env.region:
-                self.cons_spatial_graph[(i, j)] = self.m.addConstr(
-                    sum(self.flow[self.env.map_o_d_regions_to_pax_edges[(
-                        i, j)]]) <= self.env.demand[i, j][t]
-                )
+        self.od_pairs = [(i, j) for i in env.region for j in env.region]
+        od_idx, od_edge = [], []
+        for k, (i, j) in enumerate(self.od_pairs):
+            od_edge.extend(env.map_o_d_regions_to_pax_edges[(i, j)])
+            od_idx.extend([k] * len(env.map_o_d_regions_to_pax_edges[(i, j)]))
+        od_rows = sp.csr_matrix((np.ones(len(od_edge)), (od_idx, od_edge)), shape=(len(self.od_pairs), number_edges))
+        self.od_region = np.array(self.od_pairs, dtype=np.int64).reshape(-1, 2)
         # constr. 3: pax flow is zero on rebal edges
-        self.cons_rebal_edges[0] = self.m.addConstr(
-            sum(self.flow[self.env.charging_edges]) == 0
-        )
+        rebal_row = sp.csr_matrix((np.ones(len(env.charging_edges)), (np.zeros(len(env.charging_edges), dtype=np.int64), env.charging_edges)), shape=(1, number_edges))
+
+        A = sp.vstack([node_rows, od_rows, rebal_row]).tocsr()
+        sense = np.concatenate((np.full(len(env.nodes) + len(self.od_pairs), '<'), ['=']))
+        self.A, self.sense = A, sense
+        self.rhs = np.zeros(A.shape[0])
+        self.edge_region = np.array([(o[0], d[0]) for o, d in env.edges], dtype=np.int64).reshape(-1, 2)
+        self.fill_rhs()
         # objective function: maximize profit
-        obj = 0
-        for i in range(len(self.env.edges)):
-            edge = self.env.edges[i]
-            o_region = edge[0][0]
-            d_region = edge[1][0]
-            obj += self.flow[i] * (self.env.price[o_region, d_region][t] - (self.env.G.edges[edge]['time']
-                                   [self.env.time]+self.env.scenario.time_normalizer) * self.env.scenario.operational_cost_per_timestep)
-        self.m.setObjective(obj, gp.GRB.MAXIMIZE)
+        self.backend = make_lp_backend(backend, gurobi_env)
+        self.backend.build(A, sense, self.rhs, self.objective(), maximize=True)
+
+    def fill_rhs(self):
+        env = self.env
+        t = env.time
+        number_nodes = len(env.nodes)
+        self.rhs[:number_nodes] = env.state.acc[:, t]
+        self.rhs[number_nodes:number_nodes + len(self.od_pairs)] = env.demand_array[self.od_region[:, 0], self.od_region[:, 1], t]
+
+    def objective(self):
+        env = self.env
+        t = env.time
+        price = env.price_array[self.edge_region[:, 0], self.edge_region[:, 1], t]
+        return price - (env.travel_time(t) + env.scenario.time_normalizer) * env.scenario.operational_cost_per_timestep
+
+    def update_constraints(self):
+        self.fill_rhs()
+        self.backend.set_rhs(self.rhs)
+
+    def update_objective(self):
+        self.backend.set_objective(self.objective())
+
+    def optimize(self):
+        return self.backend.solve()
+
+
+class GreedyPaxFlowsSolver(PaxFlowsSolver):
+    """
+    Exact passenger matching without an LP. All pax edges of an origin-destination pair (o, d) have the same
+    profit, and the charge levels of region o with an edge for (o, d) are all levels from a lowest one upwards.
+    The served demand is therefore a polymatroid: serving pairs by decreasing profit, each as far as the charge
+    levels allow (Hall's condition on the nested level sets), is optimal. Vehicles are then assigned pair by
+    pair, highest charge requirement first, from the lowest eligible charge level upwards.
+    The LP (PaxFlowsSolver) is only built by verify().
+    """
+
+    def __init__(self, env, gurobi_env=None, backend='gurobi'):
+        self.env = env
+        self.gurobi_env = gurobi_env
+        self.lp_backend = backend
+        self.lp_solver = None
+        self.number_edges = len(env.edges)
+        self.edge_region = np.array([(o[0], d[0]) for o, d in env.edges], dtype=np.int64).reshape(-1, 2)
+        # per origin region: node indices sorted by charge, and (destination, lowest level, edge at every level)
+        self.regions = []
+        for o in env.region:
+            nodes = sorted((n for n in env.nodes if n[0] == o), key=lambda n: n[1])
+            level = {n: k for k, n in enumerate(nodes)}
+            pairs = []
+            for d in env.region:
+                edges = env.map_o_d_regions_to_pax_edges[(o, d)]
+                if len(edges) == 0:
+                    continue
+                edge_at_level = -np.ones(len(nodes), dtype=np.int64)
+                for e in edges:
+                    edge_at_level[level[env.edges[e][0]]] = e
+                lowest = min(level[env.edges[e][0]] for e in edges)
+                assert (edge_at_level[lowest:] >= 0).all(), "pax edges of an o-d pair must cover all higher charge levels"
+                pairs.append((d, lowest, edge_at_level))
+            self.regions.append((o, np.array([env.node_index[n] for n in nodes], dtype=np.int64), pairs))
 
     def update_constraints(self):
-        for n in self.env.nodes:
-            self.cons_charge_graph[n].RHS = float(
-                self.env.acc[n][self.env.time])
-        for i in self.env.region:
-            for j in self.env.region:
-                self.cons_spatial_graph[(
-                    i, j)].RHS = self.env.demand[i, j][self.env.time]
-        self.m.update()
+        pass
 
     def update_objective(self):
-        obj = quicksum(self.flow[i] * (self.env.price[self.env.edges[i][0][0], self.env.edges[i][1][0]][self.env.time] - (self.env.G.edges[self.env.edges[i]]
-                  ['time'][self.env.time]+self.env.scenario.time_normalizer) * self.env.scenario.operational_cost_per_timestep) for i in range(len(self.env.edges)))
-        self.m.setObjective(obj, gp.GRB.MAXIMIZE)
-        self.m.update()
+        pass
 
     def optimize(self):
-        self.m.optimize()
-        paxAction = self.flow.X
-        return paxAction
\ No newline at end of file
+        env = self.env
+        t = env.time
+        acc = env.state.acc[:, t]
+        profit = self.objective()
+        flow = np.zeros(self.number_edges)
+        for o, node_idx, pairs in self.regions:
+            supply = acc[node_idx]
+            # free[k]: vehicles at levels >= k not yet promised to a pair
+            free = np.cumsum(supply[::-1])[::-1]
+            served = []
+            for d, lowest, edge_at_level in sorted(pairs, key=lambda pair: -profit[pair[2][pair[1]]]):
+                if profit[edge_at_level[lowest]] <= 0:
+                    break
+                x = min(env.demand_array[o, d, t], free[:lowest + 1].min())
+                if x <= 0:
+                    continue
+                free[:lowest + 1] -= x
+                served.append((lowest, x, edge_at_level))
+            left = supply.copy()
+            for lowest, x, edge_at_level in sorted(served, key=lambda s: -s[0]):
+                for k in range(lowest, len(left)):
+                    take = min(x, left[k])
+                    if take > 0:
+                        flow[edge_at_level[k]] += take
+                        left[k] -= take
+                        x -= take
+                    if x <= 0:
+                        break
+        return flow
+
+    def verify(self, flow=None, rtol=1e-9):
+        """
+        Solves the LP (PaxFlowsSolver) for the current step and asserts that the greedy matching reaches the
+        same profit and respects the node and demand constraints. Returns (greedy profit, LP profit).
+        """
+        if flow is None:
+            flow = self.optimize()
+        if self.lp_solver is None:
+            self.lp_solver = PaxFlowsSolver(env=self.env, gurobi_env=self.gurobi_env, backend=self.lp_backend)
+        else:
+            self.lp_solver.update_constraints()
+            self.lp_solver.update_objective()
+        lp = self.lp_solver
+        lhs = lp.A @ flow
+        tol = 1e-9 * (1 + np.abs(lp.rhs))
+        assert (flow >= 0).all()
+        assert (lhs[lp.sense == '<'] <= (lp.rhs + tol)[lp.sense == '<']).all()
+        assert (np.abs(lhs - lp.rhs) <= tol)[lp.sense == '='].all()
+        profit = self.objective()
+        greedy_value, lp_value = profit @ flow, profit @ lp.optimize()
+        assert abs(greedy_value - lp_value) <= rtol * (1 + abs(lp_value)), (greedy_value, lp_value)
+        return greedy_value, lp_value
+
+
+PAX_SOLVERS = ('lp', 'greedy')
+
+
+def make_pax_flows_solver(name, env, gurobi_env=None, backend='gurobi'):
+    """
+    Matching solver for the --pax_solver command line flag.
+    """
+    if name == 'lp':
+        return PaxFlowsSolver(env=env, gurobi_env=gurobi_env, backend=backend)
+    if name == 'greedy':
+        return GreedyPaxFlowsSolver(env=env, gurobi_env=gurobi_env, backend=backend)
+    raise ValueError(f"unknown matching solver {name}, expected one of {PAX_SOLVERS}")
@@ -0,0 +1,99 @@
+"""
+PPO-GNN
+-------
+This file contains a PPO learner for the AMoD control problem. In particular, we implement:
+(1) PPO
+    A2C-GNN agent (same GNNActor / GNNCritic, parser, Dirichlet policy head of select_action_MPNN and rollout
+    buffer) whose training_step runs several epochs of minibatch updates with the clipped surrogate objective
+    and GAE advantages over all episodes in the buffer, instead of a single gradient step.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.distributions import Dirichlet
+
+from src.algos.a2c_gnn import A2C, args
+from src.algos.rollout_buffer import discounted_returns
+
+
+class PPO(A2C):
+    """
+    Proximal Policy Optimization on top of the A2C-GNN networks.
+    clip_ratio: clipping range of the probability ratio, gae_lambda: GAE parameter, epochs / minibatch_size: passes
+    and minibatch size per training_step, entropy_coef: weight of the Dirichlet entropy bonus, reward_scale: factor
+    applied to the rewards before they are used as value targets (AMoD rewards are in the thousands per step).
+    """
+
+    def __init__(self, env, clip_ratio=0.2, gae_lambda=0.95, epochs=4, minibatch_size=64, entropy_coef=0., reward_scale=1e-3, **kwargs):
+        super(PPO, self).__init__(env, **kwargs)
+        self.clip_ratio = clip_ratio
+        self.gae_lambda = gae_lambda
+        self.epochs = epochs
+        self.minibatch_size = minibatch_size
+        self.entropy_coef = entropy_coef
+        self.reward_scale = reward_scale
+        # approximate KL and clipped fraction of the last training_step
+        self.stats = {}
+
+    def policy(self, x):
+        """
+        Dirichlet policy and values of stored steps x [B, N, input_size], one batched forward.
+        """
+        concentration, values = self.forward_batch(x)
+        return Dirichlet(concentration=concentration), values
+
+    def advantages(self, rewards, dones, values):
+        """
+        GAE advantages and value targets; the value after an episode end (or the last stored step) is 0.
+        """
+        rewards = rewards.numpy() * self.reward_scale
+        dones = dones.numpy()
+        values = values.double().cpu().numpy()
+        next_values = np.append(values[1:], 0.)
+        next_values[dones] = 0.
+        deltas = rewards + args.gamma * next_values - values
+        advantages = discounted_returns(deltas, dones, args.gamma * self.gae_lambda)
+        return torch.from_numpy(advantages).float(), torch.from_numpy(advantages + values).float()
+
+    def training_step(self):
+        x, actions, rewards, dones = self.buffer.get()
+        S = len(self.buffer)
+        with torch.no_grad():
+            dist, old_values = self.policy(x)
+            old_log_probs = dist.log_prob(actions.to(self.device))
+            concentration = dist.concentration
+        advantages, targets = self.advantages(rewards, dones, old_values)
+        advantages = (advantages - advantages.mean()) / (advantages.std() + self.eps)
+        advantages, targets = advantages.to(self.device), targets.to(self.device)
+
+        a_losses, v_losses, kls, clipped = [], [], [], []
+        for epoch in range(self.epochs):
+            for idx in torch.randperm(S).split(self.minibatch_size):
+                dist, values = self.policy(x[idx])
+                log_probs = dist.log_prob(actions[idx].to(self.device))
+                ratio = torch.exp(log_probs - old_log_probs[idx])
+                surrogate = torch.min(ratio * advantages[idx], torch.clamp(ratio, 1 - self.clip_ratio, 1 + self.clip_ratio) * advantages[idx])
+
+                # take gradient steps
+                self.optimizers['a_optimizer'].zero_grad()
+                a_loss = -surrogate.mean() - self.entropy_coef * dist.entropy().mean()
+                a_loss.backward()
+                torch.nn.utils.clip_grad_norm_(self.actor.parameters(), self.grad_norm_clip_a)
+                self.optimizers['a_optimizer'].step()
+
+                self.optimizers['c_optimizer'].zero_grad()
+                v_loss = F.smooth_l1_loss(values, targets[idx])
+                v_loss.backward()
+                torch.nn.utils.clip_grad_norm_(self.critic.parameters(), self.grad_norm_clip_c)
+                self.optimizers['c_optimizer'].step()
+
+                a_losses.append(a_loss.item())
+                v_losses.append(v_loss.item())
+                kls.append((old_log_probs[idx] - log_probs).mean().item())
+                clipped.append(((ratio - 1).abs() > self.clip_ratio).float().mean().item())
+        self.stats = {'approx_kl': kls[-1], 'clip_fraction': np.mean(clipped)}
+
+        # reset the buffer
+        self.buffer.clear()
+        return (np.mean(a_losses), np.mean(v_losses), old_values.mean().item() / self.reward_scale, concentration.mean().item(),
+                concentration.std().item(), old_log_probs.mean().item(), old_log_probs.std(unbiased=False).item())
@@ -1,72 +1,80 @@
 # Class def for optimization
-import gurobipy as gp
-from gurobipy import quicksum
+import numpy as np
+import scipy.sparse as sp
+from src.algos.lp_backend import make_lp_backend
 
 
-class RebalFlowSolver:  
-    def __init__(self, env, desiredAcc, gurobi_env):
+class RebalFlowSolver:
+    """
+    Minimum rebalancing cost problem. The node-edge incidence rows, the charger-capacity rows and the cost
+    vector are assembled once as scipy.sparse matrices; every step only pushes new RHS and objective arrays.
+    Variables are [flow (edges), slack (nodes), slack_abs (nodes)].
+    """
+    def __init__(self, env, desiredAcc, gurobi_env=None, backend='gurobi'):
         # Initialize model
-        self.cons_charge_graph1 = {}
-        self.cons_charge_graph2 = {}
-        self.cons_spatial_graph_charging_cars = {}
-        t = env.time
-        self.m = gp.Model(env=gurobi_env)
-        self.flow = self.m.addMVar(shape=(len(env.edges)), lb=0, ub=gp.GRB.INFINITY, vtype=gp.GRB.CONTINUOUS, name="flow") # both could be INTEGER
-        self.slack_variables = self.m.addMVar(shape=(len(env.nodes)), lb=-10000000, ub=gp.GRB.INFINITY, vtype=gp.GRB.CONTINUOUS, name="slack")
-        self.slack_variables_abs = self.m.addMVar(shape=(len(env.nodes)), lb=0, ub=gp.GRB.INFINITY, vtype=gp.GRB.CONTINUOUS, name="slack_abs")
+        number_nodes = len(env.nodes)
+        number_edges = len(env.edges)
+        self.number_edges = number_edges
 
-        for n_idx in range(len(env.nodes)):
-            n = env.nodes[n_idx]
-            outgoing_edges = env.map_node_to_outgoing_edges[n]
-            incoming_edges = env.map_node_to_incoming_edges[n]
+        # node-edge incidence matrices, [node_idx, edge_idx]
+        edge_idx = np.arange(number_edges)
+        origin_idx = np.empty(number_edges, dtype=np.int64)
+        destination_idx = np.empty(number_edges, dtype=np.int64)
+        for n_idx, n in enumerate(env.nodes):
+            origin_idx[env.map_node_to_outgoing_edges[n]] = n_idx
+            destination_idx[env.map_node_to_incoming_edges[n]] = n_idx
+        outgoing = sp.csr_matrix((np.ones(number_edges), (origin_idx, edge_idx)), shape=(number_nodes, number_edges))
+        incoming = sp.csr_matrix((np.ones(number_edges), (destination_idx, edge_idx)), shape=(number_nodes, number_edges))
+        no_slack = sp.csr_matrix((number_nodes, 2*number_nodes))
 
-            # Constraint 1: We can not have more vehicles flowing out of a node, than vehicles at the node
-            self.cons_charge_graph1[n_idx] = self.m.addConstr(sum(self.flow[outgoing_edges]) <= env.acc[n][t + 1])
+        # Constraint 1: We can not have more vehicles flowing out of a node, than vehicles at the node
+        # Constraint 2: We want to reach the target distribrution
+        # rows are interleaved per node (1, 2, 1, 2, ...) in the order the constraints used to be added
+        node_rows = sp.vstack([sp.hstack([outgoing, no_slack]),
+                               sp.hstack([incoming - outgoing, sp.identity(number_nodes), sp.csr_matrix((number_nodes, number_nodes))])]).tocsr()
+        node_rows = node_rows[np.arange(2*number_nodes).reshape(2, number_nodes).T.reshape(-1)]
 
-            # Constraint 2: We want to reach the target distribrution
-            self.cons_charge_graph2[n_idx] = self.m.addConstr(sum(self.flow[incoming_edges]) - sum(self.flow[outgoing_edges]) + self.slack_variables[n_idx] == desiredAcc[n] - env.acc[n][t + 1]) 
-            self.m.addGenConstrAbs(self.slack_variables_abs[n_idx], self.slack_variables[n_idx], "absconstr")
-            
-            # Constraint 3: We cannot charge more vehicles then we have charging spots
+        # Constraint 3: We cannot charge more vehicles then we have charging spots
+        charge_region, charge_edge = [], []
         for r_idx in range(env.number_nodes_spatial):
-            outgoing_charge_edges = env.map_region_to_charge_edges[r_idx]
-            self.cons_spatial_graph_charging_cars[r_idx] = self.m.addConstr(sum(self.flow[outgoing_charge_edges]) <= env.scenario.cars_per_station_capacity[r_idx] - env.scenario.cars_charging_per_station[r_idx][t+1]) # TODO finish
-        
-        self.obj1 = 0
-        for n_idx in range(len(env.nodes)):
-            self.obj1 += self.slack_variables_abs[n_idx] * 1e10
+            charge_edge.extend(env.map_region_to_charge_edges[r_idx])
+            charge_region.extend([r_idx] * len(env.map_region_to_charge_edges[r_idx]))
+        charge_rows = sp.csr_matrix((np.ones(len(charge_edge)), (charge_region, charge_edge)), shape=(env.number_nodes_spatial, number_edges + 2*number_nodes))
+
+        A = sp.vstack([node_rows, charge_rows]).tocsr()
+        sense = np.concatenate((np.tile(np.array(['<', '=']), number_nodes), np.full(env.number_nodes_spatial, '<')))
+        lb = np.concatenate((np.zeros(number_edges), np.full(number_nodes, -10000000.), np.zeros(number_nodes)))
+        # slack_abs == |slack|
+        abs_pairs = (number_edges + number_nodes + np.arange(number_nodes), number_edges + np.arange(number_nodes))
+        self.rhs = np.zeros(A.shape[0])
+        self.cost = np.concatenate((np.zeros(number_edges), np.zeros(number_nodes), np.full(number_nodes, 1e10)))
+
+        self.fill_rhs(desiredAcc, env)
+        self.fill_objective(env)
+        self.backend = make_lp_backend(backend, gurobi_env)
+        self.backend.build(A, sense, self.rhs, self.cost, lb=lb, abs_pairs=abs_pairs)
 
-        self.obj2 = 0
-        for e_idx in range(len(env.edges)):
-            i,j = env.edges[e_idx]
-            self.obj2 += self.flow[e_idx] * (env.G.edges[i,j]['time'][t + 1]+env.scenario.time_normalizer) * env.scenario.operational_cost_per_timestep
-        self.m.setObjective(self.obj1+self.obj2, gp.GRB.MINIMIZE)
+    def fill_rhs(self, desired_acc, env):
+        t = env.time
+        number_nodes = len(env.nodes)
+        acc = env.state.acc[:, t + 1]
+        desired = np.array([desired_acc[n] for n in env.nodes], dtype=float)
+        assert abs(desired.sum() - acc.sum()) < 1e-5
+        self.rhs[0:2*number_nodes:2] = acc
+        self.rhs[1:2*number_nodes:2] = desired - acc
+        self.rhs[2*number_nodes:] = env.charger_occupancy.free(t + 1)
+
+    def fill_objective(self, env):
+        self.cost[:self.number_edges] = (env.travel_time(env.time + 1) + env.scenario.time_normalizer) * env.scenario.operational_cost_per_timestep
 
     def update_constraints(self, desired_acc, env):
-        desired_acc_checksum = 0
-        acc_checksum = 0
-        for n_idx in range(len(env.nodes)):
-            node_charge = env.nodes[n_idx]
+        self.fill_rhs(desired_acc, env)
+        self.backend.set_rhs(self.rhs)
 
-            desired_acc_checksum += desired_acc[node_charge]
-            acc_checksum += env.acc[node_charge][env.time + 1]
-            self.cons_charge_graph1[n_idx].RHS = env.acc[node_charge][env.time + 1]
-            self.cons_charge_graph2[n_idx].RHS = desired_acc[node_charge] - env.acc[node_charge][env.time + 1]
-        assert abs(desired_acc_checksum - acc_checksum) < 1e-5
-        for r_idx in range(env.number_nodes_spatial):
-            self.cons_spatial_graph_charging_cars[r_idx].RHS = env.scenario.cars_per_station_capacity[r_idx] - env.scenario.cars_charging_per_station[r_idx][env.time+1]
-        self.m.update()
-        
     def update_objective(self, env):
-        self.obj2 = sum((self.flow[e_idx] * (env.G.edges[env.edges[e_idx][0], env.edges[e_idx][1]]['time'][env.time + 1] + env.scenario.time_normalizer) * env.scenario.operational_cost_per_timestep) for e_idx in range(len(env.edges)))
-        self.m.setObjective(self.obj1+self.obj2, gp.GRB.MINIMIZE)
-        self.m.update()
+        self.fill_objective(env)
+        self.backend.set_objective(self.cost)
 
     def optimize(self):
-        self.m.optimize()
-        if self.m.status == 3:
-            print("Optimization is infeasible.")
-        assert self.m.status == 2
-        action = self.flow.X
+        action = self.backend.solve()[:self.number_edges]
         return action
-        
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Rollout Buffer
+--------------
+This file contains the on-policy experience storage of A2C-GNN. In particular, we implement:
+(1) RolloutBuffer
+    Preallocated tensors of parsed observations, Dirichlet actions, rewards, episode-end flags and (for
+    off-policy learners) the log-probs of the behaviour policy. Steps are stored without an autograd graph;
+    the learner recomputes log-probs and values of all steps in one batched forward (A2C.forward_batch).
+(2) discounted_returns
+    Reverse discounted cumulative sum of the rewards, restarted after every episode end.
+"""
+import numpy as np
+import torch
+from scipy.signal import lfilter
+
+
+def discounted_returns(rewards, dones, gamma):
+    """
+    R_t = r_t + gamma * R_{t+1}, with R_{t+1} = 0 after a step with dones[t] set. rewards, dones: [S] arrays.
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    returns = np.empty_like(rewards)
+    ends = np.flatnonzero(dones[:-1]) + 1
+    for segment in np.split(np.arange(len(rewards)), ends):
+        if len(segment) > 0:
+            returns[segment] = lfilter([1.], [1., -gamma], rewards[segment][::-1])[::-1]
+    return returns
+
+
+class RolloutBuffer:
+    """
+    Steps of one or more episodes of the same graph: x [S, N, input_size], actions [S, N], rewards [S], dones [S]
+    and behaviour log-probs [S].
+    The storage doubles whenever it is full, so it is only reallocated during the first updates.
+    """
+
+    def __init__(self, number_nodes, input_size, capacity=64):
+        self.size = 0
+        self.x = torch.zeros((capacity, number_nodes, input_size), dtype=torch.float32)
+        self.actions = torch.zeros((capacity, number_nodes), dtype=torch.float32)
+        self.rewards = torch.zeros(capacity, dtype=torch.float64)
+        self.dones = torch.zeros(capacity, dtype=torch.bool)
+        self.log_probs = torch.zeros(capacity, dtype=torch.float32)
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, steps):
+        capacity = self.x.shape[0]
+        if self.size + steps <= capacity:
+            return
+        while capacity < self.size + steps:
+            capacity *= 2
+        for key in ('x', 'actions', 'rewards', 'dones', 'log_probs'):
+            old = getattr(self, key)
+            new = old.new_zeros((capacity,) + tuple(old.shape[1:]))
+            new[:self.size] = old[:self.size]
+            setattr(self, key, new)
+
+    def add(self, x, action):
+        """
+        Stores the observation and action of a new step, its reward follows with add_reward.
+        """
+        self.reserve(1)
+        self.x[self.size] = x
+        self.actions[self.size] = action
+        self.rewards[self.size] = 0.
+        self.dones[self.size] = False
+        self.log_probs[self.size] = 0.
+        self.size += 1
+
+    def add_reward(self, reward, done=False):
+        """
+        Reward (and episode end) of the last stored step.
+        """
+        assert self.size > 0, "add_reward needs a step stored with add"
+        self.rewards[self.size - 1] = float(reward)
+        self.dones[self.size - 1] = done
+
+    def add_episode(self, x, actions, rewards, log_probs=None):
+        """
+        Appends a whole episode (e.g. collected by a rollout worker); the previous step is closed as an episode end.
+        log_probs are the Dirichlet log-probs of the actions under the policy that sampled them.
+        """
+        steps = len(rewards)
+        self.reserve(steps)
+        if self.size > 0:
+            self.dones[self.size - 1] = True
+        end = self.size + steps
+        self.x[self.size:end] = torch.as_tensor(np.asarray(x[:steps]), dtype=torch.float32)
+        self.actions[self.size:end] = torch.as_tensor(np.asarray(actions[:steps]), dtype=torch.float32)
+        self.rewards[self.size:end] = torch.as_tensor(np.asarray(rewards[:steps], dtype=np.float64))
+        self.dones[self.size:end] = False
+        self.dones[end - 1] = True
+        self.log_probs[self.size:end] = 0. if log_probs is None else torch.as_tensor(np.asarray(log_probs[:steps]), dtype=torch.float32)
+        self.size = end
+
+    def get(self):
+        """
+        Views of the stored steps: x, actions, rewards, dones.
+        """
+        return self.x[:self.size], self.actions[:self.size], self.rewards[:self.size], self.dones[:self.size]
+
+    def behaviour_log_probs(self):
+        return self.log_probs[:self.size]
+
+    def returns(self, gamma):
+        return torch.from_numpy(discounted_returns(self.rewards[:self.size].numpy(), self.dones[:self.size].numpy(), gamma))
+
+    def clear(self):
+        self.size = 0
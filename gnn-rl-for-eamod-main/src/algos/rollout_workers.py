@@ -0,0 +1,176 @@
+"""
+Rollout Workers
+---------------
+This file contains the process-parallel experience collection for A2C-GNN. In particular, we implement:
+(1) SharedTrajectory
+    Fixed-size episode arrays (parsed node features, Dirichlet actions and their log-probs, rewards) in shared memory.
+(2) RolloutWorkerPool
+    K worker processes, each owning an AMoD environment, a policy copy and its own matching /
+    rebalancing solver (with a private LP backend). Every call to collect() broadcasts the learner's
+    weights through shared memory, lets each worker play one episode and returns the K trajectories,
+    which the learner re-evaluates with A2C.add_trajectory before calling A2C.training_step.
+"""
+import multiprocessing as mp
+from collections import namedtuple
+import numpy as np
+import torch
+from torch.distributions import Dirichlet
+from torch.nn.utils import parameters_to_vector, vector_to_parameters
+
+from src.envs.amod_env import AMoD
+from src.algos.a2c_gnn import A2C
+from src.algos.pax_flows_solver import make_pax_flows_solver
+from src.algos.min_cost_flow import make_rebal_flow_solver
+from src.algos.lp_backend import make_gurobi_env
+from src.misc.utils import desired_acc_from_action
+
+Trajectory = namedtuple('Trajectory', ['x', 'actions', 'rewards', 'log_probs', 'reward', 'served_demand', 'rebalancing_cost'])
+
+
+class SharedTrajectory:
+    """
+    One episode of at most tf steps stored in a single shared-memory block, readable from any process.
+    """
+
+    def __init__(self, tf, number_nodes, input_size, ctx=mp):
+        self.shapes = {'x': (tf, number_nodes, input_size), 'actions': (tf, number_nodes), 'rewards': (tf,), 'log_probs': (tf,)}
+        self.block = ctx.RawArray('d', sum(int(np.prod(shape)) for shape in self.shapes.values()))
+        self.length = ctx.RawValue('i', 0)
+
+    def arrays(self):
+        buffer = np.frombuffer(self.block, dtype=np.float64)
+        arrays = {}
+        offset = 0
+        for key, shape in self.shapes.items():
+            size = int(np.prod(shape))
+            arrays[key] = buffer[offset:offset + size].reshape(shape)
+            offset += size
+        return arrays
+
+
+def run_episode(env, model, solvers, gurobi_env, bool_sample_demand, trajectory, lp_backend='gurobi', pax_solver='lp', reb_solver='lp'):
+    """
+    Plays one episode with the matching step and the GNN rebalancing policy and writes it to `trajectory`.
+    solvers caches the matching / rebalancing solver of this worker across episodes.
+    """
+    arrays = trajectory.arrays()
+    env.reset(bool_sample_demand)
+    episode_reward = 0
+    episode_served_demand = 0
+    episode_rebalancing_cost = 0
+    for step in range(env.tf):
+        # take matching step (Step 1 in paper)
+        if solvers.get('pax') is None:
+            solvers['pax'] = make_pax_flows_solver(pax_solver, env, gurobi_env, lp_backend)
+        else:
+            solvers['pax'].update_constraints()
+            solvers['pax'].update_objective()
+        _, paxreward, done, info_pax = env.pax_step(pax_flows_solver=solvers['pax'])
+        episode_reward += paxreward
+
+        # sample from the GNN-RL policy (Step 2 in paper), gradients are recomputed by the learner
+        with torch.no_grad():
+            data = model.parse_obs()
+            a_probs = model.actor(data.x, data.edge_index, data.edge_attr)
+            dirichlet_action = Dirichlet(concentration=(a_probs[1] + 1e-16).view(-1,))
+            action_rl = dirichlet_action.sample()
+        arrays['x'][step] = data.x.numpy()
+        arrays['actions'][step] = action_rl.numpy()
+        arrays['log_probs'][step] = dirichlet_action.log_prob(action_rl).item()
+        desired_acc = desired_acc_from_action(env, action_rl)
+
+        # solve minimum rebalancing distance problem (Step 3 in paper)
+        if solvers.get('rebal') is None:
+            solvers['rebal'] = make_rebal_flow_solver(reb_solver, env, desired_acc, gurobi_env, lp_backend)
+        else:
+            solvers['rebal'].update_constraints(desired_acc, env)
+            solvers['rebal'].update_objective(env)
+        rebAction = solvers['rebal'].optimize()
+
+        _, rebreward, done, info_reb = env.reb_step(rebAction)
+        episode_reward += rebreward
+        arrays['rewards'][step] = paxreward + rebreward
+        episode_served_demand += info_pax['served_demand']
+        episode_rebalancing_cost += info_reb['rebalancing_cost']
+        trajectory.length.value = step + 1
+        if done:
+            break
+    return episode_reward, episode_served_demand, episode_rebalancing_cost
+
+
+def rollout_worker(worker_id, scenario, model_kwargs, gurobi_params, lp_backend, pax_solver, reb_solver, seed, weights, trajectory, conn):
+    """
+    Worker loop: waits for ('collect', bool_sample_demand), loads the shared weights, plays one episode and
+    answers with the episode statistics. ('close', None) terminates the worker.
+    """
+    torch.set_num_threads(1)
+    env = AMoD(scenario, seed=seed + worker_id)
+    model = A2C(env=env, **model_kwargs)
+    # decorrelate demand samples and policy samples across workers
+    np.random.seed(seed + worker_id)
+    torch.manual_seed(seed + worker_id)
+    gurobi_env = make_gurobi_env(gurobi_params) if lp_backend == 'gurobi' else None
+    solvers = {}
+    weights = np.frombuffer(weights, dtype=np.float32)
+    while True:
+        command, bool_sample_demand = conn.recv()
+        if command == 'close':
+            break
+        vector_to_parameters(torch.from_numpy(weights.copy()), model.parameters())
+        conn.send(run_episode(env, model, solvers, gurobi_env, bool_sample_demand, trajectory, lp_backend, pax_solver, reb_solver))
+    conn.close()
+
+
+class RolloutWorkerPool:
+    """
+    Pool of rollout processes sharing the policy weights and one SharedTrajectory per worker with the learner.
+    model is the learner's A2C; model_kwargs are passed to A2C in every worker (T, scale_factor, scale_price, seed)
+    and must describe the same architecture. Workers start a Gurobi environment from gurobi_params only when
+    lp_backend is 'gurobi'; pax_solver ('lp' or 'greedy') and reb_solver ('lp' or 'mcf') select the matching and
+    rebalancing solvers. start_method defaults to 'fork' since main scripts in this repo run at module level.
+    """
+
+    def __init__(self, scenario, model, n_workers, model_kwargs, gurobi_params=None, lp_backend='gurobi', pax_solver='lp', reb_solver='lp', seed=10, start_method='fork'):
+        ctx = mp.get_context(start_method)
+        self.n_workers = n_workers
+        n_params = sum(p.numel() for p in model.parameters())
+        self.weights = ctx.RawArray('f', n_params)
+        self.trajectories = [SharedTrajectory(model.env.tf, model.env.number_nodes, model.input_size, ctx) for _ in range(n_workers)]
+        self.conns = []
+        self.workers = []
+        for worker_id in range(n_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            worker = ctx.Process(target=rollout_worker, args=(worker_id, scenario, model_kwargs, gurobi_params, lp_backend, pax_solver, reb_solver, seed,
+                                                              self.weights, self.trajectories[worker_id], child_conn), daemon=True)
+            worker.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.workers.append(worker)
+
+    def set_weights(self, model):
+        """
+        Copies the learner's actor and critic parameters into the shared weight buffer.
+        """
+        vector = parameters_to_vector(model.parameters()).detach().cpu().numpy().astype(np.float32)
+        np.frombuffer(self.weights, dtype=np.float32)[:] = vector
+
+    def collect(self, bool_sample_demand=True):
+        """
+        Plays one episode per worker with the current shared weights and returns a list of Trajectory.
+        """
+        for conn in self.conns:
+            conn.send(('collect', bool_sample_demand))
+        trajectories = []
+        for conn, trajectory in zip(self.conns, self.trajectories):
+            reward, served_demand, rebalancing_cost = conn.recv()
+            arrays = trajectory.arrays()
+            length = trajectory.length.value
+            trajectories.append(Trajectory(arrays['x'][:length].copy(), arrays['actions'][:length].copy(), arrays['rewards'][:length].copy(),
+                                           arrays['log_probs'][:length].copy(), reward, served_demand, rebalancing_cost))
+        return trajectories
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close', None))
+        for worker in self.workers:
+            worker.join()
@@ -16,7 +16,6 @@ from cmath import inf
 from collections import defaultdict
 from email.charset import add_charset
 from itertools import count
-import gurobipy as gp
 import numpy as np
 import random
 import subprocess
@@ -25,6 +24,9 @@ import os
 import math 
 import networkx as nx
 from src.misc.utils import mat2str
+from src.envs.state_store import AMoDState, AMoDSnapshot, ArrayView, ChargerOccupancy
+from src.envs.step_engine import StepEngine
+from src.envs.topology import get_topology
 from copy import deepcopy
 import json
 
@@ -32,9 +34,13 @@ import json
 class AMoD:
     # initialization
     # updated to take scenario
-    def __init__(self, scenario):
+    # vectorized=False runs the original per-edge loops, which the vectorized step engine reproduces bit-for-bit
+    # seed initializes the environment's demand Generator (an int or a SeedSequence); None seeds it from OS entropy,
+    # independent of the global NumPy random state
+    def __init__(self, scenario, vectorized=True, seed=None):
         if scenario.EV == True:
             self.scenario = deepcopy(scenario)
+            self.rng = np.random.default_rng(seed)
             # Road Graph: node - node, edge - connection of node, node attr: 'accInit', edge attr: 'time'
             self.G = scenario.G
             self.G_spatial = scenario.G_spatial
@@ -46,6 +52,9 @@ class AMoD:
             self.arrDemand = dict()
             self.nodes = list(self.G.nodes)
             self.nodes_spatial = list(self.G_spatial.nodes)
+            self.node_index = {n: idx for idx, n in enumerate(self.nodes)}
+            self.topology = None
+            self.step_engine = None
             self.gcn_edge_idx = None
             self.gcn_edge_idx_spatial = None
             self.number_nodes = len(self.nodes)  # number of nodes
@@ -58,49 +67,22 @@ class AMoD:
             self.price = defaultdict(dict)  # price
             self.demand = self.scenario.demand_input
             self.price = self.scenario.p
-            # number of vehicles within each node, key: i - node, t - time
-            self.acc = defaultdict(dict)
-            # number of vehicles arriving at each node, key: i - node, t - time
-            self.dacc = defaultdict(dict)
-            # number of vehicles within each spatial node, key: i - node, t - time
-            self.acc_spatial = defaultdict(dict)
-            self.n_charging_vehicles_spatial = defaultdict(dict)
-            self.n_rebal_vehicles_spatial = defaultdict(dict)
-            self.n_customer_vehicles_spatial = defaultdict(dict)
-            
-            # number of vehicles arriving at each spatial node, key: i - node, t - time
-            self.dacc_spatial = defaultdict(dict)
-            # number of rebalancing vehicles, key: (i,j) - (origin, destination), t - time
-            self.rebFlow = defaultdict(dict)
-            # number of vehicles with passengers, key: (i,j) - (origin, destination), t - time
-            self.paxFlow = defaultdict(dict)
+            self.create_demand_arrays()
             self.edges = list(self.G.edges)
             self.edges_spatial = list(self.G_spatial.edges)
+            self.od_pairs = [(o, d) for o in self.region for d in self.region]
+            self.create_edge_idx_and_weights()
+            # preallocated state arrays, indexed by [node_idx, t], [region, t], [edge_idx, t] and [od_idx, t]
+            self.state = AMoDState(self.number_nodes, self.number_nodes_spatial, len(self.edges), len(self.od_pairs), self.state_horizon())
+            self.create_state_views()
             # map from od regions to road edges connecting them
             self.map_o_d_regions_to_pax_edges = None
             self.charging_edges = None  # edges only used for rebal
             self.map_node_to_outgoing_edges = None  # maps node to outgoing edges
             self.map_node_to_incoming_edges = None  # maps node to incoming edges
             self.create_edge_maps()
-            self.create_edge_idx_and_weights()
-            self.reset_cars_charging()
-
-            for i, j in self.G.edges:
-                self.rebFlow[i, j] = defaultdict(float)
-                self.paxFlow[i, j] = defaultdict(float)
-
-            for n in self.nodes:
-                self.acc[n][0] = self.G.nodes[n]['accInit']
-                self.dacc[n] = defaultdict(float)
-            for n in self.nodes_spatial:
-                self.acc_spatial[n][0] = self.G_spatial.nodes[n]['accInit']
-                self.n_charging_vehicles_spatial[n][0] = 0
-                self.n_rebal_vehicles_spatial[n][0] = 0
-                self.n_customer_vehicles_spatial[n][0] = 0
-                self.dacc_spatial[n] = defaultdict(float)
-            self.servedDemand = defaultdict(dict)
-            for i, j in self.demand:
-                self.servedDemand[i, j] = defaultdict(float)
+            self.reset_state()
+            self.step_engine = StepEngine(self) if vectorized else None
 
             self.N = len(self.nodes)  # total number of cells
 
@@ -113,6 +95,64 @@ class AMoD:
             self.obs_spatial = (self.acc_spatial, self.time,
                                 self.dacc_spatial, self.demand)
 
+    def create_state_views(self):
+        # number of vehicles within each node, key: i - node, t - time
+        self.acc = ArrayView(self.state.acc, self.nodes)
+        # number of vehicles arriving at each node, key: i - node, t - time
+        self.dacc = ArrayView(self.state.dacc, self.nodes)
+        # number of vehicles within each spatial node, key: i - node, t - time
+        self.acc_spatial = ArrayView(self.state.acc_spatial, self.nodes_spatial)
+        self.n_charging_vehicles_spatial = ArrayView(self.state.n_charging_vehicles_spatial, self.nodes_spatial)
+        # vehicles occupying a charger at each spatial node, key: r - region, t - time
+        self.charger_occupancy = ChargerOccupancy(self.state, self.scenario.cars_per_station_capacity)
+        self.scenario.cars_charging_per_station = ArrayView(self.state.charging, self.region)
+        self.n_rebal_vehicles_spatial = ArrayView(self.state.n_rebal_vehicles_spatial, self.nodes_spatial)
+        self.n_customer_vehicles_spatial = ArrayView(self.state.n_customer_vehicles_spatial, self.nodes_spatial)
+        # number of vehicles arriving at each spatial node, key: i - node, t - time
+        self.dacc_spatial = ArrayView(self.state.dacc_spatial, self.nodes_spatial)
+        # number of rebalancing vehicles, key: (i,j) - (origin, destination), t - time
+        self.rebFlow = ArrayView(self.state.reb_flow, self.edges)
+        # number of vehicles with passengers, key: (i,j) - (origin, destination), t - time
+        self.paxFlow = ArrayView(self.state.pax_flow, self.edges)
+        # served demand, key: (i,j) - (origin region, destination region), t - time
+        self.servedDemand = ArrayView(self.state.served_demand, self.od_pairs)
+        self.obs = (self.acc, self.time, self.dacc, self.demand)
+        self.obs_spatial = (self.acc_spatial, self.time, self.dacc_spatial, self.demand)
+
+    def create_demand_arrays(self):
+        # dense copies of the demand / price dicts, key: [origin region, destination region, t]
+        horizon = max([2*self.tf] + [max(times) + 1 for values in (self.demand, self.price) for times in values.values() if len(times) > 0])
+        self.demand_array = np.zeros((len(self.region), len(self.region), horizon))
+        self.price_array = np.zeros((len(self.region), len(self.region), horizon))
+        for array, values in ((self.demand_array, self.demand), (self.price_array, self.price)):
+            for (i, j), series in values.items():
+                times = list(series.keys())
+                array[i, j, times] = [series[t] for t in times]
+
+    def bind_state(self, state):
+        # move the episode state into externally owned arrays (e.g. one slice of a VecAMoD batch)
+        state.copy_from(self.state)
+        self.state = state
+        self.create_state_views()
+
+    def state_horizon(self):
+        # latest time index written during an episode: arrivals at t + travel time + time_normalizer and
+        # charging occupancy up to t + charge time, with t <= tf - 1
+        max_travel_time = int(self.edge_time.max(initial=0)) + self.scenario.time_normalizer
+        max_energy_distance = int(np.max(self.scenario.energy_distance))
+        max_charge_time = math.ceil((self.scenario.number_charge_levels + max_energy_distance) / self.scenario.charge_levels_per_charge_step)
+        return self.tf + max(max_travel_time, max_charge_time) + 1
+
+    def reset_state(self):
+        self.state.reset()
+        self.reset_cars_charging()
+        for n in self.nodes:
+            self.state.acc[self.node_index[n], 0] = self.G.nodes[n]['accInit']
+        for n in self.nodes_spatial:
+            self.state.acc_spatial[n, 0] = self.G_spatial.nodes[n]['accInit']
+        if self.step_engine is not None:
+            self.step_engine.reset_arrivals()
+
     def create_edge_maps(self):
         self.map_o_d_regions_to_pax_edges = dict([])
         self.charging_edges = []
@@ -145,39 +185,31 @@ class AMoD:
 
 
     def create_edge_idx_and_weights(self):
-        edge_idx = torch.tensor([[], []], dtype=torch.long)
-        edge_idx_spatial = torch.tensor([[], []], dtype=torch.long)
-        for e_spatial in self.edges_spatial:
-            origin_node_idx = self.nodes_spatial.index(e_spatial[0])
-            destination_node_idx = self.nodes_spatial.index(e_spatial[1])
-            new_edge = torch.tensor(
-                [[origin_node_idx], [destination_node_idx]], dtype=torch.long)
-            edge_idx_spatial = torch.cat((edge_idx, new_edge), 1)
-        self.gcn_edge_idx_spatial = edge_idx_spatial
-        for e in self.edges:
-            origin_node_idx = self.nodes.index(e[0])
-            destination_node_idx = self.nodes.index(e[1])
-            new_edge = torch.tensor(
-                [[origin_node_idx], [destination_node_idx]], dtype=torch.long)
-            edge_idx = torch.cat((edge_idx, new_edge), 1)
-        self.gcn_edge_idx = edge_idx
+        # edge_index tensors come from the topology cache, shared by all environments of the same graph
+        self.topology = get_topology(self.G, self.G_spatial, self.tf)
+        self.gcn_edge_idx_spatial = self.topology.edge_index_spatial
+        self.gcn_edge_idx = self.topology.edge_index
+        # travel time of every edge, key: [edge_idx, t], t = 0..tf (read-only, shared through the topology cache)
+        self.edge_time = self.topology.edge_time
+
+    def travel_time(self, t=None):
+        # travel times [edge_idx] of the edges departing at time t (default: the current time)
+        return self.edge_time[:, self.time if t is None else t]
 
     # pax step
     def pax_step(self, paxAction=None, pax_flows_solver=None, episode=1):
        t = self.time
        self.reward = 0
-       new_customer_vehicles = 0
-       for n in self.nodes:
-            self.acc[n][t+1] = self.acc[n][t]
-       for n_spatial in self.nodes_spatial:
-            self.acc_spatial[n_spatial][t+1] = self.acc_spatial[n_spatial][t]
-            assert self.acc_spatial[n_spatial][t] >= -1e-8
-            self.n_charging_vehicles_spatial[n_spatial][t+1] = self.n_charging_vehicles_spatial[n_spatial][t]
-            assert self.n_charging_vehicles_spatial[n_spatial][t] >= -1e-8
-            self.n_rebal_vehicles_spatial[n_spatial][t+1] = self.n_rebal_vehicles_spatial[n_spatial][t]
-            assert self.n_rebal_vehicles_spatial[n_spatial][t] >= -1e-8
-            self.n_customer_vehicles_spatial[n_spatial][t+1] = self.n_customer_vehicles_spatial[n_spatial][t]
-            assert self.n_customer_vehicles_spatial[n_spatial][t] >= -1e-8
+       state = self.state
+       state.acc[:, t+1] = state.acc[:, t]
+       assert (state.acc_spatial[:, t] >= -1e-8).all()
+       assert (state.n_charging_vehicles_spatial[:, t] >= -1e-8).all()
+       assert (state.n_rebal_vehicles_spatial[:, t] >= -1e-8).all()
+       assert (state.n_customer_vehicles_spatial[:, t] >= -1e-8).all()
+       state.acc_spatial[:, t+1] = state.acc_spatial[:, t]
+       state.n_charging_vehicles_spatial[:, t+1] = state.n_charging_vehicles_spatial[:, t]
+       state.n_rebal_vehicles_spatial[:, t+1] = state.n_rebal_vehicles_spatial[:, t]
+       state.n_customer_vehicles_spatial[:, t+1] = state.n_customer_vehicles_spatial[:, t]
        self.info['served_demand'] = 0 # initialize served demand
        self.info["operating_cost"] = 0 # initialize operating cost
        self.info['revenue'] = 0
@@ -187,42 +219,15 @@ class AMoD:
        self.paxAction = paxAction
 
        # serving passengers
-       satisfied_demand = np.zeros(self.number_nodes_spatial)
-       total_demand = np.zeros(self.number_nodes_spatial)
-       for origin in range(self.number_nodes_spatial):
-            for destination in range(self.number_nodes_spatial):
-                total_demand[origin] += self.demand[origin, destination][t]
-
-       for k in range(len(self.edges)):
-           i,j = self.edges[k]
-           i_region = i[0]
-           j_region = j[0]
-           if (i_region,j_region) not in self.demand or t not in self.demand[i_region,j_region] or self.paxAction[k]<1e-3 or i[1]<j[1]:
-               continue
-           if (paxAction[k] >= self.acc[i][t+1] + 1e-3):
-                paxAction[k] = self.acc[i][t+1]
-           if (paxAction[k] < 0): 
-                paxAction[k] = 0
-           self.paxAction[k] = min(self.acc[i][t+1], paxAction[k])
-           self.servedDemand[i_region,j_region][t] += self.paxAction[k] 
-           satisfied_demand[i_region] += self.paxAction[k]
-           self.paxFlow[i,j][t+self.G.edges[i,j]['time'][self.time]] = self.paxAction[k]
-           self.info["operating_cost"] += (self.G.edges[i,j]['time'][self.time]+ self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.paxAction[k]
-           self.acc[i][t+1] -= self.paxAction[k]
-           self.acc_spatial[i[0]][t+1] -= self.paxAction[k]
-           self.n_customer_vehicles_spatial[i[0]][t+1] += self.paxAction[k]
-           self.info['served_demand'] += self.paxAction[k]
-           self.dacc[j][t+self.G.edges[i,j]['time'][self.time]+self.scenario.time_normalizer] += self.paxFlow[i,j][t+self.G.edges[i,j]['time'][self.time]]
-           self.dacc_spatial[j_region][t+self.G.edges[i, j]['time'][self.time]+self.scenario.time_normalizer] += self.paxFlow[i, j][t+self.G.edges[i, j]['time'][self.time]]
-           self.reward += self.paxAction[k]*(self.price[i_region, j_region][t] - (self.G.edges[i, j]['time'][self.time]+self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep)
-           self.info['revenue'] += self.paxAction[k]*(self.price[i_region,j_region][t])
+       if self.step_engine is not None:
+           self.paxAction = np.asarray(paxAction, dtype=float)
+           self.reward = self.step_engine.serve_passengers(self.paxAction)
+       else:
+           self.serve_passengers_loop(paxAction)
        
        test_spatial_acc_count = np.zeros(self.number_nodes_spatial)
-       for n in self.nodes:
-            test_spatial_acc_count[n[0]] += self.acc[n][t+1]
-       for region in self.nodes_spatial:
-            assert abs(test_spatial_acc_count[region] - self.acc_spatial[region][t+1]) < 1e-5
-            # assert satisfied_demand[region] - total_demand[region] < 1e-5
+       np.add.at(test_spatial_acc_count, [n[0] for n in self.nodes], state.acc[:, t+1])
+       assert (np.abs(test_spatial_acc_count - state.acc_spatial[:, t+1]) < 1e-5).all()
 
        self.obs = (self.acc, self.time, self.dacc, self.demand) # for acc, the time index would be t+1, but for demand, the time index would be t
        self.obs_spatial = (self.acc_spatial, self.time, self.dacc_spatial, self.demand)
@@ -237,21 +242,73 @@ class AMoD:
         
         self.rebAction = rebAction      
         # rebalancing
+        if self.step_engine is not None:
+            self.rebAction = np.asarray(rebAction, dtype=float)
+            self.reward = self.step_engine.rebalance(self.rebAction)
+            # arrival for the next time step, executed in the last state of a time step
+            self.step_engine.arrive()
+        else:
+            self.rebalance_loop(rebAction)
+            self.arrive_loop()
+            
+        self.time += 1
+        # use self.time to index the next time step
+        self.obs = (self.acc, self.time, self.dacc, self.demand)
+        done = (self.tf == t+1) # if the episode is completed
+        return self.obs, self.reward, done, self.info
+    
+    # per-edge reference implementation of the passenger part of pax_step
+    def serve_passengers_loop(self, paxAction):
+       t = self.time
+       state = self.state
+       for k in range(len(self.edges)):
+           i,j = self.edges[k]
+           i_region = i[0]
+           j_region = j[0]
+           if (i_region,j_region) not in self.demand or t not in self.demand[i_region,j_region] or self.paxAction[k]<1e-3 or i[1]<j[1]:
+               continue
+           i_idx = self.node_index[i]
+           j_idx = self.node_index[j]
+           if (paxAction[k] >= state.acc[i_idx, t+1] + 1e-3):
+                paxAction[k] = state.acc[i_idx, t+1]
+           if (paxAction[k] < 0): 
+                paxAction[k] = 0
+           self.paxAction[k] = min(state.acc[i_idx, t+1], paxAction[k])
+           edge_time = int(self.edge_time[k, self.time])
+           state.served_demand[i_region*self.number_nodes_spatial + j_region, t] += self.paxAction[k]
+           state.pax_flow[k, t+edge_time] = self.paxAction[k]
+           self.info["operating_cost"] += (edge_time + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.paxAction[k]
+           state.acc[i_idx, t+1] -= self.paxAction[k]
+           state.acc_spatial[i_region, t+1] -= self.paxAction[k]
+           state.n_customer_vehicles_spatial[i_region, t+1] += self.paxAction[k]
+           self.info['served_demand'] += self.paxAction[k]
+           state.dacc[j_idx, t+edge_time+self.scenario.time_normalizer] += state.pax_flow[k, t+edge_time]
+           state.dacc_spatial[j_region, t+edge_time+self.scenario.time_normalizer] += state.pax_flow[k, t+edge_time]
+           self.reward += self.paxAction[k]*(self.price[i_region, j_region][t] - (edge_time+self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep)
+           self.info['revenue'] += self.paxAction[k]*(self.price[i_region,j_region][t])
+
+    # per-edge reference implementation of the rebalancing part of reb_step
+    def rebalance_loop(self, rebAction):
+        t = self.time
+        state = self.state
         for k in range(len(self.edges)):
             i,j = self.edges[k]    
             if (i,j) not in self.G.edges:
                 assert False
+            i_idx = self.node_index[i]
+            j_idx = self.node_index[j]
             # update the number of vehicles
-            assert rebAction[k] < self.acc[i][t+1] + 1e-3
+            assert rebAction[k] < state.acc[i_idx, t+1] + 1e-3
             if rebAction[k] < 1e-3:
                 continue
-            self.rebAction[k] = min(self.acc[i][t+1], rebAction[k])
+            self.rebAction[k] = min(state.acc[i_idx, t+1], rebAction[k])
+            edge_time = int(self.edge_time[k, self.time])
             
-            self.rebFlow[i,j][t+self.G.edges[i,j]['time'][self.time]] = self.rebAction[k]
-            self.dacc[j][t+self.G.edges[i,j]['time'][self.time]+self.scenario.time_normalizer] += self.rebFlow[i,j][t+self.G.edges[i,j]['time'][self.time]]
-            self.dacc_spatial[j[0]][t+self.G.edges[i,j]['time'][self.time]+self.scenario.time_normalizer] += self.rebFlow[i,j][t+self.G.edges[i,j]['time'][self.time]]
-            self.acc[i][t+1] -= self.rebAction[k] 
-            self.acc_spatial[i[0]][t+1] -= self.rebAction[k]
+            state.reb_flow[k, t+edge_time] = self.rebAction[k]
+            state.dacc[j_idx, t+edge_time+self.scenario.time_normalizer] += state.reb_flow[k, t+edge_time]
+            state.dacc_spatial[j[0], t+edge_time+self.scenario.time_normalizer] += state.reb_flow[k, t+edge_time]
+            state.acc[i_idx, t+1] -= self.rebAction[k] 
+            state.acc_spatial[i[0], t+1] -= self.rebAction[k]
             # charging edge
             if i[1] < j[1] and self.rebAction[k] > 0 and i[0] == j[0]:
                 charge_difference = j[1] - i[1]
@@ -262,108 +319,95 @@ class AMoD:
                 self.reward -= avg_energy_price * self.rebAction[k]*charge_difference
                 # we have to add plus one because charging starts in the next timestep
                 for future_time in range(t+1, t+charge_time+1):
-                    self.scenario.cars_charging_per_station[i[0]][future_time] += self.rebAction[k]
-                    assert self.scenario.cars_charging_per_station[i[0]][future_time] - self.scenario.cars_per_station_capacity[i[0]] < 1e-7
-                    self.n_charging_vehicles_spatial[i[0]][future_time] += self.rebAction[k]
+                    state.charging[i[0], future_time] += self.rebAction[k]
+                    assert state.charging[i[0], future_time] - self.scenario.cars_per_station_capacity[i[0]] < 1e-7
+                    state.n_charging_vehicles_spatial[i[0], future_time] += self.rebAction[k]
             
             # road and charging edge
             elif i[1] - self.scenario.energy_distance[i[0], j[0]] < j[1] and i[0] != j[0] and self.rebAction[k] > 0:
-                self.n_rebal_vehicles_spatial[i[0]][t+1] += self.rebAction[k]
+                state.n_rebal_vehicles_spatial[i[0], t+1] += self.rebAction[k]
                 charge_difference = j[1] - i[1] + self.scenario.energy_distance[i[0], j[0]]
                 charge_time = math.ceil(charge_difference/self.scenario.charge_levels_per_charge_step)
                 avg_energy_price = np.mean(self.scenario.p_energy[self.time:self.time+charge_time])
     
-                self.info['spatial_rebalancing_cost'] += (self.G.edges[i,j]['time'][self.time] + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
-                self.info["operating_cost"] += (self.G.edges[i,j]['time'][self.time] + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
-                self.info['rebalancing_cost'] += (self.G.edges[i,j]['time'][self.time] + self.scenario.time_normalizer - charge_time)*self.scenario.operational_cost_per_timestep*self.rebAction[k] + avg_energy_price * self.rebAction[k]*charge_difference
+                self.info['spatial_rebalancing_cost'] += (edge_time + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
+                self.info["operating_cost"] += (edge_time + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
+                self.info['rebalancing_cost'] += (edge_time + self.scenario.time_normalizer - charge_time)*self.scenario.operational_cost_per_timestep*self.rebAction[k] + avg_energy_price * self.rebAction[k]*charge_difference
                 
                 # we have to add plus one because charging starts in the next timestep
                 for future_time in range(t+1, t+charge_time+1):
-                    self.scenario.cars_charging_per_station[i[0]][future_time] += self.rebAction[k]
-                    assert self.scenario.cars_charging_per_station[i[0]][future_time] - self.scenario.cars_per_station_capacity[i[0]] < 1e-7
-                    self.n_charging_vehicles_spatial[i[0]][future_time] += self.rebAction[k]
-                self.reward -= avg_energy_price * self.rebAction[k]*charge_difference + (self.G.edges[i,j]['time'][self.time]+self.scenario.time_normalizer - charge_time)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
+                    state.charging[i[0], future_time] += self.rebAction[k]
+                    assert state.charging[i[0], future_time] - self.scenario.cars_per_station_capacity[i[0]] < 1e-7
+                    state.n_charging_vehicles_spatial[i[0], future_time] += self.rebAction[k]
+                self.reward -= avg_energy_price * self.rebAction[k]*charge_difference + (edge_time+self.scenario.time_normalizer - charge_time)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
             
             # road edge
             elif self.rebAction[k] > 0:
-                self.n_rebal_vehicles_spatial[i[0]][t+1] += self.rebAction[k]
+                state.n_rebal_vehicles_spatial[i[0], t+1] += self.rebAction[k]
 
-                self.info['rebalancing_cost'] += (self.G.edges[i,j]['time'][self.time] + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
-                self.info['spatial_rebalancing_cost'] += (self.G.edges[i,j]['time'][self.time] + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
-                self.info["operating_cost"] += (self.G.edges[i,j]['time'][self.time] + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
+                self.info['rebalancing_cost'] += (edge_time + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
+                self.info['spatial_rebalancing_cost'] += (edge_time + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
+                self.info["operating_cost"] += (edge_time + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
                 
-                self.reward -= (self.G.edges[i,j]['time'][self.time] + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
+                self.reward -= (edge_time + self.scenario.time_normalizer)*self.scenario.operational_cost_per_timestep*self.rebAction[k]
+
+    def arrive_loop(self):
+        t = self.time
+        state = self.state
         # arrival for the next time step, executed in the last state of a time step
         for k in range(len(self.edges)):
             o, d = self.edges[k]
-            if (o, d) in self.rebFlow and t in self.rebFlow[o, d]:
-                self.acc[d][t+1] += self.rebFlow[o, d][t]
-                self.acc_spatial[d[0]][t+1] += self.rebFlow[o, d][t]
-                # check if charging capacity has freed up
-                if d[1] > o[1] and o[0] == d[0]:
-                    continue
-                else:
-                    self.n_rebal_vehicles_spatial[o[0]][t+1] -= self.rebFlow[o, d][t]
-
-            if (o, d) in self.paxFlow and t in self.paxFlow[o, d]:
-                self.acc[d][t+1] += self.paxFlow[o, d][t]
-                self.acc_spatial[d[0]][t+1] += self.paxFlow[o, d][t]
-                self.n_customer_vehicles_spatial[o[0]][t+1] -= self.paxFlow[o, d][t]
-            
-        self.time += 1
-        # use self.time to index the next time step
-        self.obs = (self.acc, self.time, self.dacc, self.demand)
-        done = (self.tf == t+1) # if the episode is completed
-        return self.obs, self.reward, done, self.info
+            d_idx = self.node_index[d]
+            state.acc[d_idx, t+1] += state.reb_flow[k, t]
+            state.acc_spatial[d[0], t+1] += state.reb_flow[k, t]
+            # check if charging capacity has freed up
+            if not (d[1] > o[1] and o[0] == d[0]):
+                state.n_rebal_vehicles_spatial[o[0], t+1] -= state.reb_flow[k, t]
+
+            state.acc[d_idx, t+1] += state.pax_flow[k, t]
+            state.acc_spatial[d[0], t+1] += state.pax_flow[k, t]
+            state.n_customer_vehicles_spatial[o[0], t+1] -= state.pax_flow[k, t]
     
     def reset(self, bool_sample_demand=True):
         # reset the episode
-        self.acc = defaultdict(dict)
-        self.acc_spatial = defaultdict(dict)
-        self.n_rebal_vehicles_spatial = defaultdict(dict)
-        self.n_customer_vehicles_spatial = defaultdict(dict)
-        
-        self.dacc = defaultdict(dict)
-        self.rebFlow = defaultdict(dict)
-        self.paxFlow = defaultdict(dict)
-        self.demand = defaultdict(dict)  # demand
-        self.price = defaultdict(dict)  # price
-        self.reset_cars_charging()
-
-        tripAttr = self.scenario.get_random_demand(bool_sample_demand)
-        # trip attribute (origin, destination, time of request, demand, price)
-        for i, j, t, d, p in tripAttr:
-            self.demand[i, j][t] = d
-            self.price[i, j][t] = p
+        # demand / price of every (origin region, destination region, t) are drawn as arrays from the environment's Generator
+        self.demand_array, self.price_array = self.scenario.sample_demand(self.rng, bool_sample_demand)
+        self.create_demand_views()
 
         self.time = 0
-        for i, j in self.G.edges:
-            self.rebFlow[i, j] = defaultdict(float)
-            self.paxFlow[i, j] = defaultdict(float)
-        for n in self.G:
-            self.acc[n][0] = self.G.nodes[n]['accInit']
-            self.dacc[n] = defaultdict(float)
-        for n_spatial in self.nodes_spatial:
-            self.acc_spatial[n_spatial][0] = self.G_spatial.nodes[n_spatial]['accInit']
-            self.dacc_spatial[n_spatial] = defaultdict(float)
-            self.n_rebal_vehicles_spatial[n_spatial][0] = 0
-            self.n_customer_vehicles_spatial[n_spatial][0] = 0
-        for i, j in self.demand:
-            self.servedDemand[i, j] = defaultdict(float)
+        self.reset_state()
         self.obs = (self.acc, self.time, self.dacc, self.demand)
         self.reward = 0
         return self.obs
 
-    def reset_cars_charging(self):
-        self.scenario.cars_charging_per_station = defaultdict(dict)
-        self.n_charging_vehicles_spatial = defaultdict(dict)
-        for region in range(self.scenario.spatial_nodes):
-            self.scenario.cars_charging_per_station[region] = defaultdict(float)
-            self.n_charging_vehicles_spatial[region] = defaultdict(float)
-            for t in range(self.scenario.tf):
-                self.scenario.cars_charging_per_station[region][t] = 0.
-                self.n_charging_vehicles_spatial[region][t] = 0.
+    def create_demand_views(self):
+        # demand / price as key (i,j) - (origin region, destination region), t - time mappings over the arrays
+        self.demand = ArrayView(self.demand_array.reshape(len(self.od_pairs), -1), self.od_pairs)
+        self.price = ArrayView(self.price_array.reshape(len(self.od_pairs), -1), self.od_pairs)
+
+    def snapshot(self):
+        # copy of the episode state (time, vehicles, in-flight flows, charger occupancy, demand Generator state) that
+        # restore() can return to any number of times, e.g. for lookahead rollouts or fast resets
+        return AMoDSnapshot(self.time, self.state.pack(), self.rng.bit_generator.state,
+                            (self.demand, self.price, self.demand_array, self.price_array), dict(self.info), self.reward)
+
+    def restore(self, snapshot):
+        # return to a state taken by snapshot(); the state arrays are overwritten in place
+        self.time = snapshot.time
+        self.state.unpack(snapshot.state)
+        self.rng.bit_generator.state = snapshot.random_state
+        self.demand, self.price, self.demand_array, self.price_array = snapshot.demand
+        self.info = dict(snapshot.info)
+        self.reward = snapshot.reward
+        if self.step_engine is not None:
+            self.step_engine.reset_arrivals()
+        self.obs = (self.acc, self.time, self.dacc, self.demand)
+        self.obs_spatial = (self.acc_spatial, self.time, self.dacc_spatial, self.demand)
+        return self.obs
 
+    def reset_cars_charging(self):
+        self.state.charging.fill(0.)
+        self.state.n_charging_vehicles_spatial.fill(0.)
 
 
 class Scenario:
@@ -514,6 +558,28 @@ class Scenario:
                         for t in range(0, self.tf+1):
                             self.G.edges[(o, c), (d, target_charge)]['time'][t] = math.ceil(self.rebTime[o, d][t]) - self.time_normalizer
         
+    def demand_tables(self):
+        # mean demand and price [origin region, destination region, t] for t < 2*tf, restricted to region pairs
+        # connected by an edge (the pairs get_random_demand samples), built once per scenario
+        if getattr(self, 'demand_tables_cache', None) is None:
+            horizon = 2*self.tf
+            mean = np.zeros((self.spatial_nodes, self.spatial_nodes, horizon))
+            price = np.zeros((self.spatial_nodes, self.spatial_nodes, horizon))
+            for o, d in set((i[0], j[0]) for i, j in self.edges):
+                if (o, d) in self.demand_input:
+                    times = [t for t in self.demand_input[o, d].keys() if 0 <= t < horizon]
+                    mean[o, d, times] = [self.demand_input[o, d][t] for t in times]
+                    price[o, d, times] = [self.p[o, d][t] for t in times]
+            self.demand_tables_cache = (mean, price)
+        return self.demand_tables_cache
+
+    def sample_demand(self, rng, bool_random=True):
+        # demand [R, R, 2*tf] (one Poisson draw per region pair and time step from rng, or the mean demand) and price
+        mean, price = self.demand_tables()
+        demand = rng.poisson(mean).astype(float) if bool_random else mean.copy()
+        return demand, price
+
+    # per-edge sampler using the global np.random state, the reference of sample_demand in tests/test_demand_sampling.py
     def get_random_demand(self, bool_random = True):
         # generate demand and price
         # reset = True means that the function is called in the reset() method of AMoD enviroment,
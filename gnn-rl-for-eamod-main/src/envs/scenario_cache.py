@@ -0,0 +1,207 @@
+"""
+Compiled Scenario Cache
+-----------------------
+This file contains the compiled (array) format of a Scenario. In particular, we implement:
+(1) compile_scenario / load_compiled_scenario
+    Save a built Scenario as node/edge tables, travel-time matrices, demand and price tensors [o, d, t],
+    rebalancing times, energy prices, charger capacities and accInit in one uncompressed .npz file, and turn
+    such a file back into a Scenario without re-running the graph construction.
+(2) load_or_create_scenario
+    Cache lookup keyed by a hash of the scenario JSON, the energy-distance .npy, the seed and the code that builds
+    the scenario (the given create_scenario function and the Scenario class); falls back to create_scenario on a
+    miss and stores the result next to the JSON file.
+
+The global NumPy random state after construction is stored as well, so demand sampled after loading from the
+cache is identical to demand sampled after a fresh build. Files are written under a temporary name and renamed,
+so concurrent runs and workers never read a partial file.
+
+The arrays are loaded eagerly rather than memory-mapped: a compiled scenario is a few hundred KB (NY_5: ~250 KB)
+and every array is turned into networkx graphs and dicts right away, so a memory map would only defer the same
+read by a few lines.
+"""
+import hashlib
+import inspect
+import json
+import os
+from collections import defaultdict
+import networkx as nx
+import numpy as np
+from src.envs.amod_env import Scenario
+
+# bump when the compiled layout changes (changes of the construction code are part of the key)
+CACHE_VERSION = 1
+
+SCALARS = ('sd', 'EV', 'time_normalizer', 'time_granularity', 'operational_cost_per_timestep', 'spatial_nodes',
+           'number_charge_levels', 'charge_levels_per_charge_step', 'time', 'is_json', 'trip_length_preference',
+           'grid_travel_time', 'tf')
+
+
+def _update_code(digest, code):
+    """
+    Hashes the bytecode, names and constants of a code object and of the functions / lambdas nested in it
+    (the repr of a nested code object contains its memory address).
+    """
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            _update_code(digest, const)
+        else:
+            digest.update(repr(const).encode())
+
+
+def _update_function(digest, function):
+    digest.update(f"{function.__module__}.{function.__qualname__}".encode())
+    _update_code(digest, function.__code__)
+    digest.update(repr(function.__defaults__).encode())
+
+
+def scenario_key(json_file_path, energy_file_path, seed, create_scenario=None):
+    digest = hashlib.sha1()
+    for path in (json_file_path, energy_file_path):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    digest.update(f"seed={seed};version={CACHE_VERSION}".encode())
+    # construction code: the arguments create_scenario passes to Scenario and the Scenario methods themselves
+    if create_scenario is not None:
+        _update_function(digest, create_scenario)
+    for name, function in sorted(vars(Scenario).items()):
+        if inspect.isfunction(function):
+            _update_function(digest, function)
+    return digest.hexdigest()[:16]
+
+
+def compiled_path(json_file_path, energy_file_path, seed, create_scenario=None):
+    stem = os.path.splitext(os.path.basename(json_file_path))[0]
+    key = scenario_key(json_file_path, energy_file_path, seed, create_scenario)
+    return os.path.join(os.path.dirname(json_file_path), f"{stem}_{key}.scenario.npz")
+
+
+def _pair_tensor(nested, pairs, horizon):
+    """
+    Dense [pair, t] values plus the insertion order of the time keys of every pair (-1 padded).
+    """
+    values = np.zeros((len(pairs), horizon))
+    keys = -np.ones((len(pairs), horizon), dtype=np.int64)
+    for k, pair in enumerate(pairs):
+        times = list(nested[pair].keys())
+        keys[k, :len(times)] = times
+        values[k, times] = [nested[pair][t] for t in times]
+    return values, keys
+
+
+def _pair_dicts(pairs, keys, values_list, factories):
+    dicts = tuple(defaultdict(dict) for _ in values_list)
+    for k, pair in enumerate(pairs):
+        times = keys[k][keys[k] >= 0]
+        for nested, values in zip(dicts, values_list):
+            nested[pair] = factories[k]()
+            row = values[k].tolist()
+            for t in times.tolist():
+                nested[pair][t] = row[t]
+    return dicts
+
+
+def compile_scenario(scenario, path, random_state=None):
+    """
+    Writes `scenario` to `path`. random_state is the np.random state to restore on load (default: current one).
+    The file is written under a temporary name in the same directory and renamed, readers never see a partial file.
+    """
+    nodes = list(scenario.G.nodes)
+    edges = list(scenario.G.edges)
+    nodes_spatial = list(scenario.G_spatial.nodes)
+    edges_spatial = list(scenario.G_spatial.edges)
+    tf = scenario.tf
+
+    demand_pairs = list(scenario.demand_input.keys())
+    assert list(scenario.p.keys()) == demand_pairs
+    horizon = max(max(scenario.demand_input[pair].keys(), default=0) for pair in demand_pairs) + 1
+    demand, demand_keys = _pair_tensor(scenario.demand_input, demand_pairs, horizon)
+    price, price_keys = _pair_tensor(scenario.p, demand_pairs, horizon)
+    assert (demand_keys == price_keys).all()
+    reb_pairs = list(scenario.rebTime.keys())
+    reb_time, reb_keys = _pair_tensor(scenario.rebTime, reb_pairs, tf + 1)
+
+    if random_state is None:
+        random_state = np.random.get_state()
+    meta = {key: getattr(scenario, key) for key in SCALARS}
+    meta['random_state'] = [random_state[0], int(random_state[2]), int(random_state[3]), float(random_state[4])]
+    meta['demand_is_defaultdict'] = [isinstance(scenario.demand_input[pair], defaultdict) for pair in demand_pairs]
+    meta['charging_stations'] = [bool(c) for c in scenario.charging_stations]
+    meta['cars_per_station_capacity'] = list(scenario.cars_per_station_capacity)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f,
+                 meta=np.array(json.dumps(meta)),
+                 trip_attr=np.array(json.dumps(scenario.tripAttr)),
+                 nodes=np.array(nodes, dtype=np.int64).reshape(-1, 2),
+                 node_acc_init=np.array([scenario.G.nodes[n]['accInit'] for n in nodes], dtype=np.int64),
+                 edges=np.array(edges, dtype=np.int64).reshape(-1, 4),
+                 edge_time=np.array([[scenario.G.edges[e]['time'][t] for t in range(tf + 1)] for e in edges], dtype=np.int64).reshape(-1, tf + 1),
+                 nodes_spatial=np.array(nodes_spatial, dtype=np.int64),
+                 node_spatial_acc_init=np.array([scenario.G_spatial.nodes[n]['accInit'] for n in nodes_spatial], dtype=np.int64),
+                 edges_spatial=np.array(edges_spatial, dtype=np.int64).reshape(-1, 2),
+                 edge_spatial_time=np.array([[scenario.G_spatial.edges[e]['time'][t] for t in range(tf + 1)] for e in edges_spatial], dtype=np.int64).reshape(-1, tf + 1),
+                 demand_pairs=np.array(demand_pairs, dtype=np.int64).reshape(-1, 2),
+                 demand=demand, price=price, demand_keys=demand_keys,
+                 reb_pairs=np.array(reb_pairs, dtype=np.int64).reshape(-1, 2),
+                 reb_time=reb_time.astype(np.int64), reb_keys=reb_keys,
+                 energy_distance=np.asarray(scenario.energy_distance),
+                 p_energy=np.asarray(scenario.p_energy),
+                 random_state_keys=np.asarray(random_state[1]))
+    os.replace(tmp_path, path)
+
+
+def load_compiled_scenario(path, restore_random_state=True):
+    """
+    Builds a Scenario from a compiled file without re-running add_charge_edges / add_road_edges.
+    """
+    with np.load(path) as data:
+        data = dict(data)
+    meta = json.loads(str(data['meta']))
+    scenario = object.__new__(Scenario)
+    for key in SCALARS:
+        setattr(scenario, key, meta[key])
+    tf = scenario.tf
+    scenario.charging_stations = meta['charging_stations']
+    scenario.cars_per_station_capacity = meta['cars_per_station_capacity']
+    scenario.cars_charging_per_station = defaultdict(dict)
+    scenario.intermediate_charging_station = defaultdict(dict)
+    scenario.energy_distance = data['energy_distance']
+    scenario.p_energy = data['p_energy']
+    scenario.tripAttr = json.loads(str(data['trip_attr']))
+
+    scenario.G = nx.DiGraph()
+    scenario.G.add_nodes_from((tuple(n), {'accInit': acc}) for n, acc in zip(data['nodes'].tolist(), data['node_acc_init'].tolist()))
+    scenario.G.add_edges_from(((o_region, o_charge), (d_region, d_charge), {'time': dict(enumerate(times))})
+                              for (o_region, o_charge, d_region, d_charge), times in zip(data['edges'].tolist(), data['edge_time'].tolist()))
+    scenario.G_spatial = nx.DiGraph()
+    scenario.G_spatial.add_nodes_from((n, {'accInit': acc}) for n, acc in zip(data['nodes_spatial'].tolist(), data['node_spatial_acc_init'].tolist()))
+    scenario.G_spatial.add_edges_from((o, d, {'time': dict(enumerate(times))})
+                                      for (o, d), times in zip(data['edges_spatial'].tolist(), data['edge_spatial_time'].tolist()))
+    scenario.edges = list(scenario.G.edges)
+
+    demand_pairs = [tuple(pair) for pair in data['demand_pairs'].tolist()]
+    factories = [(lambda: defaultdict(float)) if is_default else dict for is_default in meta['demand_is_defaultdict']]
+    scenario.demand_input, scenario.p = _pair_dicts(demand_pairs, data['demand_keys'], (data['demand'], data['price']), factories)
+    reb_pairs = [tuple(pair) for pair in data['reb_pairs'].tolist()]
+    scenario.rebTime, = _pair_dicts(reb_pairs, data['reb_keys'], (data['reb_time'],), [dict] * len(reb_pairs))
+
+    if restore_random_state:
+        name, pos, has_gauss, cached_gaussian = meta['random_state']
+        np.random.set_state((name, data['random_state_keys'], pos, has_gauss, cached_gaussian))
+    return scenario
+
+
+def load_or_create_scenario(create_scenario, json_file_path, energy_file_path, seed=10):
+    """
+    Returns the compiled scenario for (json, npy, seed) if it exists, otherwise builds it with
+    create_scenario(json_file_path, energy_file_path, seed) and compiles it for the next start.
+    """
+    path = compiled_path(json_file_path, energy_file_path, seed, create_scenario)
+    if os.path.exists(path):
+        return load_compiled_scenario(path)
+    scenario = create_scenario(json_file_path, energy_file_path, seed)
+    compile_scenario(scenario, path)
+    return scenario
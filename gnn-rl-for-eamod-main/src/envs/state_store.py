@@ -0,0 +1,209 @@
+"""
+Array-backed AMoD state
+-----------------------
+This file contains the compact state backend of the AMoD simulator. In particular, we implement:
+(1) AMoDState
+    Preallocated NumPy arrays indexed by [node_idx, t], [region_idx, t] and [edge_idx, t].
+(2) ArrayView
+    Read-only mapping view (key -> time -> value) over one of these arrays, so that callers written
+    against the old nested dicts (e.g. env.acc[n][t], dictsum) keep working unchanged.
+(3) ChargerOccupancy
+    Charging timeline of every station on top of AMoDState.charging: range additions with a vectorized
+    capacity check, free capacity at one step and windows over several steps.
+(4) AMoDSnapshot
+    Flat copy of a mid-episode environment, taken by AMoD.snapshot and applied by AMoD.restore.
+"""
+from collections.abc import Mapping
+import numpy as np
+
+
+class TimeSeriesView(Mapping):
+    """
+    Read-only view of one row of a [key, t] array. Times outside the stored horizon read as 0.
+    """
+    __slots__ = ('_array', '_row')
+
+    def __init__(self, array, row):
+        self._array = array
+        self._row = row
+
+    def __getitem__(self, t):
+        if 0 <= t < self._array.shape[1]:
+            return float(self._array[self._row, t])
+        return 0.
+
+    def __contains__(self, t):
+        return 0 <= t < self._array.shape[1]
+
+    def __iter__(self):
+        return iter(range(self._array.shape[1]))
+
+    def __len__(self):
+        return self._array.shape[1]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class ArrayView(Mapping):
+    """
+    Read-only mapping view key -> TimeSeriesView over a [key, t] array.
+    """
+
+    def __init__(self, array, keys):
+        self._array = array
+        self._keys = list(keys)
+        self._index = {key: idx for idx, key in enumerate(self._keys)}
+        self._rows = [TimeSeriesView(array, idx) for idx in range(len(self._keys))]
+
+    def __getitem__(self, key):
+        return self._rows[self._index[key]]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"ArrayView(keys={len(self._keys)}, horizon={self._array.shape[1]})"
+
+    def to_dict(self):
+        """
+        Plain nested dict copy of the view (e.g. for pickling results).
+        """
+        return {key: dict(enumerate(self._array[idx].tolist())) for idx, key in enumerate(self._keys)}
+
+
+class AMoDState:
+    """
+    Vehicle state of one AMoD episode stored in preallocated arrays of shape [*, horizon].
+    With batch_shape=(N,) every array gets a leading episode axis, and view(i) returns the state of episode i
+    sharing memory with the stacked arrays.
+    """
+    fields = ('acc', 'dacc', 'acc_spatial', 'dacc_spatial', 'n_charging_vehicles_spatial', 'n_rebal_vehicles_spatial',
+              'n_customer_vehicles_spatial', 'charging', 'reb_flow', 'pax_flow', 'served_demand')
+
+    def __init__(self, number_nodes, number_nodes_spatial, number_edges, number_od_pairs, horizon, batch_shape=()):
+        self.horizon = horizon
+        batch_shape = tuple(batch_shape)
+        # number of vehicles within / arriving at each charge node
+        self.acc = np.zeros(batch_shape + (number_nodes, horizon))
+        self.dacc = np.zeros(batch_shape + (number_nodes, horizon))
+        # number of vehicles within / arriving at each spatial node
+        self.acc_spatial = np.zeros(batch_shape + (number_nodes_spatial, horizon))
+        self.dacc_spatial = np.zeros(batch_shape + (number_nodes_spatial, horizon))
+        self.n_charging_vehicles_spatial = np.zeros(batch_shape + (number_nodes_spatial, horizon))
+        self.n_rebal_vehicles_spatial = np.zeros(batch_shape + (number_nodes_spatial, horizon))
+        self.n_customer_vehicles_spatial = np.zeros(batch_shape + (number_nodes_spatial, horizon))
+        # number of vehicles occupying a charger at each spatial node
+        self.charging = np.zeros(batch_shape + (number_nodes_spatial, horizon))
+        # rebalancing / passenger flows indexed by arrival time
+        self.reb_flow = np.zeros(batch_shape + (number_edges, horizon))
+        self.pax_flow = np.zeros(batch_shape + (number_edges, horizon))
+        # served demand per (origin region, destination region) pair
+        self.served_demand = np.zeros(batch_shape + (number_od_pairs, horizon))
+
+    @classmethod
+    def like(cls, state, batch_shape=()):
+        """
+        Zero state with the same per-episode shapes as `state`.
+        """
+        return cls(state.acc.shape[-2], state.acc_spatial.shape[-2], state.reb_flow.shape[-2],
+                   state.served_demand.shape[-2], state.horizon, batch_shape)
+
+    def view(self, idx):
+        state = object.__new__(AMoDState)
+        state.horizon = self.horizon
+        for field in self.fields:
+            setattr(state, field, getattr(self, field)[idx])
+        return state
+
+    def arrays(self):
+        return tuple(getattr(self, field) for field in self.fields)
+
+    def pack(self):
+        """
+        Copy of all fields stacked along the key axis, [..., rows, horizon].
+        """
+        return np.concatenate(self.arrays(), axis=-2)
+
+    def unpack(self, packed):
+        """
+        Inverse of pack. Writes into the existing arrays, so a state bound to a batch slice stays bound.
+        """
+        start = 0
+        for array in self.arrays():
+            rows = array.shape[-2]
+            array[...] = packed[..., start:start + rows, :]
+            start += rows
+
+    def copy_from(self, state):
+        for field in self.fields:
+            getattr(self, field)[...] = getattr(state, field)
+
+    def reset(self):
+        for array in self.arrays():
+            array.fill(0.)
+
+
+class ChargerOccupancy:
+    """
+    Vehicles charging at every station, [region, t], stored in state.charging, and the station capacities.
+    The cells of one add() are accumulated in the given order, so they round exactly like
+    `occupancy[region][t] += amount` in a loop over the sessions.
+    """
+
+    def __init__(self, state, capacity):
+        self.state = state
+        self.capacity = np.asarray(capacity, dtype=float)
+
+    def add(self, regions, start, durations, amounts):
+        """
+        Occupies a charger of regions[k] with amounts[k] vehicles for durations[k] steps from start (scalar or
+        [K]) on and checks the capacities. Returns the touched cells (regions, times) and their amounts.
+        """
+        durations = np.asarray(durations, dtype=np.int64)
+        offsets = np.arange(durations.sum()) - np.repeat(np.cumsum(durations) - durations, durations)
+        regions = np.repeat(regions, durations)
+        times = np.repeat(np.broadcast_to(start, durations.shape), durations) + offsets
+        amounts = np.repeat(amounts, durations)
+        np.add.at(self.state.charging, (regions, times), amounts)
+        assert (self.state.charging[regions, times] - self.capacity[regions] < 1e-7).all()
+        return regions, times, amounts
+
+    def free(self, t):
+        """
+        Chargers still available at every region at step t, [region].
+        """
+        return self.capacity - self.state.charging[:, t]
+
+    def window(self, start, length):
+        """
+        Occupancy for t = start..start+length-1, [region, length]; steps after the horizon are 0.
+        """
+        window = np.zeros((len(self.capacity), length))
+        stop = min(start + length, self.state.horizon)
+        if stop > start:
+            window[:, :stop - start] = self.state.charging[:, start:stop]
+        return window
+
+
+class AMoDSnapshot:
+    """
+    Episode state of one AMoD environment as a few flat arrays: time, the packed AMoDState (including the
+    charger occupancy) and the state of the demand Generator. Demand and price are kept by reference, since
+    AMoD.reset replaces them instead of modifying them.
+    """
+    __slots__ = ('time', 'state', 'random_state', 'demand', 'info', 'reward')
+
+    def __init__(self, time, state, random_state, demand, info, reward):
+        self.time = time
+        self.state = state
+        self.random_state = random_state
+        self.demand = demand
+        self.info = info
+        self.reward = reward
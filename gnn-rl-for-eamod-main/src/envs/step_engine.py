@@ -0,0 +1,239 @@
+"""
+Vectorized AMoD step engine
+---------------------------
+This file contains the NumPy implementation of the per-edge loops in AMoD.pax_step and AMoD.reb_step.
+In particular, we implement:
+(1) sequential_sum
+    Left-to-right accumulation, matching `x += term` inside a Python loop (np.sum is pairwise).
+(2) StepEngine
+    Precomputes per-edge origin/destination indices, travel times, energy deltas and edge-type masks once
+    and applies clipping, revenue, operating cost and charging cost with scatter-adds. Departing flows are
+    queued in a ring buffer indexed by arrival step mod number of slots, so the arrivals of a step are applied
+    in O(arrivals) instead of a scan over all edges.
+
+All accumulations (np.add.at / np.subtract.at / np.add.accumulate) are applied in edge order, so rewards,
+info and state are bit-for-bit identical to the loop version.
+"""
+import math
+import numpy as np
+
+
+def sequential_sum(start, terms, ufunc=np.add):
+    """
+    start (+/-) terms[0] (+/-) terms[1] ..., accumulated left to right.
+    """
+    if len(terms) == 0:
+        return start
+    return ufunc.accumulate(np.concatenate(([start], terms)))[-1]
+
+
+class StepEngine:
+    """
+    Edge arrays of one AMoD environment and vectorized passenger / rebalancing / arrival updates.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        scenario = env.scenario
+        R = env.number_nodes_spatial
+        self.origin_idx = np.array([env.node_index[o] for o, d in env.edges], dtype=np.int64)
+        self.destination_idx = np.array([env.node_index[d] for o, d in env.edges], dtype=np.int64)
+        self.origin_region = np.array([o[0] for o, d in env.edges], dtype=np.int64)
+        self.destination_region = np.array([d[0] for o, d in env.edges], dtype=np.int64)
+        origin_charge = np.array([o[1] for o, d in env.edges], dtype=np.int64)
+        destination_charge = np.array([d[1] for o, d in env.edges], dtype=np.int64)
+        self.od_idx = self.origin_region * R + self.destination_region
+        # travel time of every edge at every time step, [edge_idx, t]
+        self.edge_time = env.edge_time
+        energy_distance = np.asarray(scenario.energy_distance)[self.origin_region, self.destination_region]
+
+        # edge types, evaluated in the same order as the branches of the loop version
+        self.pax_edge = origin_charge >= destination_charge
+        same_region = self.origin_region == self.destination_region
+        self.charge_edge = (origin_charge < destination_charge) & same_region
+        self.road_charge_edge = ~self.charge_edge & (origin_charge - energy_distance < destination_charge) & ~same_region
+        self.road_edge = ~self.charge_edge & ~self.road_charge_edge
+        # arriving flows on these edges free rebalancing vehicles (i.e. everything but pure charging arrivals)
+        self.rebal_arrival_edge = ~((destination_charge > origin_charge) & same_region)
+
+        # energy deltas and charge durations of edges that charge
+        self.charge_difference = np.zeros(len(env.edges))
+        self.charge_time = np.zeros(len(env.edges), dtype=np.int64)
+        for k in np.flatnonzero(self.charge_edge | self.road_charge_edge):
+            if self.charge_edge[k]:
+                charge_difference = destination_charge[k] - origin_charge[k]
+            else:
+                charge_difference = destination_charge[k] - origin_charge[k] + scenario.energy_distance[self.origin_region[k], self.destination_region[k]]
+            self.charge_difference[k] = charge_difference
+            self.charge_time[k] = math.ceil(charge_difference/scenario.charge_levels_per_charge_step)
+
+        # arrival ring buffer: slot step % arrival_slots holds the edges whose flows arrive after that step
+        self.arrival_slots = int(self.edge_time.max(initial=0)) + 1
+        self.arrivals = [[] for _ in range(self.arrival_slots)]
+        self.reset_arrivals()
+
+    def reset_arrivals(self):
+        """
+        Refills the ring buffer from the flows of the state that have not arrived yet (after a reset or restore).
+        """
+        state = self.env.state
+        t = self.env.time
+        self.arrivals = [[] for _ in range(self.arrival_slots)]
+        for step in range(t, min(t + self.arrival_slots, state.horizon)):
+            self.arrivals[step % self.arrival_slots].append(np.flatnonzero((state.reb_flow[:, step] != 0) | (state.pax_flow[:, step] != 0)))
+
+    def schedule_arrivals(self, idx, steps):
+        """
+        Queues the edges idx whose flows arrive after steps (departure step plus travel time, [len(idx)]).
+        """
+        slots = steps % self.arrival_slots
+        for slot in np.unique(slots):
+            self.arrivals[slot].append(idx[slots == slot])
+
+    def clip_outflows(self, acc, actions, idx, pax):
+        """
+        Clips actions[idx] to the vehicles left at each origin node. Edges are visited in order and each one
+        sees the accumulation left by the previous edges of the same node, exactly like the loop version.
+        Only nodes whose outflow gets within rounding distance of the accumulation are replayed in Python.
+        """
+        origin = self.origin_idx[idx]
+        values = actions[idx]
+        order = np.argsort(origin, kind='stable')
+        origin_sorted = origin[order]
+        used = np.cumsum(values[order])
+        used_before = used - values[order]
+        used_before -= used_before[np.searchsorted(origin_sorted, origin_sorted, side='left')]
+        remaining = np.empty(len(idx))
+        remaining[order] = acc[origin_sorted] - used_before
+        tolerance = 1e-6 * (1. + np.abs(acc[origin]))
+        near_binding = ~(values < remaining - tolerance)
+        if not near_binding.any():
+            return values.copy()
+
+        clipped = values.copy()
+        for node in np.unique(origin[near_binding]):
+            left = acc[node]
+            for m in np.flatnonzero(origin == node):
+                value = actions[idx[m]]
+                if pax:
+                    if value >= left + 1e-3:
+                        value = left
+                    if value < 0:
+                        value = 0
+                else:
+                    assert value < left + 1e-3
+                value = min(left, value)
+                clipped[m] = value
+                left -= value
+        return clipped
+
+    def serve_passengers(self, paxAction):
+        env = self.env
+        state = env.state
+        scenario = env.scenario
+        t = env.time
+        od_active = np.array([od in env.demand and t in env.demand[od] for od in env.od_pairs])
+        price = np.array([env.price[od][t] if od_active[od_idx] else 0. for od_idx, od in enumerate(env.od_pairs)])
+        idx = np.flatnonzero(od_active[self.od_idx] & ~(paxAction < 1e-3) & self.pax_edge)
+        if len(idx) == 0:
+            return 0
+        a = self.clip_outflows(state.acc[:, t+1], paxAction, idx, pax=True)
+        paxAction[idx] = a
+        origin, destination = self.origin_idx[idx], self.destination_idx[idx]
+        origin_region, destination_region = self.origin_region[idx], self.destination_region[idx]
+        edge_time = self.edge_time[idx, t]
+        arrival_time = t + edge_time + scenario.time_normalizer
+
+        np.add.at(state.served_demand[:, t], self.od_idx[idx], a)
+        state.pax_flow[idx, t + edge_time] = a
+        self.schedule_arrivals(idx, t + edge_time)
+        operating_cost = (edge_time + scenario.time_normalizer)*scenario.operational_cost_per_timestep
+        env.info["operating_cost"] = sequential_sum(env.info["operating_cost"], operating_cost*a)
+        np.subtract.at(state.acc[:, t+1], origin, a)
+        np.subtract.at(state.acc_spatial[:, t+1], origin_region, a)
+        np.add.at(state.n_customer_vehicles_spatial[:, t+1], origin_region, a)
+        env.info['served_demand'] = sequential_sum(env.info['served_demand'], a)
+        np.add.at(state.dacc, (destination, arrival_time), a)
+        np.add.at(state.dacc_spatial, (destination_region, arrival_time), a)
+        edge_price = price[self.od_idx[idx]]
+        env.info['revenue'] = sequential_sum(env.info['revenue'], a*edge_price)
+        return sequential_sum(0, a*(edge_price - operating_cost))
+
+    def rebalance(self, rebAction):
+        env = self.env
+        state = env.state
+        scenario = env.scenario
+        t = env.time
+        assert (rebAction < state.acc[self.origin_idx, t+1] + 1e-3).all()
+        idx = np.flatnonzero(~(rebAction < 1e-3))
+        if len(idx) == 0:
+            return 0
+        a = self.clip_outflows(state.acc[:, t+1], rebAction, idx, pax=False)
+        rebAction[idx] = a
+        origin, destination = self.origin_idx[idx], self.destination_idx[idx]
+        origin_region, destination_region = self.origin_region[idx], self.destination_region[idx]
+        edge_time = self.edge_time[idx, t]
+        arrival_time = t + edge_time + scenario.time_normalizer
+
+        state.reb_flow[idx, t + edge_time] = a
+        self.schedule_arrivals(idx, t + edge_time)
+        np.add.at(state.dacc, (destination, arrival_time), a)
+        np.add.at(state.dacc_spatial, (destination_region, arrival_time), a)
+        np.subtract.at(state.acc[:, t+1], origin, a)
+        np.subtract.at(state.acc_spatial[:, t+1], origin_region, a)
+
+        positive = a > 0
+        charge = self.charge_edge[idx] & positive
+        road_charge = self.road_charge_edge[idx] & positive
+        road = self.road_edge[idx] & positive
+        charging = charge | road_charge
+        charge_time = self.charge_time[idx]
+        avg_energy_price = np.zeros(len(idx))
+        for duration in np.unique(charge_time[charging]):
+            avg_energy_price[charge_time == duration] = np.mean(scenario.p_energy[t:t+duration])
+        energy_cost = avg_energy_price * a * self.charge_difference[idx]
+        driving_cost = (edge_time + scenario.time_normalizer)*scenario.operational_cost_per_timestep*a
+        road_charge_driving_cost = (edge_time + scenario.time_normalizer - charge_time)*scenario.operational_cost_per_timestep*a
+
+        rebalancing_cost = np.zeros(len(idx))
+        rebalancing_cost[charge] = energy_cost[charge]
+        rebalancing_cost[road_charge] = road_charge_driving_cost[road_charge] + energy_cost[road_charge]
+        rebalancing_cost[road] = driving_cost[road]
+        reward_cost = np.zeros(len(idx))
+        reward_cost[charge] = energy_cost[charge]
+        reward_cost[road_charge] = energy_cost[road_charge] + road_charge_driving_cost[road_charge]
+        reward_cost[road] = driving_cost[road]
+        spatial = road_charge | road
+        env.info['rebalancing_cost'] = sequential_sum(env.info['rebalancing_cost'], rebalancing_cost[charging | road])
+        env.info['spatial_rebalancing_cost'] = sequential_sum(env.info['spatial_rebalancing_cost'], driving_cost[spatial])
+        env.info["operating_cost"] = sequential_sum(env.info["operating_cost"], driving_cost[spatial])
+        np.add.at(state.n_rebal_vehicles_spatial[:, t+1], origin_region[spatial], a[spatial])
+
+        # charging starts in the next timestep and occupies the station for charge_time steps
+        if charging.any():
+            regions, times, amounts = env.charger_occupancy.add(origin_region[charging], t+1, charge_time[charging], a[charging])
+            np.add.at(state.n_charging_vehicles_spatial, (regions, times), amounts)
+
+        return sequential_sum(0, reward_cost[charging | road], ufunc=np.subtract)
+
+    def arrive(self):
+        env = self.env
+        state = env.state
+        t = env.time
+        slot = t % self.arrival_slots
+        if len(self.arrivals[slot]) == 0:
+            return
+        queued = np.unique(np.concatenate(self.arrivals[slot]))
+        self.arrivals[slot] = []
+        reb_flow, pax_flow = state.reb_flow[queued, t], state.pax_flow[queued, t]
+        arriving = (reb_flow != 0) | (pax_flow != 0)
+        queued, reb_flow, pax_flow = queued[arriving], reb_flow[arriving], pax_flow[arriving]
+        if len(queued) == 0:
+            return
+        # rebalancing and passenger arrivals of an edge are added in that order, edge by edge
+        flows = np.stack((reb_flow, pax_flow), axis=1).reshape(-1)
+        np.add.at(state.acc[:, t+1], np.repeat(self.destination_idx[queued], 2), flows)
+        np.add.at(state.acc_spatial[:, t+1], np.repeat(self.destination_region[queued], 2), flows)
+        rebal = self.rebal_arrival_edge[queued]
+        np.subtract.at(state.n_rebal_vehicles_spatial[:, t+1], self.origin_region[queued[rebal]], reb_flow[rebal])
+        np.subtract.at(state.n_customer_vehicles_spatial[:, t+1], self.origin_region[queued], pax_flow)
@@ -0,0 +1,83 @@
+"""
+Topology Cache
+--------------
+This file contains the static graph tensors shared by all environments of a scenario. In particular, we implement:
+(1) Topology
+    Node / edge lists, edge_index tensors of the charge-augmented and the spatial graph, travel times [edge, t]
+    and, built on demand and cached, the padded travel-time edge features and block-diagonal batches of the GNN.
+(2) get_topology
+    Cache lookup keyed by a hash of the graphs (nodes, edges and travel times); graph objects seen before are
+    matched without hashing, so AMoD environments, resets, A2C.set_env and parser instances all reuse one Topology.
+"""
+import hashlib
+import weakref
+import numpy as np
+import torch
+
+_topologies = {}
+_topology_keys = weakref.WeakKeyDictionary()
+
+
+class Topology:
+    def __init__(self, G, G_spatial, tf):
+        self.nodes = list(G.nodes)
+        self.edges = list(G.edges)
+        self.nodes_spatial = list(G_spatial.nodes)
+        self.edges_spatial = list(G_spatial.edges)
+        node_index = {n: idx for idx, n in enumerate(self.nodes)}
+        node_spatial_index = {n: idx for idx, n in enumerate(self.nodes_spatial)}
+        self.edge_index = torch.tensor([[node_index[o] for o, d in self.edges], [node_index[d] for o, d in self.edges]],
+                                       dtype=torch.long).view(2, -1)
+        self.edge_index_spatial = torch.tensor([[node_spatial_index[o] for o, d in self.edges_spatial],
+                                                [node_spatial_index[d] for o, d in self.edges_spatial]], dtype=torch.long).view(2, -1)
+        # travel time of every edge at t = 0..tf as stored in G, [edge_idx, t]
+        self.edge_time = np.array([[G.edges[e]['time'][t] for t in range(tf + 1)] for e in self.edges], dtype=np.int64).reshape(-1, tf + 1)
+        self.key = topology_key(self.nodes, self.edges, self.edges_spatial, self.edge_time)
+        self.edge_attrs = {}
+        self.batches = {}
+
+    def edge_attr(self, input_size):
+        """
+        Travel-time edge features [E, input_size] of the MPNN: the travel times of every edge zero-padded to
+        input_size, laid out like the flat list built by the reference parser in tests/test_gnn_parser.py.
+        """
+        if input_size not in self.edge_attrs:
+            number_edges, columns = self.edge_time.shape
+            all_times = np.zeros((number_edges, max(input_size, columns)), dtype=np.int64)
+            all_times[:, :columns] = self.edge_time
+            self.edge_attrs[input_size] = torch.tensor(all_times.reshape(-1)).float().view(input_size, number_edges).T
+        return self.edge_attrs[input_size]
+
+    def batch(self, batch_size, input_size):
+        """
+        Block-diagonal edge_index, repeated edge_attr and node-to-graph index of batch_size copies of the graph.
+        """
+        if (batch_size, input_size) not in self.batches:
+            number_nodes = len(self.nodes)
+            offsets = torch.arange(batch_size, dtype=self.edge_index.dtype) * number_nodes
+            batch_edge_index = (self.edge_index.unsqueeze(0) + offsets.view(-1, 1, 1)).permute(1, 0, 2).reshape(2, -1)
+            batch = torch.arange(batch_size).repeat_interleave(number_nodes)
+            self.batches[batch_size, input_size] = (batch_edge_index, self.edge_attr(input_size).repeat(batch_size, 1), batch)
+        return self.batches[batch_size, input_size]
+
+
+def topology_key(nodes, edges, edges_spatial, edge_time):
+    digest = hashlib.sha1()
+    for values in (nodes, edges, edges_spatial):
+        digest.update(np.array(values, dtype=np.int64).tobytes())
+        digest.update(b';')
+    digest.update(edge_time.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def get_topology(G, G_spatial, tf):
+    """
+    The cached Topology of the graph G (with spatial graph G_spatial and episode length tf).
+    """
+    key = _topology_keys.get(G)
+    if key is not None and key[1] is G_spatial and key[2] == tf:
+        return _topologies[key[0]]
+    topology = Topology(G, G_spatial, tf)
+    topology = _topologies.setdefault(topology.key, topology)
+    _topology_keys[G] = (topology.key, G_spatial, tf)
+    return topology
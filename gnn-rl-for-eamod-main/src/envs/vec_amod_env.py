@@ -0,0 +1,75 @@
+"""
+Vectorized AMoD Environment
+---------------------------
+This file contains a batched version of the AMoD simulator. In particular, we implement:
+(1) VecAMoD
+    N independent AMoD episodes (each with its own demand Generator, see Scenario.sample_demand) whose
+    state lives in one stacked AMoDState of shape [N, *, horizon]. pax_step / reb_step advance all
+    episodes in one call, but step the envs one by one with their own StepEngine on their slice of the
+    stacked state; the stacking only gives batched consumers one array to read. Finished episodes are
+    reset automatically.
+"""
+import numpy as np
+from src.envs.amod_env import AMoD
+from src.envs.state_store import AMoDState
+
+
+class VecAMoD:
+    def __init__(self, scenario, n_envs=4, vectorized=True, seed=None):
+        self.n_envs = n_envs
+        # env i samples its demand from a Generator seeded with seed + i
+        self.envs = [AMoD(scenario, vectorized=vectorized, seed=None if seed is None else seed + i) for i in range(n_envs)]
+        # stacked state, env i works on the view self.state.view(i)
+        self.state = AMoDState.like(self.envs[0].state, batch_shape=(n_envs,))
+        for i, env in enumerate(self.envs):
+            env.bind_state(self.state.view(i))
+        self.tf = self.envs[0].tf
+        self.nodes = self.envs[0].nodes
+        self.edges = self.envs[0].edges
+        self.number_nodes = self.envs[0].number_nodes
+        self.number_nodes_spatial = self.envs[0].number_nodes_spatial
+        # episode counter per env, incremented on every (auto-)reset
+        self.episodes = np.zeros(n_envs, dtype=np.int64)
+        self.bool_sample_demand = True
+        self.obs = [env.obs for env in self.envs]
+
+    @property
+    def times(self):
+        return np.array([env.time for env in self.envs])
+
+    def reset(self, bool_sample_demand=True):
+        self.obs = [env.reset(bool_sample_demand) for env in self.envs]
+        self.bool_sample_demand = bool_sample_demand
+        return self.obs
+
+    def pax_step(self, paxActions=None, pax_flows_solvers=None):
+        """
+        paxActions: [N, E] passenger flows, or None to solve the matching problem with pax_flows_solvers[i].
+        Returns obs, rewards [N], dones [N], infos (one dict copy per env).
+        """
+        rewards = np.zeros(self.n_envs)
+        infos = []
+        for i, env in enumerate(self.envs):
+            if paxActions is None:
+                self.obs[i], rewards[i], _, info = env.pax_step(pax_flows_solver=pax_flows_solvers[i])
+            else:
+                self.obs[i], rewards[i], _, info = env.pax_step(paxAction=paxActions[i])
+            infos.append(dict(info))
+        return self.obs, rewards, np.zeros(self.n_envs, dtype=bool), infos
+
+    def reb_step(self, rebActions):
+        """
+        rebActions: [N, E] rebalancing flows.
+        Returns obs, rewards [N], dones [N], infos. Envs whose episode finished are reset before returning,
+        so obs[i] is then the first observation of the next episode.
+        """
+        rewards = np.zeros(self.n_envs)
+        dones = np.zeros(self.n_envs, dtype=bool)
+        infos = []
+        for i, env in enumerate(self.envs):
+            self.obs[i], rewards[i], dones[i], info = env.reb_step(rebActions[i])
+            infos.append(dict(info))
+            if dones[i]:
+                self.obs[i] = env.reset(self.bool_sample_demand)
+                self.episodes[i] += 1
+        return self.obs, rewards, dones, infos
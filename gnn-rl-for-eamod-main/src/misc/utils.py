@@ -12,4 +12,22 @@ def moving_average(a, n=3) :
     """
     ret = np.cumsum(a, dtype=float)
     ret[n:] = ret[n:] - ret[:-n]
-    return ret[n - 1:] / n
\ No newline at end of file
+    return ret[n - 1:] / n
+
+def desired_acc_from_action(env, action_rl):
+    """
+    Transforms a sample from the Dirichlet policy into integer vehicle counts per node that sum to the idle fleet.
+    Rounding leftovers are assigned to the most likely node.
+    """
+    total_idle_acc = sum(env.acc[n][env.time+1] for n in env.nodes)
+    desired_acc = {env.nodes[i]: int(action_rl[i] *total_idle_acc) for i in range(env.number_nodes)} # over nodes
+    total_desiredAcc = sum(desired_acc[n] for n in env.nodes)
+    missing_cars = total_idle_acc - total_desiredAcc
+    most_likely_node = np.argmax(action_rl)
+    if missing_cars != 0:
+        desired_acc[env.nodes[most_likely_node]] += missing_cars
+        total_desiredAcc = sum(desired_acc[n] for n in env.nodes)
+    assert abs(total_desiredAcc - total_idle_acc) < 1e-5
+    for n in env.nodes:
+        assert desired_acc[n] >= 0
+    return desired_acc
@@ -0,0 +1,17 @@
+"""
+Shared fixtures of the test suite: the bundled Toy and NY_5 scenarios, built from JSON rather than the compiled
+cache. Run from the repository root with `python -m pytest tests`.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import SCENARIOS, create_scenario, quiet
+
+
+@pytest.fixture(scope='session', params=list(SCENARIOS))
+def scenario(request):
+    json_file_path, energy_file_path = SCENARIOS[request.param]
+    return quiet(create_scenario, json_file_path, energy_file_path)
@@ -0,0 +1,56 @@
+from collections import defaultdict
+import numpy as np
+import pytest
+
+from src.envs.amod_env import AMoD
+
+
+def reset_loop(env, bool_sample_demand=True):
+    # reference of AMoD.reset, formerly AMoD.reset_loop: per-edge sampler Scenario.get_random_demand (global
+    # np.random) into demand / price dicts
+    env.demand = defaultdict(dict)  # demand
+    env.price = defaultdict(dict)  # price
+
+    tripAttr = env.scenario.get_random_demand(bool_sample_demand)
+    # trip attribute (origin, destination, time of request, demand, price)
+    for i, j, t, d, p in tripAttr:
+        env.demand[i, j][t] = d
+        env.price[i, j][t] = p
+    env.create_demand_arrays()
+
+    env.time = 0
+    env.reset_state()
+    env.obs = (env.acc, env.time, env.dacc, env.demand)
+    env.reward = 0
+    return env.obs
+
+
+def test_mean_demand_matches_loop(scenario):
+    env, reference = AMoD(scenario, seed=10), AMoD(scenario, seed=10)
+    env.reset(False)
+    reset_loop(reference, False)
+    np.testing.assert_array_equal(env.demand_array, reference.demand_array)
+    np.testing.assert_array_equal(env.price_array, reference.price_array)
+    np.testing.assert_array_equal(env.state.pack(), reference.state.pack())
+
+
+@pytest.mark.parametrize('seed', [10, 11])
+def test_sampled_demand_matches_loop(scenario, seed):
+    # the two samplers draw from different streams: same cells, same prices, Poisson totals around the same mean
+    env, reference = AMoD(scenario, seed=seed), AMoD(scenario, seed=seed)
+    env.reset(True)
+    np.random.seed(seed)
+    reset_loop(reference, True)
+    mean = AMoD(scenario, seed=seed)
+    mean.reset(False)
+    np.testing.assert_array_equal(env.price_array, reference.price_array)
+    for demand in (env.demand_array, reference.demand_array):
+        assert (demand >= 0).all() and (demand == np.round(demand)).all()
+        assert (demand[mean.demand_array == 0] == 0).all()
+        total = mean.demand_array.sum()
+        assert abs(demand.sum() - total) < 6 * np.sqrt(total)
+    np.testing.assert_array_equal(env.state.pack(), reference.state.pack())
+    # the Generator of the environment is independent of the global random state
+    state = np.random.get_state()
+    env.reset(True)
+    assert np.random.get_state()[1].tolist() == state[1].tolist()
@@ -0,0 +1,72 @@
+import numpy as np
+import torch
+import pytest
+from torch_geometric.data import Data
+
+from src.envs.amod_env import AMoD
+from src.algos.a2c_gnn import A2C
+from src.algos.pax_flows_solver import GreedyPaxFlowsSolver
+from src.algos.reb_flow_solver import RebalFlowSolver
+from src.misc.utils import desired_acc_from_action
+
+
+def parse_obs_loop(parser):
+    # per-node reference of GNNParser.parse_obs, formerly GNNParser.parse_obs_loop (nested comprehensions over
+    # nodes x T x regions)
+    env = parser.env
+    x = torch.cat((
+        torch.tensor([float(n[1])/env.scenario.number_charge_levels for n in env.nodes]
+                     ).view(1, 1, env.number_nodes).float(),
+        torch.tensor([env.acc[n][env.time+1]*parser.scale_factor for n in env.nodes]
+                     ).view(1, 1, env.number_nodes).float(),
+        torch.tensor([[(env.acc[n][env.time+1] + env.dacc[n][t])*parser.scale_factor for n in env.nodes]
+                      for t in range(env.time+1, env.time+parser.T+1)]).view(1, parser.T, env.number_nodes).float(),
+        torch.tensor([[sum([env.price[o[0], j][t] * parser.scale_factor * parser.price_scale_factor * (env.demand[o[0], j][t])*((o[1]-env.scenario.energy_distance[o[0], j]) >= int(not env.scenario.charging_stations[j]))
+                      for j in env.region]) for o in env.nodes] for t in range(env.time+1, env.time+parser.T+1)]).view(1, parser.T, env.number_nodes).float()),
+                  dim=1).squeeze(0).view(parser.input_size, env.number_nodes).T
+    edge_index = env.gcn_edge_idx
+    # edge_weight = env.edge_weight
+
+    # edge features for MPNN implementation
+    all_times = []
+    # Loop over edges, get 'time' values for each edge, and add to 'all_times' list.
+    edges = env.edges
+    for e in edges:
+        if e in env.edges:
+            times_for_e = env.edge_time[env.edges.index(e)].tolist()
+        else:
+            times_for_e = [0]
+        while (len(times_for_e) < parser.input_size):
+            times_for_e.append(0)
+        all_times.extend(times_for_e)
+    # Convert the list of 'time' values into a tensor.
+    tensor = torch.tensor(all_times)
+    e = (tensor.view(1, np.prod(tensor.shape)).float()).squeeze(0).view(parser.input_size, len(edges)).T
+
+    data = Data(x, edge_index, edge_attr=e)
+    return data
+
+
+@pytest.mark.parametrize('seed', [10, 11])
+def test_parse_obs_matches_loop(scenario, seed):
+    # the array parser has to return exactly the tensors of the per-node reference on every step of an episode
+    env = AMoD(scenario, seed=seed)
+    env.reset(True)
+    model = A2C(env=env, T=10, seed=seed)
+    rng = np.random.default_rng(seed)
+    greedy = GreedyPaxFlowsSolver(env, backend='highs')
+    for step in range(env.tf):
+        if step > 0:
+            greedy.update_constraints()
+            greedy.update_objective()
+        env.pax_step(paxAction=greedy.optimize())
+
+        data, reference = model.parse_obs(), parse_obs_loop(model.obs_parser)
+        assert torch.equal(data.x, reference.x)
+        assert torch.equal(data.edge_index, reference.edge_index)
+        assert torch.equal(data.edge_attr, reference.edge_attr)
+
+        desired_acc = desired_acc_from_action(env, rng.dirichlet(np.ones(env.number_nodes)))
+        _, _, done, _ = env.reb_step(RebalFlowSolver(env=env, desiredAcc=desired_acc, backend='highs').optimize())
+        if done:
+            break
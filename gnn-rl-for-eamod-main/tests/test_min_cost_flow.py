@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from src.envs.amod_env import AMoD
+from src.algos.pax_flows_solver import GreedyPaxFlowsSolver
+from src.algos.min_cost_flow import MinCostRebalFlowSolver
+from src.algos.reb_flow_solver import RebalFlowSolver
+from src.misc.utils import desired_acc_from_action
+
+
+@pytest.mark.parametrize('seed', [10, 11])
+def test_min_cost_flow_matches_lp_optimum(scenario, seed):
+    # the LP (RebalFlowSolver on HiGHS) is the oracle of the transportation flow and of MinCostRebalFlowSolver
+    env = AMoD(scenario, seed=seed)
+    env.reset(True)
+    rng = np.random.default_rng(seed)
+    greedy = GreedyPaxFlowsSolver(env, backend='highs')
+    mcf = None
+    for step in range(env.tf):
+        if step > 0:
+            greedy.update_constraints()
+            greedy.update_objective()
+        env.pax_step(paxAction=greedy.optimize())
+
+        desired_acc = desired_acc_from_action(env, rng.dirichlet(np.ones(env.number_nodes)))
+        if mcf is None:
+            mcf = MinCostRebalFlowSolver(env, desired_acc, backend='highs')
+        else:
+            mcf.update_constraints(desired_acc, env)
+            mcf.update_objective(env)
+        lp_flow = RebalFlowSolver(env=env, desiredAcc=desired_acc, backend='highs').optimize()
+        lp_value = mcf.objective(lp_flow)
+
+        # without the charger capacities the transportation flow is a lower bound, and optimal if it respects them
+        flow = mcf.transport.solve(mcf.acc, mcf.desired, mcf.cost)
+        assert (flow >= 0).all()
+        assert mcf.objective(flow) <= lp_value * (1 + 1e-9) + 1e-9
+        charged = np.array([flow[env.map_region_to_charge_edges[r_idx]].sum() for r_idx in range(env.number_nodes_spatial)])
+        if not mcf.capacity_may_bind():
+            assert (charged <= mcf.charge_capacity + 1e-7).all()
+        if (charged <= mcf.charge_capacity + 1e-7).all():
+            assert mcf.objective(flow) == pytest.approx(lp_value, rel=1e-9, abs=1e-9)
+
+        rebal_flow = mcf.optimize()
+        assert mcf.objective(rebal_flow) == pytest.approx(lp_value, rel=1e-9, abs=1e-9)
+        _, _, done, _ = env.reb_step(rebal_flow)
+        if done:
+            break
+    assert mcf.steps == step + 1
@@ -0,0 +1,166 @@
+import math
+import os
+import sys
+from collections import defaultdict
+import numpy as np
+import pytest
+
+gp = pytest.importorskip('gurobipy')
+
+from src.envs.amod_env import AMoD
+from benchmarks.common import ROOT, SCENARIOS, create_scenario, quiet
+
+MPC_PATH = os.path.join(ROOT, 'mpc_baselines')
+if MPC_PATH not in sys.path:
+    # appended, so `src` still resolves to this repository's simulator
+    sys.path.append(MPC_PATH)
+from MPC_gurobi import WARM_STARTS, RollingHorizonMPC, build_mpc_model, charger_occupancy, optimize_mpc_model, solve_mpc
+
+MPC_HORIZON = 6
+
+
+def build_mpc_model_loop(env, gurobi_env, mpc_horizon):
+    # per-term reference of build_mpc_model, formerly MPC_gurobi.solve_mpc_loop: builds the same model expression
+    # by expression and returns it unsolved with its pax_flow / rebal_flow variables
+    time = env.time
+    discount_factor = 0.99
+    if mpc_horizon+time >= env.tf:
+        discount_factor = 1
+    m = gp.Model(env=gurobi_env)
+    dacc = defaultdict(dict) # should be all zeros at the start
+    acc = defaultdict(dict)
+    for n in env.nodes:
+        dacc[n] = defaultdict(int)
+        acc[n] = defaultdict(int)
+        acc[n][0] = env.acc[n][time]
+        for t in range(int(mpc_horizon*2)):
+            dacc[n][t] = 0
+    pax_flow = m.addMVar(shape=(mpc_horizon, len(env.edges)), lb=0.0, ub=gp.GRB.INFINITY, vtype=gp.GRB.CONTINUOUS, name="pax_flow")
+    rebal_flow = m.addMVar(shape=(mpc_horizon, len(env.edges)), lb=0.0, ub=gp.GRB.INFINITY, vtype=gp.GRB.CONTINUOUS, name="rebal_flow")
+    charging_cars_per_location = defaultdict(dict)
+    occupancy = charger_occupancy(env, time + 1, mpc_horizon)
+    for n in env.nodes_spatial:
+        charging_cars_per_location[n] = defaultdict(float, enumerate(occupancy[n].tolist()))
+    for t in range(mpc_horizon):
+        for o in env.region:
+            for d in env.region:
+                # Constraint: no more passenger flow than demand on pax edges
+                m.addConstr(
+                    sum(pax_flow[t, env.map_o_d_regions_to_pax_edges[(o,d)]]) <= env.demand[o, d][t + time]
+                )
+        # pax flow should be zero on rebal edges
+        m.addConstr(
+                    sum(pax_flow[t, env.charging_edges]) == 0
+                )
+        for n in env.nodes:
+            outgoing_edges = env.map_node_to_outgoing_edges[n]
+            
+            # Constraint: We can not have more vehicles flowing out of a node, than vehicles at the node
+            m.addConstr(
+                sum(rebal_flow[t, outgoing_edges]) +  sum(pax_flow[t, outgoing_edges]) <= acc[n][t] 
+            )
+            for e in outgoing_edges:
+                o_node, d_node = env.edges[e]
+                # add incoming flow from earlier optimizations -> should be stored in rebal_flow and pax_flow
+                # only relevant if we do not solve everything as one optimization
+                if mpc_horizon < env.tf:
+                    if env.rebFlow[o_node,d_node][t + time] != 0.0:
+                        dacc[d_node][t+1] += env.rebFlow[o_node,d_node][t + time]
+                    if env.paxFlow[o_node,d_node][t + time] != 0.0:
+                        dacc[d_node][t+1] += env.paxFlow[o_node,d_node][t + time]
+                # regular opimization
+                dacc[d_node][t+env.G.edges[o_node,d_node]['time'][t + time]] += pax_flow[t,e] + rebal_flow[t,e] # adding one because of design decision to appear later
+                # charge station constraint
+                if d_node[1] > o_node[1] or (o_node[1] - env.scenario.energy_distance[o_node[0], d_node[0]] < d_node[1] and o_node[0] != d_node[0]):
+                    # Constraint: no more charging vehicles than there are charging stations
+                    m.addConstr(
+                        charging_cars_per_location[o_node[0]][t] + rebal_flow[t,e] <= env.scenario.cars_per_station_capacity[o_node[0]]
+                    )
+
+                    if d_node[1] > o_node[1] and o_node[0] == d_node[0]:
+                        change_dist = d_node[1] - o_node[1]
+                    else:
+                        change_dist = d_node[1] - o_node[1] + env.scenario.energy_distance[o_node[0], d_node[0]]
+                    
+                    time_spent_charging = math.ceil(change_dist/env.scenario.charge_levels_per_charge_step)
+                    # add plus one because range creates values from [begin,end)
+                    for future_time_step in range(t,t+time_spent_charging):
+                        charging_cars_per_location[o_node[0]][future_time_step] = charging_cars_per_location[o_node[0]][future_time_step] + rebal_flow[t,e] 
+            
+        
+        for n in env.nodes:
+            outgoing_edges = env.map_node_to_outgoing_edges[n]
+            acc[n][t+1] = acc[n][t] + dacc[n][t] - sum(rebal_flow[t, outgoing_edges]) - sum(pax_flow[t, outgoing_edges]) 
+
+
+    obj = 0
+    for t in range(mpc_horizon):
+        for e in range(len(env.edges)):
+            o_node,d_node = env.edges[e]
+            o_region = o_node[0]
+            d_region = d_node[0]
+            charge_cost = 0
+            charge_time = 0
+            if d_node[1]>=o_node[1] and o_region != o_region:
+                charge_diff = d_node[1] - o_node[1] + env.scenario.energy_distance[o_region,d_region]
+                charge_time = math.ceil(charge_diff/env.scenario.charge_levels_per_charge_step)
+                avg_price = np.mean(env.scenario.p_energy[time+t:time+t+charge_time])
+                charge_cost = avg_price*charge_diff*rebal_flow[t,e]
+            elif d_node[1]>o_node[1]:
+                charge_diff = d_node[1] - o_node[1]
+                charge_time = math.ceil(charge_diff/env.scenario.charge_levels_per_charge_step)
+                avg_price = np.mean(env.scenario.p_energy[time+t:time+t+charge_time])
+                charge_cost = avg_price*charge_diff*rebal_flow[t,e]
+            obj += (discount_factor**t) * pax_flow[t,e]*env.price[o_region,d_region][t + time] - env.scenario.operational_cost_per_timestep * (rebal_flow[t,e] + pax_flow[t,e]) * (env.G.edges[o_node,d_node]['time'][t + time]+env.scenario.time_normalizer - charge_time) - charge_cost
+    m.setObjective(obj, gp.GRB.MAXIMIZE)
+    m.update()
+    return m, pax_flow, rebal_flow
+
+
+@pytest.fixture(scope='module')
+def gurobi_env():
+    try:
+        env = gp.Env(params={'OutputFlag': 0, 'Threads': 1})
+    except gp.GurobiError as error:
+        pytest.skip(f"no Gurobi license: {error}")
+    yield env
+    env.dispose()
+
+
+def test_mpc_model_matches_loop(gurobi_env):
+    # Toy keeps the horizon model within the size limit of a restricted Gurobi license
+    env = AMoD(quiet(create_scenario, *SCENARIOS['Toy']), seed=10)
+    env.reset(True)
+    for step in range(env.tf - MPC_HORIZON + 1):
+        m, pax_flow, rebal_flow = build_mpc_model_loop(env, gurobi_env, MPC_HORIZON)
+        columns = [v.index for v in pax_flow.reshape(-1).tolist() + rebal_flow.reshape(-1).tolist()]
+        A, sense, rhs, obj = build_mpc_model(env, MPC_HORIZON)
+        assert (m.getA()[:, columns] != A).nnz == 0
+        np.testing.assert_array_equal(np.array(m.getAttr('Sense', m.getConstrs())), np.asarray(sense))
+        np.testing.assert_array_equal(np.array(m.getAttr('RHS', m.getConstrs())), rhs)
+        np.testing.assert_array_equal(np.array(m.getAttr('Obj', m.getVars()))[columns], obj)
+
+        m.optimize()
+        assert m.status == gp.GRB.OPTIMAL
+        for backend in ('gurobi', 'highs'):
+            _, pax, rebal = optimize_mpc_model(A, sense, rhs, obj, MPC_HORIZON, len(env.edges), gurobi_env, backend)
+            assert obj @ np.concatenate((pax.ravel(), rebal.ravel())) == pytest.approx(m.ObjVal, rel=1e-7)
+
+        pax, rebal = solve_mpc(env, gurobi_env, MPC_HORIZON)
+        env.pax_step(paxAction=pax[0])
+        env.reb_step(rebal[0])
+
+
+@pytest.mark.parametrize('warm_start', WARM_STARTS)
+def test_rolling_horizon_matches_solve_mpc(gurobi_env, warm_start):
+    # the persistent model reaches the optimum of a fresh solve_mpc model in every window, whatever its start
+    env = AMoD(quiet(create_scenario, *SCENARIOS['Toy']), seed=10)
+    env.reset(True)
+    rolling = RollingHorizonMPC(env, gurobi_env, MPC_HORIZON, warm_start=warm_start)
+    for step in range(env.tf - MPC_HORIZON + 1):
+        _, _, _, obj = build_mpc_model(env, MPC_HORIZON)
+        rolling_pax, rolling_rebal = rolling.solve()
+        pax, rebal = solve_mpc(env, gurobi_env, MPC_HORIZON)
+        assert obj @ np.concatenate((rolling_pax.ravel(), rolling_rebal.ravel())) == pytest.approx(obj @ np.concatenate((pax.ravel(), rebal.ravel())), rel=1e-9)
+        env.pax_step(paxAction=pax[0])
+        env.reb_step(rebal[0])
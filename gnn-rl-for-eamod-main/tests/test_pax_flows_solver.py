@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from src.envs.amod_env import AMoD
+from src.algos.pax_flows_solver import GreedyPaxFlowsSolver
+from src.algos.min_cost_flow import make_rebal_flow_solver
+from src.misc.utils import desired_acc_from_action
+
+
+def assert_feasible(env, flow, tol=1e-9):
+    t = env.time
+    assert (flow >= 0).all()
+    for n in env.nodes:
+        outflow = flow[env.map_node_to_outgoing_edges[n]].sum()
+        assert outflow <= env.state.acc[env.node_index[n], t] + tol
+    for o in env.region:
+        for d in env.region:
+            assert flow[env.map_o_d_regions_to_pax_edges[(o, d)]].sum() <= env.demand_array[o, d, t] + tol
+
+
+@pytest.mark.parametrize('seed', [10, 11])
+def test_greedy_matches_lp_optimum(scenario, seed):
+    # the LP (PaxFlowsSolver on HiGHS) is the oracle of the greedy matching on every step of a sampled episode
+    env = AMoD(scenario, seed=seed)
+    env.reset(True)
+    greedy = GreedyPaxFlowsSolver(env, backend='highs')
+    uniform = np.ones(env.number_nodes) / env.number_nodes
+    rebal_flow_solver = None
+    for step in range(env.tf):
+        flow = greedy.optimize()
+        assert_feasible(env, flow)
+        greedy_value, lp_value = greedy.verify(flow, rtol=1e-9)
+        assert greedy_value == pytest.approx(lp_value, rel=1e-9, abs=1e-9)
+        env.pax_step(paxAction=flow)
+
+        desired_acc = desired_acc_from_action(env, uniform)
+        if rebal_flow_solver is None:
+            rebal_flow_solver = make_rebal_flow_solver('lp', env, desired_acc, backend='highs')
+        else:
+            rebal_flow_solver.update_constraints(desired_acc, env)
+            rebal_flow_solver.update_objective(env)
+        _, _, done, _ = env.reb_step(rebal_flow_solver.optimize())
+        if done:
+            break
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+import torch
+
+from src.algos.rollout_buffer import RolloutBuffer, discounted_returns
+
+
+def test_add_reward_closes_the_last_step():
+    buffer = RolloutBuffer(number_nodes=3, input_size=4, capacity=2)
+    with pytest.raises(AssertionError):
+        # nothing stored yet, the reward must not land in the last preallocated slot
+        buffer.add_reward(1., True)
+    assert not buffer.dones.any() and (buffer.rewards == 0).all()
+    for step in range(3):
+        buffer.add(torch.full((3, 4), float(step)), torch.ones(3) / 3)
+        buffer.add_reward(step + 1., step == 2)
+    assert len(buffer) == 3
+    assert buffer.rewards[:3].tolist() == [1., 2., 3.]
+    assert buffer.dones[:3].tolist() == [False, False, True]
+    np.testing.assert_allclose(discounted_returns(buffer.rewards[:3].numpy(), buffer.dones[:3].numpy(), 0.5), [2.75, 3.5, 3.])
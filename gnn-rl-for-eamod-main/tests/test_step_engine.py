@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from src.envs.amod_env import AMoD
+from src.algos.pax_flows_solver import GreedyPaxFlowsSolver
+from src.algos.reb_flow_solver import RebalFlowSolver
+from src.misc.utils import desired_acc_from_action
+
+
+def assert_same_step(vectorized, loop, result_vectorized, result_loop):
+    _, reward_vectorized, done_vectorized, info_vectorized = result_vectorized
+    _, reward_loop, done_loop, info_loop = result_loop
+    assert reward_vectorized == reward_loop
+    assert done_vectorized == done_loop
+    assert info_vectorized == info_loop
+    assert vectorized.time == loop.time
+    np.testing.assert_array_equal(vectorized.state.pack(), loop.state.pack())
+
+
+@pytest.mark.parametrize('seed', [10, 11])
+def test_vectorized_step_matches_loops(scenario, seed):
+    # StepEngine (serve_passengers / rebalance / arrive) has to reproduce the per-edge loops bit-for-bit
+    vectorized = AMoD(scenario, vectorized=True, seed=seed)
+    loop = AMoD(scenario, vectorized=False, seed=seed)
+    vectorized.reset(True)
+    loop.reset(True)
+    np.testing.assert_array_equal(vectorized.demand_array, loop.demand_array)
+    np.testing.assert_array_equal(vectorized.state.pack(), loop.state.pack())
+
+    rng = np.random.default_rng(seed)
+    greedy = GreedyPaxFlowsSolver(vectorized, backend='highs')
+    for step in range(vectorized.tf):
+        if step > 0:
+            greedy.update_constraints()
+            greedy.update_objective()
+        pax_action = greedy.optimize()
+        assert_same_step(vectorized, loop, vectorized.pax_step(paxAction=pax_action), loop.pax_step(paxAction=list(pax_action)))
+
+        desired_acc = desired_acc_from_action(vectorized, rng.dirichlet(np.ones(vectorized.number_nodes)))
+        reb_action = RebalFlowSolver(env=vectorized, desiredAcc=desired_acc, backend='highs').optimize()
+        result_vectorized = vectorized.reb_step(reb_action)
+        assert_same_step(vectorized, loop, result_vectorized, loop.reb_step(list(reb_action)))
+        if result_vectorized[2]:
+            break
@@ -0,0 +1,54 @@
+import numpy as np
+
+from src.envs.amod_env import AMoD
+from src.envs.vec_amod_env import VecAMoD
+from src.algos.pax_flows_solver import GreedyPaxFlowsSolver
+from src.algos.reb_flow_solver import RebalFlowSolver
+from src.misc.utils import desired_acc_from_action
+
+
+def test_vec_env_matches_single_envs(scenario, seed=10):
+    # env i of the batch behaves like AMoD(seed=seed + i) on its slice of the stacked state, and is reset when
+    # its episode ends
+    n_envs = 3
+    vec = VecAMoD(scenario, n_envs=n_envs, seed=seed)
+    envs = [AMoD(scenario, seed=seed + i) for i in range(n_envs)]
+    vec.reset(True)
+    for env in envs:
+        env.reset(True)
+    for i, env in enumerate(envs):
+        assert np.shares_memory(vec.envs[i].state.acc, vec.state.acc)
+        np.testing.assert_array_equal(vec.envs[i].demand_array, env.demand_array)
+    assert not np.array_equal(vec.envs[0].demand_array, vec.envs[1].demand_array)
+
+    rng = np.random.default_rng(seed)
+    greedy = [GreedyPaxFlowsSolver(env, backend='highs') for env in vec.envs]
+    for step in range(vec.tf):
+        if step > 0:
+            for solver in greedy:
+                solver.update_constraints()
+                solver.update_objective()
+        pax_actions = [solver.optimize() for solver in greedy]
+        _, rewards, _, infos = vec.pax_step(paxActions=pax_actions)
+        for i, env in enumerate(envs):
+            _, reward, _, info = env.pax_step(paxAction=pax_actions[i])
+            assert rewards[i] == reward and infos[i] == info
+
+        reb_actions = []
+        for env in vec.envs:
+            desired_acc = desired_acc_from_action(env, rng.dirichlet(np.ones(env.number_nodes)))
+            reb_actions.append(RebalFlowSolver(env=env, desiredAcc=desired_acc, backend='highs').optimize())
+        _, rewards, dones, infos = vec.reb_step(reb_actions)
+        for i, env in enumerate(envs):
+            _, reward, done, info = env.reb_step(reb_actions[i])
+            assert rewards[i] == reward and infos[i] == info and dones[i] == done
+            if not done:
+                np.testing.assert_array_equal(vec.state.pack()[i], env.state.pack())
+    assert dones.all()
+
+    # auto-reset: the next episode's demand continues each env's Generator, the state starts over
+    assert (vec.episodes == 1).all() and (vec.times == 0).all()
+    for i, env in enumerate(envs):
+        env.reset(True)
+        np.testing.assert_array_equal(vec.envs[i].demand_array, env.demand_array)
+        np.testing.assert_array_equal(vec.state.pack()[i], env.state.pack())
@@ -11,6 +11,7 @@ import os
 import wandb
 
 from src.envs.amod_env import Scenario, AMoD
+from src.envs.scenario_cache import load_or_create_scenario
 from src.algos.a2c_gnn import A2C
 from src.algos.reb_flow_solver import solveRebFlow
 from src.misc.utils import dictsum
@@ -57,7 +58,7 @@ def train(subproblem=0, episodes=20, seed=10, test=False):
         problem_folder = 'Toy'
         file_path = os.path.join('data', problem_folder, 'scenario_test_3_2.json')
         energy_dist_path = os.path.join('data', problem_folder,  'energy_distance_3x2.npy')
-        scenario = create_scenario(file_path, energy_dist_path, seed=seed)
+        scenario = load_or_create_scenario(create_scenario, file_path, energy_dist_path, seed=seed)
         env = AMoD(scenario, beta=0.5)
         training_environments.append(env)
         